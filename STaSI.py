@@ -5,13 +5,19 @@ The Journal of Physical Chemistry Letters 2014 5 (18), 3157-3161
 DOI: 10.1021/jz501435p
 '''
 
+import os
 import numpy as np
 from itertools import combinations
+from functools import partial
+from multiprocessing import Pool
 import pandas as pd
 
 __author__ = "Tobias Bartsch"
 __email__ = "tobias-bartsch@gmx.net"
 
+#t-test threshold of a transition (see _findTransitionPoint)
+THRESHOLD = 3.174
+
 
 def w1(timeseries):
     '''Compute w1, the Haar wavelet transform of the lowest scale.
@@ -33,11 +39,16 @@ def sdevFromW1(w1):
         return 0
 
 
-def fitSTaSIModel(data):
+def fitSTaSIModel(data, return_fit=True, processes=1, tolerance=None):
     '''fits the STaSI model to the data
     
     Args:
         data (np.array): the time series
+        return_fit (bool): if False, do not compute the fit function of the best model (fit is None)
+        processes (int): number of worker processes for segmentizing long time series (see segmentizeDataParallel).
+                         1 segmentizes in this process, None uses one process per core.
+        tolerance (int): if given, find the transitions approximately on medians of bins of this many points
+                         (see segmentizeDataApproximate). Exact if None.
     Returns:
         (fit (np.array), means (list), results (pd.DataFrame), MDLs): 
                                         fit: best fit to the data
@@ -53,15 +64,187 @@ def fitSTaSIModel(data):
     if sigma == 0:
         print("we can't fit this because we can't get a decent sdev")
         return (None, None, None, None, None)
-    segindices = segmentizeData(data, sigma)
+    if tolerance is not None:
+        segindices = segmentizeDataApproximate(data, sigma, tolerance)
+    elif processes == 1:
+        segindices = segmentizeData(data, sigma)
+    else:
+        segindices = segmentizeDataParallel(data, sigma, processes)
+    return _poolAndSelect(data, segindices, return_fit)
+
+def _poolAndSelect(data, segindices, return_fit=True):
+    #pool the segments into states and pick the best model. Returns the same as fitSTaSIModel
     states = makeStates(data, segindices)
     means, sdevs = getMeansOfStates(data, segindices, states)
-    fits = getFitFunctions(segindices, states, means)
-    MDLs = MDL(data, fits, segindices, states)
+    MDLs = segmentMDL(data, segindices, states, means)
     best_fit = np.argmin(MDLs)
 
-    numstates_best = np.max(states[best_fit])
-    return fits[best_fit], means[best_fit], sdevs[best_fit], _segsAndMeans(segindices, states[best_fit], means[best_fit], sdevs[best_fit]), np.asarray(MDLs)
+    if return_fit:
+        fit = getFitFunctions(segindices, [states[best_fit]], [means[best_fit]])[0]
+    else:
+        fit = None
+    return fit, means[best_fit], sdevs[best_fit], _segsAndMeans(segindices, states[best_fit], means[best_fit], sdevs[best_fit]), MDLs
+
+class IncrementalSTaSI:
+    """STaSI fit of a time series that grows at its end (and may lose points at its beginning),
+    e.g. the transit times of a segment over the last 60 days.
+
+    The segmentation of the previous update is kept. New points are only tested for transitions together with
+    the trailing segment(s); the state pooling and MDL selection are then redone for the whole series.
+    We fall back to a full fit (fitSTaSIModel) if the series changed in any other way than at its ends, or if it drifted:
+    the noise changed by more than drift_tolerance, or the last kept transition is no longer significant.
+    """
+
+    def __init__(self, retest=1, drift_tolerance=0.25, threshold=THRESHOLD):
+        '''Create an IncrementalSTaSI
+
+        Args:
+            retest (int): number of trailing segments to test for transitions again together with the new points
+            drift_tolerance (float): refit everything if the standard deviation of the data changes by more than
+                                     this fraction
+            threshold (float): t-test threshold of a transition (see _findTransitionPoint)
+        '''
+        self.retest = retest
+        self.drift_tolerance = drift_tolerance
+        self.threshold = threshold
+        self.data = None #the series of the last update
+        self.index = None #labels (e.g. time stamps) of its points
+        self.sigma = None
+        self.segmentindices = None
+        self.full_fits = 0 #number of updates that had to fit everything
+        self.incremental_fits = 0
+
+    def update(self, data, index=None, return_fit=True):
+        '''fit the current series
+
+        Args:
+            data (np.array): the whole current time series
+            index (np.array): increasing labels of the points of data (e.g. time stamps). They tell us how many
+                              points at the beginning of the previous series were dropped. If None, data must
+                              start with the previous series.
+            return_fit (bool): see fitSTaSIModel
+        Returns:
+            the same as fitSTaSIModel
+        '''
+        data = np.asarray(data)
+        if index is None:
+            index = np.arange(len(data))
+        index = np.asarray(index)
+        segindices = self._updateSegmentation(data, index)
+        if segindices is None:
+            return self._fullFit(data, index, return_fit)
+        self.incremental_fits += 1
+        self.data = np.array(data) #a copy: the caller may change data
+        self.index = index
+        self.segmentindices = segindices
+        return _poolAndSelect(data, segindices, return_fit)
+
+    def _fullFit(self, data, index, return_fit):
+        #like fitSTaSIModel, but keep the segmentation
+        self.full_fits += 1
+        self.data = None
+        if len(data) < 2 or sdevFromW1(w1(data)) == 0:
+            return fitSTaSIModel(data, return_fit)
+        self.data = np.array(data) #a copy: the caller may change data
+        self.index = index
+        self.sigma = sdevFromW1(w1(data))
+        self.segmentindices = segmentizeData(data, self.sigma)
+        return _poolAndSelect(data, self.segmentindices, return_fit)
+
+    def _updateSegmentation(self, data, index):
+        '''the segment indices of data, derived from the previous segmentation. None if we need a full fit.'''
+        if self.data is None or len(data) < 2:
+            return None
+        N_old = len(self.data)
+        drop = np.searchsorted(self.index, index[0]) #points that are no longer part of the series
+        kept = N_old - drop
+        if kept < 2 or kept > len(data) \
+                or not np.array_equal(self.index[drop:], index[:kept]) \
+                or not np.array_equal(self.data[drop:], data[:kept]):
+            return None
+        sigma = sdevFromW1(w1(data))
+        if sigma == 0 or abs(sigma - self.sigma) > self.drift_tolerance * self.sigma:
+            return None
+
+        #segments of the previous series that are left (the first one may be shorter now)
+        segindices = [0] + [s - drop for s in self.segmentindices[1:-1] if s - drop > 0]
+        #test the trailing segments and the new points for transitions
+        first_retested = max(len(segindices) - self.retest, 0)
+        start = segindices[first_retested]
+        trailing = segmentizeData(data[start:], sigma)
+        segindices = segindices[:first_retested] + [start + int(s) for s in trailing]
+        if first_retested > 0 and not self._significant(data, segindices, first_retested, sigma):
+            return None
+        self.sigma = sigma
+        return segindices
+
+    def _significant(self, data, segindices, position, sigma):
+        #whether the transition at segindices[position] is still significant between its neighboring transitions
+        start = segindices[position-1]
+        end = segindices[position+1]
+        return _tTest(data[start:end], segindices[position] - start, sigma) > self.threshold
+
+def fitSTaSIModels(series, processes=None, key_names=None, MDLs=None, tolerance=None):
+    '''fits the STaSI model to many time series, in parallel
+
+    Args:
+        series (dict): keys identify the time series (e.g. (line_id, direction, origin_id, dest_id)),
+                       vals are the time series (np.array)
+        processes (int): number of worker processes. One per core if None; 1 fits in this process.
+        key_names (list of string): names of the parts of tuple keys. If given, the keys are split
+                                    into these columns of results. Otherwise results has a column 'key'.
+        MDLs (dict): if given, the MDL curves of the fitted series are stored in it (keys: keys of series)
+        tolerance (int): if given, fit approximately on bins of this many points (see fitSTaSIModel)
+    Returns:
+        (results (pd.DataFrame), errors (dict)):
+                                        results: the tables of _segsAndMeans of all time series
+                                                 (columns start, stop, median, sdev, state), with the key of each series.
+                                        errors: keys of the series that could not be fitted: description of the problem
+    '''
+    #start with the longest series, so that no long fit is left over at the end while the other workers are idle
+    items = sorted(series.items(), key=lambda item: len(item[1]), reverse=True)
+    fitOne = partial(_fitOneSeries, tolerance=tolerance)
+    if processes == 1 or len(items) < 2:
+        outputs = [fitOne(item) for item in items]
+    else:
+        with Pool(processes) as pool:
+            outputs = list(pool.imap_unordered(fitOne, items))
+
+    tables = []
+    errors = {}
+    position = {key: i for i, (key, _) in enumerate(series.items())}
+    for key, table, MDL_curve, error in sorted(outputs, key=lambda output: position[output[0]]): #in the order of series
+        if error is not None:
+            errors[key] = error
+            continue
+        if MDLs is not None:
+            MDLs[key] = MDL_curve
+        if key_names is None:
+            table.insert(0, 'key', [key] * len(table))
+        else:
+            for i, name in enumerate(key_names):
+                table.insert(i, name, key[i])
+        tables.append(table)
+    if key_names is None:
+        key_names = ['key']
+    columns = list(key_names) + ['start', 'stop', 'median', 'sdev', 'state']
+    if not tables:
+        return pd.DataFrame(columns=columns), errors
+    return pd.concat(tables, ignore_index=True)[columns], errors
+
+def _fitOneSeries(item, tolerance=None):
+    #fit one (key, time series) pair of fitSTaSIModels. Returns (key, table, MDLs, error)
+    key, data = item
+    data = np.asarray(data)
+    if len(data) < 2:
+        return key, None, None, 'fewer than 2 data points'
+    try:
+        _, _, _, table, MDLs = fitSTaSIModel(data, return_fit=False, tolerance=tolerance)
+    except Exception as e:
+        return key, None, None, repr(e)
+    if table is None:
+        return key, None, None, 'standard deviation is zero'
+    return key, table, MDLs, None
 
 def _segsAndMeans(segmentindices, states_one_pooling_level, means_one_pooling_level, sdevs_one_pooling_level):
     '''return a list of segments with start and end indices, their states, and their means
@@ -120,46 +303,156 @@ def segmentizeData(data, sigma=None):
     donesegs = np.array([False])
     done = False
     while (done == False): # are not yet done segmentizing
-        segnew = [0]
-        donenew = []
-        for start, end, status in zip(segmentindices[0:-1], segmentindices[1:], donesegs):
-            if status == False: #we need to process this segment
-                if(end - start <3):
-                    #this segment contains nothing. do nothing with it.
+        segmentindices, donesegs = _splitSegments(data, sigma, segmentindices, donesegs)
+        if all(donesegs) == True:
+            done = True
+
+    return segmentindices
+
+def segmentizeDataParallel(data, sigma=None, processes=None, min_chunk_length=5000):
+    '''segmentizeData for long time series, with the same result.
+
+    The segments of segmentizeData are split independently of each other. We first split the data serially,
+    one level at a time, until there are enough segments to keep all workers busy (or all segments are shorter
+    than min_chunk_length). Each of these chunks is then segmentized in a worker process, and their segment
+    indices are put back together.
+
+    Args:
+        data (np.array): the time series
+        sigma: standard deviation of the data (see segmentizeData)
+        processes (int): number of worker processes. One per core if None.
+        min_chunk_length (int): do not split chunks shorter than this serially
+    Returns:
+        segmentindices (list of int): list of end-of-segment indices.
+    '''
+    N = len(data)
+    if N < 2*min_chunk_length:
+        return segmentizeData(data, sigma)
+    if processes is None:
+        processes = os.cpu_count()
+    with Pool(processes) as pool:
+        numchunks = 4 * processes
+        segmentindices = [0, N-1]
+        donesegs = [False]
+        while True:
+            #stop when there is enough work for all workers, or the remaining segments are small
+            todo = [end - start for start, end, status in zip(segmentindices[:-1], segmentindices[1:], donesegs)
+                    if not status]
+            if len(todo) >= numchunks or not todo or max(todo) < min_chunk_length:
+                break
+            segmentindices, donesegs = _splitSegments(data, sigma, segmentindices, donesegs)
+
+        chunks = [(start, end) for start, end, status in zip(segmentindices[:-1], segmentindices[1:], donesegs)
+                  if not status]
+        #segmentizeData(data[start:end+1]) splits data[start:end], just like segmentizeData(data) splits this segment
+        results = pool.starmap(segmentizeData, [(data[start:end+1], sigma) for start, end in chunks])
+
+    segnew = set(int(index) for index in segmentindices)
+    for (start, _), chunkindices in zip(chunks, results):
+        segnew.update(start + int(index) for index in chunkindices)
+    return sorted(segnew)
+
+def segmentizeDataApproximate(data, sigma, tolerance=60):
+    '''approximate segmentizeData for long time series, e.g. for dashboards.
+
+    We segmentize the medians of bins of tolerance points, and then place each transition found on the bins at the
+    point of the highest t-test value within one bin of it (at full resolution). States shorter than a bin or
+    so may be missed; larger tolerances are faster and less accurate.
+
+    Args:
+        data (np.array): the time series
+        sigma: standard deviation of the data. If None we compute it from w1s of the whole series.
+        tolerance (int): number of points per bin
+    Returns:
+        segmentindices (list of int): list of end-of-segment indices.
+    '''
+    N = len(data)
+    if sigma is None:
+        sigma = sdevFromW1(w1(data))
+    tolerance = int(tolerance)
+    if tolerance < 2 or N < 4*tolerance:
+        return segmentizeData(data, sigma)
+    #medians of the full bins and of the last, partial bin
+    numfull = N // tolerance
+    binned = np.median(np.reshape(data[:numfull*tolerance], (numfull, tolerance)), axis=1)
+    if N > numfull*tolerance:
+        binned = np.append(binned, np.median(data[numfull*tolerance:]))
+    binned_sigma = sdevFromW1(w1(binned))
+    if binned_sigma == 0:
+        return segmentizeData(data, sigma)
+    candidates = [int(index) * tolerance for index in segmentizeData(binned, binned_sigma)[1:-1]]
+    candidates = [c for c in candidates if c < N-1]
+
+    #refine the candidates one after the other, at full resolution
+    segmentindices = [0]
+    for i, candidate in enumerate(candidates):
+        start = segmentindices[-1]
+        end = candidates[i+1] if i+1 < len(candidates) else N-1
+        if end - start < 3:
+            continue
+        Rs = _tTests(data[start:end], sigma)
+        #a transition at start+tpnts, with tpnts the index of the t-test (see _splitSegments)
+        lo = max(candidate - tolerance - start, 1)
+        hi = min(candidate + tolerance - start, end - start - 1)
+        if lo >= hi:
+            continue
+        segmentindices.append(start + lo + int(np.nanargmax(Rs[lo:hi])))
+    segmentindices.append(N-1)
+    return segmentindices
+
+def _splitSegments(data, sigma, segmentindices, donesegs):
+    '''split all segments that are not done yet at their transition points (one step of segmentizeData)
+
+    Args:
+        data (np.array): the time series
+        sigma: standard deviation of the data (see segmentizeData)
+        segmentindices (list of int): list of end-of-segment indices
+        donesegs (list of bool): for every segment, whether it is known to contain no more transition points
+    Returns:
+        (segmentindices, donesegs): the new segment indices and their status
+    '''
+    segnew = [0]
+    donenew = []
+    for start, end, status in zip(segmentindices[0:-1], segmentindices[1:], donesegs):
+        if status == False: #we need to process this segment
+            if(end - start <3):
+                #this segment contains nothing. do nothing with it.
+                segnew.append(end)
+                donenew.append(True)
+                #pass
+            else:
+                tpnts = _findTransitionPoint(data[start:end], sigma)
+                if tpnts is None:
+                    #we are done with this segment
                     segnew.append(end)
                     donenew.append(True)
-                    #pass
                 else:
-                    tpnts = _findTransitionPoint(data[start:end], sigma)
-                    if tpnts is None:
-                        #we are done with this segment
+                    #found a new transition point, split this segment
+                    if(start+tpnts == end or start+tpnts == start):
+                        #we are done
                         segnew.append(end)
                         donenew.append(True)
                     else:
-                        #found a new transition point, split this segment
-                        if(start+tpnts == end or start+tpnts == start):
-                            #we are done
-                            segnew.append(end)
-                            donenew.append(True)
-                        else:
-                            segnew.append(start+tpnts)
-                            segnew.append(end)
-                            donenew.append(False)
-                            donenew.append(False)
-            else: 
-                #this segment has already been processed and found not to contain any more transitions points. add it to our list
-                segnew.append(end)
-                donenew.append(True)
-        segmentindices = segnew
-        donesegs = donenew
-        if all(donesegs) == True:
-            done = True
-
-    return segmentindices
+                        segnew.append(start+tpnts)
+                        segnew.append(end)
+                        donenew.append(False)
+                        donenew.append(False)
+        else: 
+            #this segment has already been processed and found not to contain any more transitions points. add it to our list
+            segnew.append(end)
+            donenew.append(True)
+    return segnew, donenew
 
 def makeStates(data, segmentindices):
     '''group states into progressively fewer states (determined by the merit function of state pooling)
-    
+
+    Every state is described by its number of points and their sum, which is all the merit function needs
+    (see _meritFromStats). The merits of all pairs of states are kept in a matrix, together with the best
+    partner of every state. After combining two states only the merits of pairs involving the combined state
+    are computed again. Of several pairs with equal merit, the one with the lowest state numbers is combined
+    first. These merits are exact, whereas those of _combineTwoStates carry float rounding noise, so the order
+    in which tied pairs are combined can differ from _combineTwoStates.
+
     Args:
         data (np.array): time series
         segmentindices (list of int): list of end-of-segment indices
@@ -172,14 +465,63 @@ def makeStates(data, segmentindices):
                                   #For example, states=[1,1,1,2,2] assigns the first three segments to state 1 and the last 2 segments to state 2
                                   #Numbering of states starts at 1 (not at zero!).
     pooled_states = [list(states)]
-    while (max(states)>1):
-        new_states = _combineTwoStates(data, segmentindices, states)
-        pooled_states.append(list(new_states))
-        states = new_states
+
+    #states are identified by the index of their first segment. Combining two states keeps the lower index,
+    #so the order of the indices of the remaining states is the order of their state numbers.
+    k = numsegs - 1
+    counts = np.diff(np.asarray(segmentindices)).astype(np.float64)
+    sums = np.array([np.sum(data[start:end], dtype=np.float64)
+                     for start, end in zip(segmentindices[:-1], segmentindices[1:])])
+    owner = np.arange(k) #state index of every segment
+    alive = np.ones(k, dtype=bool)
+
+    #merits[i, j] is the merit of combining states i < j (-inf for all other entries)
+    merits = np.full((k, k), -np.inf)
+    rows, cols = np.triu_indices(k, 1)
+    merits[rows, cols] = _meritFromStats(counts[rows], sums[rows], counts[cols], sums[cols])
+    #the best partner j > i of every state i (the lowest one if there are several)
+    best = np.argmax(merits, axis=1) if k > 0 else np.zeros(0, dtype=int)
+    best_merit = merits[np.arange(k), best]
+
+    for _ in range(k-1):
+        i = np.argmax(best_merit)
+        j = best[i]
+        #combine state j into state i
+        counts[i] += counts[j]
+        sums[i] += sums[j]
+        counts[j] = 0
+        alive[j] = False
+        owner[owner == j] = i
+        merits[j, :] = -np.inf
+        merits[:, j] = -np.inf
+        best_merit[j] = -np.inf
+
+        below = np.flatnonzero(alive[:i])
+        above = np.flatnonzero(alive[i+1:]) + i+1
+        merits[below, i] = _meritFromStats(counts[below], sums[below], counts[i], sums[i])
+        merits[i, above] = _meritFromStats(counts[i], sums[i], counts[above], sums[above])
+        best[i] = np.argmax(merits[i])
+        best_merit[i] = merits[i, best[i]]
+        #states whose best partner was i or j need a new search, the others only compare with the new i
+        for r in np.flatnonzero(alive & ((best == i) | (best == j))):
+            best[r] = np.argmax(merits[r])
+            best_merit[r] = merits[r, best[r]]
+        for r in below:
+            if best[r] != i and (merits[r, i] > best_merit[r]
+                                 or (merits[r, i] == best_merit[r] and i < best[r])):
+                best[r] = i
+                best_merit[r] = merits[r, i]
+
+        states = np.cumsum(alive)[owner]
+        pooled_states.append(list(states))
     return pooled_states
 
 def getMeansOfStates(data, segmentindices, pooled_states):
     '''compute the means of the data when pooled into different states
+
+    The sorted data of every state is kept from one level of pooling to the next. A state that was already
+    there reuses its median, a new state merges the sorted data of the states it was pooled from.
+
     Args: 
         data (np.array): time series
         segmentindices (list of int): list of end-of-segment indices
@@ -190,17 +532,53 @@ def getMeansOfStates(data, segmentindices, pooled_states):
     '''
     means = []
     sdevs = []
-    for i, states in enumerate(pooled_states):
+    numsegs = len(segmentindices) - 1
+    # keys: tuples of the segments of a state, vals: (sorted data, median) of the state
+    previous = {}
+    previous_key = [None] * numsegs #key of the state of every segment in the previous level of pooling
+    for states in pooled_states:
+        current = {}
+        current_key = [None] * numsegs
+        states = np.asarray(states)
+        order = np.argsort(states, kind='stable')
+        bounds = [0] + (np.flatnonzero(np.diff(states[order])) + 1).tolist() + [numsegs]
+        order = order.tolist()
         means_in_pool = []
         sdevs_in_pool = []
-        statedata = _concatenateStateData(data, states, segmentindices)
-        for statenum, sdata in enumerate(statedata):
-            means_in_pool.append(np.median(sdata)) #NOTE: median!!!!!
-            sdevs_in_pool.append(np.sqrt(np.median(sdata)+1)) #NOTE we are computing this as if it were poisson
+        for first, last in zip(bounds[:-1], bounds[1:]): #the segments of each state, in order of the state numbers
+            key = tuple(order[first:last])
+            if key in previous:
+                current[key] = previous[key]
+            else:
+                #states of the previous level that are part of this state
+                whole = {k for k in {previous_key[seg] for seg in key} if k is not None and set(key).issuperset(k)}
+                parts = []
+                for seg in key:
+                    if previous_key[seg] not in whole:
+                        parts.append(np.sort(data[segmentindices[seg]:segmentindices[seg+1]]))
+                    elif previous_key[seg][0] == seg:
+                        #first segment of a state of the previous level: take the whole state
+                        parts.append(previous[previous_key[seg]][0])
+                sorteddata = parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts), kind='stable')
+                current[key] = (sorteddata, _medianOfSorted(sorteddata))
+            for seg in key:
+                current_key[seg] = key
+            median = current[key][1]
+            means_in_pool.append(median) #NOTE: median!!!!!
+            sdevs_in_pool.append(np.sqrt(median+1)) #NOTE we are computing this as if it were poisson
         means.append(means_in_pool)
         sdevs.append(sdevs_in_pool)
+        previous = current
+        previous_key = current_key
     return means, sdevs
 
+def _medianOfSorted(sorteddata):
+    '''np.median of sorted data, from its middle elements'''
+    n = len(sorteddata)
+    if n == 0 or np.isnan(sorteddata[-1]):
+        return np.median(sorteddata)
+    return np.median(sorteddata[(n-1)//2:n//2+1])
+
 def getFitFunctions(segmentindices, pooled_states, means):
     '''generates plottable fit functions for each set of pooled states
     
@@ -297,7 +675,107 @@ def MDL(data, fit_functions, segmentindices, pooled_states):
     sigma = sdevFromW1(w1s)
     return np.asarray(_F(data, fit_functions, sigma)) + np.asarray(_G(data, fit_functions, sigma, segmentindices, pooled_states))
 
-        
+
+
+def segmentMDL(data, segmentindices, pooled_states, means):
+    '''the same as MDL(data, getFitFunctions(segmentindices, pooled_states, means), segmentindices, pooled_states),
+    but computed from the segments without building the fit function of every level of pooling.
+
+    Args:
+        data (np.array): time series
+        segmentindices (list of int): list of end-of-segment indices
+        pooled_states (list of list): each sublist in the list assigns segments to a state. later entries in the list feature progressively fewer states.
+        means (list of lists): each sublist corresponds to the means of the states for a different level of pooling
+
+    Returns:
+        MDLs (np.array of float): one MDL value per level of pooling
+    '''
+    w1s = w1(data)
+    sigma = sdevFromW1(w1s)
+    deviations = _absoluteDeviations(data, segmentindices, pooled_states, means)
+    return np.asarray(deviations)/(2*sigma) + np.asarray(_segmentG(data, sigma, segmentindices, pooled_states, means))
+
+def _segmentValues(segmentindices, states, statemeans):
+    #the value of the fit function on every segment
+    return np.asarray(statemeans, dtype=np.float64)[np.asarray(states)-1]
+
+def _absoluteDeviations(data, segmentindices, pooled_states, means):
+    '''sum of the absolute differences between the data and the fit function of every level of pooling
+    (what _F sums up). The data of every segment is sorted once; the deviations from any value then follow from
+    the number and the sum of the points of the segment below that value.
+
+    Returns:
+        deviations (list of float): one value per level of pooling
+    '''
+    data = np.asarray(data, dtype=np.float64)
+    segmentindices = np.asarray(segmentindices)
+    starts = segmentindices[:-1]
+    ends = segmentindices[1:]
+    #the fit function of a segment runs up to (and not including) its end index. The very last point of the data
+    #belongs to the last segment.
+    points = data[:segmentindices[-1]]
+    segment_of_point = np.repeat(np.arange(len(starts)), ends - starts)
+
+    #sort the points by segment, then by value. Values are replaced by their rank among all points,
+    #which makes the sort keys exact integers.
+    by_value = np.argsort(points)
+    all_sorted = points[by_value]
+    #the rank of a value is the number of smaller points (the position of the first equal point in all_sorted)
+    positions = np.arange(len(points))
+    first_equal = np.ones(len(points), dtype=bool)
+    first_equal[1:] = all_sorted[1:] != all_sorted[:-1]
+    ranks = np.empty(len(points), dtype=np.int64)
+    ranks[by_value] = np.maximum.accumulate(np.where(first_equal, positions, 0))
+    stride = len(points) + 1
+    keys = segment_of_point * stride + ranks
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    cumsum = np.concatenate(([0], np.cumsum(points[order])))
+
+    deviations = []
+    for statemeans, states in zip(means, pooled_states):
+        values = _segmentValues(segmentindices, states, statemeans)
+        #first point of every segment that is not smaller than the value of the segment
+        split = np.searchsorted(keys, np.arange(len(starts)) * stride + np.searchsorted(all_sorted, values))
+        below = values * (split - starts) - (cumsum[split] - cumsum[starts])
+        above = (cumsum[ends] - cumsum[split]) - values * (ends - split)
+        deviations.append(np.sum(below + above) + np.abs(data[segmentindices[-1]] - values[-1]))
+    return deviations
+
+def _segmentG(data, sigma, segmentindices, pooled_states, means):
+    '''_G, computed from the segments instead of the fit functions
+
+    Returns:
+        Gs (list of float): one complexity value per level of pooling
+    '''
+    V = np.max(data) - np.min(data) #domain size
+    N = len(data) #number of data points
+    N_tp = len(segmentindices)-2 #number of transition points. length of end indices minus 2 (do not count beginning and end of trace)
+
+    segmentindices = np.asarray(segmentindices)
+    lengths = np.diff(segmentindices)
+    numsegs = len(lengths)
+    #_G compares the fit function one point after and one point before each transition position.
+    #find the segments these points belong to (the last point belongs to the last segment).
+    trans_pos = segmentindices[1:-1]
+    after = np.minimum(np.searchsorted(segmentindices, trans_pos+1, side='right')-1, numsegs-1)
+    before = np.searchsorted(segmentindices, trans_pos-1, side='right')-1
+
+    Gs = []
+    for statemeans, states in zip(means, pooled_states):
+        k = np.max(states) #number of states
+        ni = np.bincount(np.asarray(states)-1, weights=lengths, minlength=k) #number of points associated with each state
+        values = _segmentValues(segmentindices, states, statemeans)
+        T_j = values[after] - values[before]
+        T_j = T_j[T_j > 0]
+
+        G = k/2 * np.log(1/(2*np.pi)) + k * np.log(V/sigma) + N_tp/2 * np.log(N) + 0.5 \
+            * ( np.sum(np.log(ni)) + np.sum(np.log(np.power(T_j/sigma, 2))) )
+        Gs.append(G)
+
+    return Gs
+
+
 def _combineTwoStates(data, segmentindices, states):
     '''combine the two states with the highest merit function of their pooling. Return new state assignments.
     
@@ -371,7 +849,13 @@ def _merit(data_i, data_j):
 
 
 
-def _findTransitionPoint(data, sigma=None, threshold = 3.174):
+def _meritFromStats(m_i, S_i, m_j, S_j):
+    '''the merit function of _merit, computed from the number of points m and their sum S of both states.
+    (m_i + m_j) * I_ij**2 - (m_i * I_i**2 + m_j * I_j**2) simplifies to -(S_i m_j - S_j m_i)^2 / (m_i m_j (m_i + m_j))'''
+    return -(S_i * m_j - S_j * m_i)**2 / (m_i * m_j * (m_i + m_j))
+
+
+def _findTransitionPoint(data, sigma=None, threshold=THRESHOLD):
     '''run t-tests checking for a transition point within the time series data
 
     Args:
@@ -384,13 +868,9 @@ def _findTransitionPoint(data, sigma=None, threshold = 3.174):
     if sigma is None:
         w1s = w1(data)
         sigma = sdevFromW1(w1s)
-    Rs = np.copy(data)
-    Rs.fill(0)
+    Rs = np.zeros_like(data)
+    Rs[:-1] = _tTests(data, sigma)
 
-    for i, _ in enumerate(data[:-1]):
-        Rs[i] = _tTest(data, i, sigma)
-
-    
     index = np.nanargmax(Rs)
     if(Rs[index] > threshold):
         return index
@@ -399,6 +879,28 @@ def _findTransitionPoint(data, sigma=None, threshold = 3.174):
 
     
 
+def _tTests(data, sigma):
+    '''run the t-tests of _tTest for all transition point candidates
+    i = 0 ... N-2 at once. The means left and right of each candidate are
+    computed from the cumulative sum of the data, so this is O(N) instead
+    of O(N^2).
+
+    Args:
+        data (np.array): time series
+        sigma (float): global noise
+    Returns:
+        Rs (np.array of float): t-test value for every candidate (length N-1)
+    '''
+    N = len(data)
+    i = np.arange(N-1)
+    if not sigma > 0:
+        return np.zeros(N-1)
+    cumsum = np.cumsum(data, dtype=np.float64)
+    mean_left = cumsum[:-1] / (i+1)
+    mean_right = (cumsum[-1] - cumsum[:-1]) / (N-i-1)
+    return np.abs(mean_right - mean_left) / (sigma * np.sqrt(1/(i+1) + 1/(N-i+1)))
+
+
 def _tTest(data, i, sigma):
     '''run one t-test to determine whether i is a transition point in data
     
@@ -4,18 +4,23 @@ import numpy as np
 import datetime
 from datetime import datetime as ddatetime
 from datetime import timedelta
+import resource
 from sqlalchemy import desc
 import mtatracking_v2.nyct_subway_pb2 as nyct_subway_pb2
 from datetime import date
 from mtatracking_v2.mean_transit_times import (
-    getTransitTimes,
+    getSegmentTransitTimes,
     computeMeanTransitTimes,
     populate_database_with_fit_results
 )
+from mtatracking_v2.STaSI import IncrementalSTaSI
 from pytz import timezone
 
 from multiprocessing import Process, Queue
 
+from mtatracking_v2.ingest_metrics import IngestMetrics
+from mtatracking_v2.db import disposeAfterFork
+
 from mtatracking_v2.models import (Train,
                                    Stop,
                                    Stop_time_update,
@@ -23,28 +28,106 @@ from mtatracking_v2.models import (Train,
                                    Trip_update,
                                    Alert_message,
                                    Vehicle_message,
-                                   Transit_time_fit
+                                   Transit_time_fit,
+                                   Segment_transit_time
                                    )
 
 
+EASTERN = timezone('US/Eastern')
+
+
+class TrainState:
+    """Compact in-memory record of a train that is currently in the system.
+
+    The ingest loop keeps one of these per live train instead of a full
+    ORM Train object. ORM rows are only produced at the write boundary
+    (see SubwaySystem._writePendingRows).
+    """
+    __slots__ = ('id', 'unique_num', 'route_id', 'is_assigned',
+                 'first_seen_timestamp', 'next_station',
+                 'trip_key', 'line_id', 'direction',
+                 'last_stop_id', 'last_stop_time', 'last_trip_key')
+
+    def __init__(self, unique_num, route_id, first_seen_timestamp,
+                 is_assigned=None, next_station=None,
+                 trip_key=None, line_id=None, direction=None,
+                 last_stop_id=None, last_stop_time=None, last_trip_key=None,
+                 id=None):
+        # primary key of the train in the database.
+        # None until the train has been written for the first time.
+        self.id = id
+        self.unique_num = unique_num
+        self.route_id = route_id
+        self.is_assigned = is_assigned
+        self.first_seen_timestamp = first_seen_timestamp
+        self.next_station = next_station
+        # natural key of the train's current Trip_update
+        self.trip_key = trip_key
+        self.line_id = line_id
+        self.direction = direction
+        # last station the train stopped at and when (naive local time,
+        # as it is stored in the database)
+        self.last_stop_id = last_stop_id
+        self.last_stop_time = last_stop_time
+        # natural key of the trip the train was on at its last stop
+        self.last_trip_key = last_trip_key
+
+    def __repr__(self):
+        return self.unique_num
+
+    def row(self, is_in_system_now=True):
+        '''raw row of the Train table for this train'''
+        row = {'unique_num': self.unique_num,
+               'route_id': self.route_id,
+               'is_assigned': self.is_assigned,
+               'first_seen_timestamp': self.first_seen_timestamp,
+               'is_in_system_now': is_in_system_now,
+               'next_station': self.next_station}
+        if self.id is not None:
+            row['id'] = self.id
+        return row
+
+
 class SubwaySystem:
     """A subway system consists of stations, lines, and trains.
     These objects are stored in a database and accessed by SQLAlchemy."""
 
-    def __init__(self, session, session_fit_update):
+    def __init__(self, session, session_fit_update,
+                 trip_origin_date_max_age=timedelta(hours=6), metrics=None):
         '''Create a SubwaySystem
         Args:
             session: SQLAlchemy session bound to database.
             session_fit_update: SQLAlchemy session bound to database.
+            trip_origin_date_max_age (timedelta): trips that have not been
+                seen in the feed for longer than this are evicted from
+                trip_origin_date_dict.
+            metrics (IngestMetrics): where to record per-cycle metrics.
+                If None we record into our own IngestMetrics object.
 
         '''
 
         self.session = session
         self.session_fit_update = session_fit_update
+        if metrics is None:
+            metrics = IngestMetrics()
+        self.metrics = metrics
         # we need to make sure we do not have unreasonably
         # long gaps in between files during tracking:
         self.last_attached_file_timestamp = np.nan
 
+        # dict of trip origin dates.
+        # keys are trip_id from GTFS, NOT our keys in the DB.
+        # vals are (origin_date, last time we saw this trip in the feed).
+        # This dict outlives a single cycle, so we evict stale entries.
+        self.trip_origin_date_dict = {}
+        self.trip_origin_date_max_age = trip_origin_date_max_age
+
+        # set by the poll scheduler if we are falling behind the feeds.
+        # If True we skip vehicle messages and requests for new fits.
+        self.shed_optional_work = False
+        self.dropped_vehicle_messages = 0
+        self.dropped_fit_requests = _DroppedFitRequests()
+
         self.resetSystem(session)
 
         # make a queue to which we can append the fits we still want to do.
@@ -58,40 +141,123 @@ class SubwaySystem:
         p.start()
 
     def resetSystem(self, session):
+        '''(Re)load the live state of the subway system from the database.
+        Only needed on startup: afterwards the live state is maintained in
+        memory by attach_tracking_data.
+        '''
         # keep the Stops table in memory so that we can check whether
         # a stop is in the database without performing a query:
-        self.stop_ids = [s.id for s in session.query(Stop).all()]
-        self.stops_dict = {s.id: s for s in session.query(Stop).all()}
+        self.stop_ids = set(s_id for s_id, in session.query(Stop.id))
 
         # keep a dictionary of trains currently in the system
         # (and their arr stations). This will allow us to determine
         # whether a train stopped at a station without querying the
-        # database
-
-        curr_trains = session.query(Train).filter(
-            Train.is_in_system_now == True).all()
-        if curr_trains:
-            self.curr_trains_arr_st_dict = {t.unique_num: t.next_station
-                                            for t in curr_trains}
-            self.trains_dict = {t.unique_num: t for t in curr_trains}
-        else:
-            # keys: uniquenums, vals: arr stations
-            self.curr_trains_arr_st_dict = {}
-            # keys: primary_keys, vals: ORM objects
-            self.trains_dict = {}
-
-        # self.trip_update_dict = {}
-        # self.stop_time_update_dict = {}
-        # self.trains_stopped_dict = {}
-        self.trip_update_list = []
-        self.alerts_list = []
-        self.vmessage_list = []
+        # database.
+        # keys: interned unique_nums, vals: TrainState records
+        self.trains_dict = {}
+        # keys: Trip_update natural keys, vals: Trip_update ids.
+        # Only holds the current trips of the trains in trains_dict.
+        self.trip_update_ids = {}
+        for t in session.query(Train).filter(
+                Train.is_in_system_now == True):
+            unique_num = sys.intern(t.unique_num)
+            self.trains_dict[unique_num] = TrainState(
+                unique_num, t.route_id, t.first_seen_timestamp,
+                is_assigned=t.is_assigned, next_station=t.next_station,
+                id=t.id)
+
+        if self.trains_dict:
+            states_by_id = {s.id: s for s in self.trains_dict.values()}
+            # latest trip update of each train
+            for tu_id, trip_key, train_id, line_id, direction in \
+                    session.query(
+                        Trip_update.id, Trip_update.trip_key,
+                        Trip_update.train_id, Trip_update.line_id,
+                        Trip_update.direction)\
+                    .filter(Trip_update.train_id.in_(states_by_id.keys()))\
+                    .order_by(Trip_update.effective_timestamp):
+                state = states_by_id[train_id]
+                state.trip_key = trip_key
+                state.line_id = line_id
+                state.direction = direction
+                self.trip_update_ids[trip_key] = tu_id
+            trip_keys = {id: k for k, id in self.trip_update_ids.items()}
+            # latest stop of each train
+            for train_id, stop_id, stop_time, tu_id in session.query(
+                    Trains_stopped.train_id, Trains_stopped.stop_id,
+                    Trains_stopped.stop_time, Trains_stopped.trip_update_id)\
+                    .filter(Trains_stopped.train_id.in_(
+                        states_by_id.keys()))\
+                    .order_by(Trains_stopped.stop_time):
+                state = states_by_id[train_id]
+                state.last_stop_id = stop_id
+                state.last_stop_time = stop_time
+                state.last_trip_key = trip_keys.get(tu_id)
+
+        self._resetPendingRows()
+        self.setStartingPrimaryKeys()
 
-        # dict of trip origin dates.
-        # keys are trip_id from GTFS, NOT our keys in the DB.
-        self.trip_origin_date_dict = {}
+    def _resetPendingRows(self):
+        '''raw rows collected during one cycle. They are written to the
+        database in bulk by _writePendingRows.'''
+        # keys: unique_num / Trip_update trip_key, so that a train or trip
+        # that appears in several feeds is only written once per cycle.
+        # Rows that refer to trains and trip updates carry their natural
+        # keys until _writePendingRows has looked up the integer ids.
+        self.train_rows = {}
+        self.trip_update_rows = {}
+        self.stop_time_update_rows = []
+        self.trains_stopped_rows = []
+        self.segment_rows = []
+        self.vmessage_rows = []
+        self.alert_rows = []
+        self.new_stop_ids = set()
+
+    def recycleSession(self):
+        '''Close the session so that its identity map (and every ORM object
+        we loaded or added during the last cycle) can be garbage collected.
+        The session reconnects on its next query.
+        '''
+        self.session.close()
+
+    def _evictStaleTripOriginDates(self, current_time_dt):
+        '''remove trips from trip_origin_date_dict that have not been seen
+        in the feed for longer than self.trip_origin_date_max_age'''
+        cutoff = current_time_dt - self.trip_origin_date_max_age
+        stale = [trip_id for trip_id, (_, last_seen)
+                 in self.trip_origin_date_dict.items()
+                 if last_seen < cutoff]
+        for trip_id in stale:
+            del self.trip_origin_date_dict[trip_id]
+
+    def memoryGauges(self):
+        '''Return gauges that let us check that memory use of the scraper
+        stays bounded over days of tracking.
 
-        self.setStartingPrimaryKeys()
+        Returns:
+            dict of gauge name: value
+        '''
+        return {
+            'rss_bytes': _currentRSS(),
+            # cheap, unlike counting gc.get_objects() on every cycle
+            'allocated_blocks': sys.getallocatedblocks(),
+            'session_identity_map': len(self.session.identity_map),
+            'trains_dict': len(self.trains_dict),
+            'trip_origin_date_dict': len(self.trip_origin_date_dict),
+            'stop_ids': len(self.stop_ids)
+        }
+
+    def sheddingReport(self):
+        '''Return how much optional work we dropped while shedding load.
+
+        Returns:
+            dict of counter name: value
+        '''
+        return {
+            'shed_optional_work': self.shed_optional_work,
+            'dropped_vehicle_messages': self.dropped_vehicle_messages,
+            'dropped_fit_requests': self.dropped_fit_requests.count
+        }
 
     def setStartingPrimaryKeys(self):
         # increment this every time we want to add a
@@ -142,79 +308,257 @@ class SubwaySystem:
         # we will remove entries from this list while processing FeedEntities.
         # The trains left in this list are the ones that are no longer in
         # the feed.
-        leftover_train_uniques = set(list(self.curr_trains_arr_st_dict.keys()))
+        leftover_train_uniques = set(self.trains_dict.keys())
         current_time = None
 
         for message in data:
             current_time = message.header.timestamp
             # make DateTime object from current_time
             current_time_dt = ddatetime.fromtimestamp(current_time)
-            current_time_dt = timezone('US/Eastern').localize(current_time_dt)
-
-            for FeedEntity in message.entity:
-                if len(FeedEntity.trip_update.trip.trip_id) > 0:
-                    # entity type "trip_update"
-                    leftover_train_uniques = self._processTripUpdate(
-                                            FeedEntity,
-                                            current_time_dt,
-                                            leftover_train_uniques)
-                if len(FeedEntity.vehicle.trip.trip_id) > 0:
-                    # entity type "vehicle"
-                    self._processVehicleMessage(FeedEntity, current_time_dt)
-                if len(FeedEntity.alert.header_text.translation) > 0:
-                    # alert message
-                    self._processAlertMessage(FeedEntity, current_time_dt)
+            current_time_dt = EASTERN.localize(current_time_dt)
+
+            with self.metrics.timer('process_s'):
+                for FeedEntity in message.entity:
+                    if len(FeedEntity.trip_update.trip.trip_id) > 0:
+                        # entity type "trip_update"
+                        self.metrics.count('entities.trip_update')
+                        leftover_train_uniques = self._processTripUpdate(
+                                                FeedEntity,
+                                                current_time_dt,
+                                                leftover_train_uniques)
+                    if len(FeedEntity.vehicle.trip.trip_id) > 0:
+                        # entity type "vehicle"
+                        self.metrics.count('entities.vehicle')
+                        if self.shed_optional_work:
+                            self.dropped_vehicle_messages += 1
+                        else:
+                            self._processVehicleMessage(
+                                FeedEntity, current_time_dt)
+                    if len(FeedEntity.alert.header_text.translation) > 0:
+                        # alert message
+                        self.metrics.count('entities.alert')
+                        self._processAlertMessage(
+                            FeedEntity, current_time_dt)
 
         # any leftover trains have stopped at their last known stations
         # register their arrival, set their 'is_in_system_now=False'
-        self._performCleanup(current_time_dt, leftover_train_uniques)
-        self.session.commit()
-        self.resetSystem(self.session)
+        with self.metrics.timer('process_s'):
+            self._performCleanup(current_time_dt, leftover_train_uniques)
+        with self.metrics.timer('write_s'):
+            self._writePendingRows()
+        with self.metrics.timer('commit_s'):
+            self.session.commit()
+        self._resetPendingRows()
+        self._evictStaleTripOriginDates(current_time_dt)
+        self.recycleSession()
+        self.metrics.gauge('fit_queue_depth', self.fitQueueDepth())
+        self.metrics.gauges(self.sheddingReport())
+
+    def fitQueueDepth(self):
+        '''approximate number of fits waiting to be performed
+        (None where the platform does not support Queue.qsize)'''
+        try:
+            return self.fit_queue.qsize()
+        except NotImplementedError:
+            return None
+
+    def _writePendingRows(self):
+        '''Write boundary of the ingest loop: insert or update all rows
+        collected during this cycle in bulk.
+        Rows are written in foreign key order.'''
+        session = self.session
+        if self.new_stop_ids:
+            session.bulk_insert_mappings(
+                Stop, [{'id': stop_id, 'name': 'Unknown',
+                        'location_type': 0}
+                       for stop_id in self.new_stop_ids])
+            self.stop_ids.update(self.new_stop_ids)
+
+        # We cannot add duplicates, so update the trains and trip updates
+        # that are already in the database and insert the rest.
+        train_ids = self._upsertRows(Train, Train.unique_num,
+                                     self.train_rows)
+        for state in self.trains_dict.values():
+            state.id = train_ids[state.unique_num]
+        for row in self.trip_update_rows.values():
+            row['train_id'] = train_ids[row.pop('train_unique_num')]
+        trip_ids = dict(self.trip_update_ids)
+        trip_ids.update(self._upsertRows(Trip_update, Trip_update.trip_key,
+                                         self.trip_update_rows))
+        self.trip_update_ids = {s.trip_key: trip_ids[s.trip_key]
+                                for s in self.trains_dict.values()}
+
+        # replace the natural keys in the remaining rows by integer ids
+        for row in self.stop_time_update_rows:
+            row['trip_update_id'] = trip_ids[row.pop('trip_key')]
+        for row in self.trains_stopped_rows:
+            row['train_id'] = train_ids[row.pop('train_unique_num')]
+            row['trip_update_id'] = trip_ids.get(row.pop('trip_key'))
+        for row in self.segment_rows:
+            row['train_id'] = train_ids[row.pop('train_unique_num')]
+        self._lookUpIds(Trip_update.trip_key, Trip_update.id, trip_ids,
+                        [r['trip_key'] for r in self.segment_rows])
+        self.segment_rows = self._resolveKeys(
+            self.segment_rows, 'trip_key', 'trip_update_id', trip_ids,
+            'segments_without_trip_update')
+        self._lookUpIds(Train.unique_num, Train.id, train_ids,
+                        [r['train_unique_num'] for r in self.vmessage_rows])
+        self.vmessage_rows = self._resolveKeys(
+            self.vmessage_rows, 'train_unique_num', 'train_id', train_ids,
+            'vehicle_messages_without_train')
+        self._lookUpIds(Trip_update.trip_key, Trip_update.id, trip_ids,
+                        [r['trip_key'] for r in self.alert_rows])
+        self.alert_rows = self._resolveKeys(
+            self.alert_rows, 'trip_key', 'trip_update_id', trip_ids,
+            'alerts_without_trip_update')
+
+        session.bulk_insert_mappings(Stop_time_update,
+                                     self.stop_time_update_rows)
+        session.bulk_insert_mappings(Trains_stopped,
+                                     self.trains_stopped_rows)
+        session.bulk_insert_mappings(Segment_transit_time, self.segment_rows)
+        session.bulk_insert_mappings(Vehicle_message, self.vmessage_rows)
+        session.bulk_insert_mappings(Alert_message, self.alert_rows)
+
+        self.metrics.count('rows.Stop', len(self.new_stop_ids))
+        self.metrics.count('rows.Train', len(self.train_rows))
+        self.metrics.count('rows.Trip_update', len(self.trip_update_rows))
+        self.metrics.count('rows.Stop_time_update',
+                           len(self.stop_time_update_rows))
+        self.metrics.count('rows.Trains_stopped',
+                           len(self.trains_stopped_rows))
+        self.metrics.count('rows.Segment_transit_time',
+                           len(self.segment_rows))
+        self.metrics.count('rows.Vehicle_message', len(self.vmessage_rows))
+        self.metrics.count('rows.Alert_message', len(self.alert_rows))
+
+    def _upsertRows(self, model, key_column, rows):
+        '''update rows that exist in the database, insert the others.
+
+        Args:
+            model: ORM class of the table
+            key_column: natural key column of the table
+            rows (dict): natural key: row dict. Rows we know to be in the
+                         database carry their integer primary key as 'id'.
+
+        Returns:
+            dict of natural key: integer primary key, for all rows
+        '''
+        if not rows:
+            return {}
+        unknown = [k for k, r in rows.items() if 'id' not in r]
+        if unknown:
+            for k, id in self.session.query(key_column, model.id)\
+                    .filter(key_column.in_(unknown)):
+                rows[k]['id'] = id
+        self.session.bulk_update_mappings(
+            model, [r for r in rows.values() if 'id' in r])
+        # return_defaults fills in the ids of the new rows. This issues one
+        # INSERT per row, but there are only a few new trains and trips
+        # per cycle.
+        self.session.bulk_insert_mappings(
+            model, [r for r in rows.values() if 'id' not in r],
+            return_defaults=True)
+        return {k: r['id'] for k, r in rows.items()}
+
+    def _lookUpIds(self, key_column, id_column, ids, keys):
+        '''add the ids of the natural keys in keys that are not in ids yet
+        (and that exist in the database) to ids'''
+        missing = set(keys) - set(ids)
+        if missing:
+            ids.update(self.session.query(key_column, id_column)
+                       .filter(key_column.in_(missing)))
+
+    def _resolveKeys(self, rows, key, id_key, ids, counter):
+        '''replace the natural key in each row by its integer id.
+        Drop (and count) the rows whose key is not in the database.'''
+        resolved = []
+        for row in rows:
+            id = ids.get(row.pop(key))
+            if id is None:
+                self.metrics.count(counter)
+                continue
+            row[id_key] = id
+            resolved.append(row)
+        return resolved
+
+    def _registerStop(self, stop_id):
+        '''make sure that stop_id will be in the Stop table
+        before we write rows that refer to it'''
+        if stop_id not in self.stop_ids:
+            self.new_stop_ids.add(stop_id)
+
+    def _trainStoppedRow(self, state, stopped_at, trip_key,
+                         current_time_dt):
+        '''Build the Trains_stopped row for a train that has just stopped
+        at stopped_at. Compare its transit time from its previous stop
+        to the latest fit to determine whether it was delayed.
+        If the train stopped at its previous stop during the same trip,
+        also record the transit time of this segment of its trip.'''
+        stop_time = current_time_dt.replace(tzinfo=None)
+        del_mag = None
+        isdel = False
+        if state.last_stop_id is not None and state.line_id is not None:
+            transit_time = (stop_time - state.last_stop_time)\
+                .total_seconds()
+            if self.shed_optional_work:
+                fit_queue = self.dropped_fit_requests
+            else:
+                fit_queue = self.fit_queue
+            median, sdev = getMedianTravelTime(state.line_id,
+                                               state.direction,
+                                               state.last_stop_id,
+                                               stopped_at,
+                                               self.session,
+                                               fit_queue,
+                                               N=60)
+            if median and sdev:
+                del_mag = (transit_time-median)/sdev
+                isdel = bool(np.abs(del_mag) > 3)
+
+        self._registerStop(stopped_at)
+        if state.last_stop_id is not None and state.line_id is not None \
+                and trip_key is not None \
+                and state.last_trip_key == trip_key \
+                and state.last_stop_id != stopped_at:
+            # same definition of a segment as in
+            # sql_queries/rebuild_segment_transit_times.sql
+            self.segment_rows.append({
+                'train_unique_num': state.unique_num,
+                'trip_key': trip_key,
+                'line_id': state.line_id,
+                'direction': state.direction,
+                'stop_id_origin': state.last_stop_id,
+                'stop_id_destination': stopped_at,
+                'origin_time': state.last_stop_time,
+                'arrival_time': stop_time,
+                'transit_seconds': (stop_time - state.last_stop_time)
+                .total_seconds()})
+        row = {'id': self.trainsstopped_counter,
+               'stop_id': stopped_at,
+               'train_unique_num': state.unique_num,
+               'trip_key': trip_key,
+               'stop_time': current_time_dt,
+               'delayed': isdel,
+               'delayed_magnitude': del_mag,
+               'delayed_MTA': False}
+        self.trainsstopped_counter += 1
+        self.metrics.count('stop_events')
+        state.last_stop_id = stopped_at
+        state.last_stop_time = stop_time
+        state.last_trip_key = trip_key
+        return row
 
     def _performCleanup(self, current_time_dt, leftover_train_uniques):
         """Set the is_in_system_now attribute of the leftover trains to False.
         Register the arrival of these trains at their last known stations.
         """
-        if leftover_train_uniques:
-
-            leftover_trains = self.session.query(Train).filter(
-                Train.unique_num.in_(leftover_train_uniques)).all()
-            for train in leftover_trains:
-                train.is_in_system_now = False
-                stopped_at = self.curr_trains_arr_st_dict[train.unique_num]
-                if len(train.stopped_at) > 0:
-                    previous_stop = train.stopped_at[0].stop
-                    stopped_at_ORM = self.session.query(Stop)\
-                        .filter(Stop.id == stopped_at).first()
-                    transit_time = (
-                        current_time_dt.replace(tzinfo=None) - train.stopped_at[0].stop_time)\
-                        .total_seconds()
-                    median, sdev = getMedianTravelTime(train.trip_updates[0].line_id,
-                                                    train.trip_updates[0].direction,
-                                                    previous_stop,
-                                                    stopped_at_ORM,
-                                                    self.session,
-                                                    self.fit_queue,
-                                                    N=60)
-                    if median and sdev:
-                        del_mag = (transit_time-median)/sdev
-                        isdel = np.abs(del_mag) > 3
-                    else:
-                        del_mag = None
-                        isdel = False
-                else:
-                    del_mag = None
-                    isdel = False
-                this_train_stopped = Trains_stopped(self.trainsstopped_counter,
-                                                    stopped_at,
-                                                    train.unique_num,
-                                                    train.trip_updates[0].id,
-                                                    current_time_dt,
-                                                    delayed=isdel,
-                                                    delayed_magnitude=del_mag,
-                                                    delayed_MTA=False)
-                self.trainsstopped_counter += 1
-                self.session.add(this_train_stopped)
+        for unique_num in leftover_train_uniques:
+            state = self.trains_dict.pop(unique_num)
+            self.train_rows[unique_num] = state.row(is_in_system_now=False)
+            self.trains_stopped_rows.append(self._trainStoppedRow(
+                state, state.next_station, state.trip_key,
+                current_time_dt))
 
     def _processTripUpdate(self, FeedEntity, current_time_dt,
                            leftover_train_uniques):
@@ -229,159 +573,99 @@ class SubwaySystem:
                                             before we processed messages.
         """
 
-        # Add current train to database
-        train_id = FeedEntity.trip_update.trip\
-            .Extensions[nyct_subway_pb2.nyct_trip_descriptor].train_id
-        origin_date = FeedEntity.trip_update.trip.start_date
-        unique_num = origin_date + ": " + train_id
+        # Add current train to our live state
+        trip = FeedEntity.trip_update.trip
+        nyct_trip = trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor]
+        train_id = nyct_trip.train_id
+        origin_date = trip.start_date
+        unique_num = sys.intern(origin_date + ": " + train_id)
         origin_date = datetime.datetime.strptime(origin_date, "%Y%m%d").date()
-        route_id = FeedEntity.trip_update.trip.route_id
-        is_assigned = FeedEntity.trip_update.trip\
-            .Extensions[nyct_subway_pb2.nyct_trip_descriptor].is_assigned
+        route_id = trip.route_id
+        is_assigned = nyct_trip.is_assigned
         if FeedEntity.trip_update and FeedEntity.trip_update.stop_time_update:
             next_station = FeedEntity.trip_update.stop_time_update[0].stop_id
         else:
             next_station = 'Unknown'
 
-        this_train = Train(unique_num=unique_num, route_id=route_id,
-                           first_seen_timestamp=current_time_dt,
-                           is_in_system_now=True,
-                           is_assigned=is_assigned,
-                           next_station=next_station)
-
-        self.session.merge(this_train)
-
-        # Add current trip to database
-        trip_id = FeedEntity.trip_update.trip.trip_id
+        # Add current trip
+        trip_id = trip.trip_id
         # We need this later for alert messages:
-        self.trip_origin_date_dict[trip_id] = origin_date
+        self.trip_origin_date_dict[trip_id] = (origin_date, current_time_dt)
         origin_time, _, direction, path_id = self.parse_trip_id(trip_id)
         # origin time to Time object:
         origin_time = (datetime.datetime.min +
                        timedelta(minutes=origin_time)).time()
-        route_id = FeedEntity.trip_update.trip.route_id
-        direction = self.direction_to_str(FeedEntity.trip_update.trip.
-                                          Extensions[nyct_subway_pb2.
-                                                     nyct_trip_descriptor].
-                                          direction)
-        this_trip = Trip_update(trip_id=trip_id, train_unique_num=unique_num,
-                                origin_date=origin_date,
-                                origin_time=origin_time,
-                                line_id=route_id,
-                                direction=direction,
-                                effective_timestamp=current_time_dt,
-                                path=path_id)
-
-        self.session.merge(this_trip)
-        self.trip_update_list.append(trip_id)
-
-        # need to call this to auto-populate the Trip_update id:
-        # self.session.flush()
+        direction = self.direction_to_str(nyct_trip.direction)
+        trip_key = Trip_update.tripKey(unique_num, trip_id)
+        trip_update_row = {
+            'trip_key': trip_key,
+            'trip_id': trip_id,
+            'train_unique_num': unique_num,
+            'origin_date': origin_date,
+            'origin_time': origin_time,
+            'line_id': route_id,
+            'direction': direction,
+            'effective_timestamp': current_time_dt,
+            'path': path_id}
+        if trip_key in self.trip_update_ids:
+            trip_update_row['id'] = self.trip_update_ids[trip_key]
+        self.trip_update_rows[trip_key] = trip_update_row
 
         # determine whether our train has just stopped at a station:
         stopped_at = None
-        if this_train.unique_num in self.curr_trains_arr_st_dict:
+        state = self.trains_dict.get(unique_num)
+        if state is not None:
             # we processed this train:
-            if this_train.unique_num in leftover_train_uniques:
-                leftover_train_uniques.remove(this_train.unique_num)
+            if unique_num in leftover_train_uniques:
+                leftover_train_uniques.remove(unique_num)
             else:
-                print("warning: processed train that was not in set")
-            if next_station !=\
-                    self.curr_trains_arr_st_dict[this_train.unique_num]:
-                # we just stopped at
-                # curr_trains_arr_st_dict[this_train.unique_num]
-                stopped_at = self.curr_trains_arr_st_dict[
-                    this_train.unique_num]
-                if(this_train.unique_num == '20190707: 1Q 2010+ STL/962'):
-                    # print(this_train)
-                    # print(FeedEntity.trip_update.stop_time_update[0])
-                    print("************")
-                    print('stopped at: ', stopped_at)
-                    print('next station: ', next_station)
-                # set new arrival station for our train:
-                self.curr_trains_arr_st_dict[
-                    this_train.unique_num] = next_station
+                # this train was already processed in this cycle
+                # (or it entered the system during this cycle)
+                self.metrics.count('trains_not_in_set')
+            if next_station != state.next_station:
+                # we just stopped at state.next_station
+                stopped_at = state.next_station
         else:
             # register this train with our dictionary
-            self.curr_trains_arr_st_dict[
-                this_train.unique_num] = next_station
+            state = TrainState(unique_num, route_id, current_time_dt)
+            self.trains_dict[unique_num] = state
 
         if stopped_at:
-            if len(this_train.stopped_at) > 0:
-                previous_stop = this_train.stopped_at[0].stop
-                stopped_at_ORM = self.session.query(Stop)\
-                    .filter(Stop.id == stopped_at).first()
-                transit_time = (
-                    current_time_dt.replace(tzinfo=None) - this_train.stopped_at[0].stop_time)\
-                    .total_seconds()
-                median, sdev = getMedianTravelTime(this_train.trip_updates[0].line_id,
-                                                this_train.trip_updates[0].direction,
-                                                previous_stop,
-                                                stopped_at_ORM,
-                                                self.session,
-                                                self.fit_queue,
-                                                N=60)
-                if mediand and sdev:
-                    del_mag = (transit_time-median)/sdev
-                    isdel = np.abs(del_mag) > 3
-                else:
-                    del_mag = None
-                    isdel = False
-            else:
-                del_mag = None
-                isdel = False
-
-            this_train_stopped = Trains_stopped(self.trainsstopped_counter,
-                                                stopped_at,
-                                                this_train.unique_num,
-                                                this_trip.id,
-                                                current_time_dt,
-                                                delayed=isdel,
-                                                delayed_magnitude=del_mag,
-                                                delayed_MTA=False)
-            if stopped_at not in self.stop_ids:
-                this_stop = Stop(stopped_at, 'Unknown')
-                self.session.merge(this_stop)
-                self.stop_ids.append(stopped_at)
-            self.session.merge(this_train_stopped)
-            self.trainsstopped_counter += 1
-
-        # Add stop time updates to database
-
+            # the stop belongs to the trip the train was on when it arrived
+            self.trains_stopped_rows.append(self._trainStoppedRow(
+                state, stopped_at, trip_key, current_time_dt))
+
+        # set new arrival station and trip for our train:
+        state.route_id = route_id
+        state.is_assigned = is_assigned
+        state.next_station = next_station
+        state.trip_key = trip_key
+        state.line_id = route_id
+        state.direction = direction
+        self.train_rows[unique_num] = state.row()
+
+        # Add stop time updates
         for stu in FeedEntity.trip_update.stop_time_update:
             stop_id = stu.stop_id
             # check whether this stop is in our table of stops.
             # If it isn't, add it.
-            if stop_id not in self.stop_ids:
-                stop = Stop(stop_id, name='Unknown')
-                self.session.add(stop)
-                # self.session.flush()
-                self.stop_ids.append(stop_id)
-
-            arrival_time = stu.arrival.time
-            arrival_time_dt = ddatetime.fromtimestamp(arrival_time)
-            arrival_time_dt = timezone('US/Eastern').localize(arrival_time_dt)
-
-            departure_time = stu.departure.time
-            departure_time_dt = ddatetime.fromtimestamp(departure_time)
-            departure_time_dt = timezone('US/Eastern').\
-                localize(departure_time_dt)
-
-            scheduled_track = stu.\
-                Extensions[nyct_subway_pb2.
-                           nyct_stop_time_update].scheduled_track
-            actual_track = stu.\
-                Extensions[nyct_subway_pb2.
-                           nyct_stop_time_update].actual_track
-            this_stu = Stop_time_update(id=self.stu_counter,
-                                        trip_update_id=this_trip.id,
-                                        stop_id=stop_id,
-                                        arrival_time=arrival_time_dt,
-                                        departure_time=departure_time_dt,
-                                        scheduled_track=scheduled_track,
-                                        actual_track=actual_track,
-                                        effective_timestamp=current_time_dt)
-            self.session.add(this_stu)
+            self._registerStop(stop_id)
+
+            arrival_time_dt = EASTERN.localize(
+                ddatetime.fromtimestamp(stu.arrival.time))
+            departure_time_dt = EASTERN.localize(
+                ddatetime.fromtimestamp(stu.departure.time))
+
+            nyct_stu = stu.Extensions[nyct_subway_pb2.nyct_stop_time_update]
+            self.stop_time_update_rows.append({
+                'id': self.stu_counter,
+                'trip_key': trip_key,
+                'stop_id': stop_id,
+                'arrival_time': arrival_time_dt,
+                'departure_time': departure_time_dt,
+                'scheduled_track': nyct_stu.scheduled_track,
+                'actual_track': nyct_stu.actual_track,
+                'effective_timestamp': current_time_dt})
             self.stu_counter += 1
 
         return leftover_train_uniques
@@ -396,7 +680,6 @@ class SubwaySystem:
         '''
         # sometimes there are alert messages without reference to trains.
         # We can't really use those so we will for now ignore them.
-        print('found alert message')
         if len(FeedEntity.alert.informed_entity) > 0:
             for tr in FeedEntity.alert.informed_entity:
                 # we need to construct the DB ID of the trip update that this
@@ -405,27 +688,20 @@ class SubwaySystem:
                 train_id = tr.trip.Extensions[
                     nyct_subway_pb2.nyct_trip_descriptor].train_id
                 if tr_id in self.trip_origin_date_dict.keys():
-                    origin_date = self.trip_origin_date_dict[tr_id]
+                    origin_date, _ = self.trip_origin_date_dict[tr_id]
                 else:
                     # fallback to hoping that the current date is right
                     origin_date = current_time_dt
                 unique_num = origin_date.strftime('%Y%m%d') + ": " + train_id
-                # tr_id is ID in GTFS; trip_id is ID in DB:
-                trip_id = unique_num + ": " + tr_id
-                print('message refers to trip id: ', trip_id)
-                thisupdate = self.session.query(Trip_update)\
-                    .filter(Trip_update.id == trip_id).one_or_none()
-                if thisupdate:
-                    if len(FeedEntity.alert.header_text.translation) > 0:
-                        for h in FeedEntity.alert.header_text.translation:
-                            header = h.text
-                            thisalert = Alert_message(
-                                trip_id, header, current_time_dt)
-                            print('adding to session...')
-                            self.session.add(thisalert)
-                else:
-                    print('warning: alert message refers '
-                          'to non-existent trip update')
+                # tr_id is ID in GTFS; trip_key is the natural key in the DB.
+                # Alerts whose trip update is not in the database are
+                # dropped (and counted) by _writePendingRows.
+                trip_key = Trip_update.tripKey(unique_num, tr_id)
+                for h in FeedEntity.alert.header_text.translation:
+                    self.alert_rows.append({
+                        'trip_key': trip_key,
+                        'header': h.text,
+                        'effective_timestamp': current_time_dt})
         else:
             # This is a strange case: there is an alert message but it does
             # not refer to any trip. There is nothing we can do with this,
@@ -438,25 +714,18 @@ class SubwaySystem:
             nyct_subway_pb2.nyct_trip_descriptor].train_id
         origin_date = FeedEntity.vehicle.trip.start_date
         unique_num = origin_date + ": " + train_id
-        current_status = FeedEntity.vehicle.current_status
         stop_id = FeedEntity.vehicle.stop_id
-        if stop_id == '':
-            stop_id = ''
-        last_moved_at = FeedEntity.vehicle.timestamp
-        last_moved_at = ddatetime.fromtimestamp(last_moved_at)
-        last_moved_at = timezone('US/Eastern').localize(last_moved_at)
-
-        current_stop_sequence = FeedEntity.vehicle.current_stop_sequence
-        effective_timestamp = current_time_dt
-        if stop_id not in self.stop_ids:
-            this_stop = Stop(stop_id, 'Unknown')
-            self.session.add(this_stop)
-            self.stop_ids.append(stop_id)
-        vmessage = Vehicle_message(unique_num, current_status,
-                                   stop_id, last_moved_at,
-                                   current_stop_sequence,
-                                   effective_timestamp)
-        self.session.add(vmessage)
+        last_moved_at = EASTERN.localize(
+            ddatetime.fromtimestamp(FeedEntity.vehicle.timestamp))
+        self._registerStop(stop_id)
+        self.vmessage_rows.append({
+            'train_unique_num': unique_num,
+            'current_status': FeedEntity.vehicle.current_status,
+            'stop_id': stop_id,
+            'last_moved_at': last_moved_at,
+            'current_stop_sequence':
+                FeedEntity.vehicle.current_stop_sequence,
+            'effective_timestamp': current_time_dt})
 
     def direction_to_str(self, direction):
         """convert a direction number (1, 2, 3, 4) to a string (N, E, S, W)
@@ -481,8 +750,30 @@ class SubwaySystem:
         return (origin_time, line, direction, path_id)
 
 
+class _DroppedFitRequests:
+    '''stands in for the fit queue while we shed load.
+    Counts the fit requests instead of performing them.'''
+
+    def __init__(self):
+        self.count = 0
+
+    def put(self, item):
+        self.count += 1
+
+
+def _currentRSS():
+    '''resident set size of this process in bytes. Falls back to the
+    peak RSS if /proc is not available (e.g. on macOS).'''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
 def getMedianTravelTime(
-       line_id, direction, orig, dest, session, fit_queue, N=60):
+       line_id, direction, orig_id, dest_id, session, fit_queue, N=60):
     '''Return the latest median travel time between orig and dest.
     Check whether a fit over the last N days exists. If no fit
     with today's end date exists in the database, use the last existing one
@@ -491,8 +782,8 @@ def getMedianTravelTime(
     Args:
         line_id: line id , e.g. 'Q'
         direction: e.g. 'N'
-        orig (Stop ORM object)
-        dest (Stop ORM object)
+        orig_id (string): id of the origin station
+        dest_id (string): id of the destination station
         session
         fit_queue
         N
@@ -508,8 +799,8 @@ def getMedianTravelTime(
                 (Transit_time_fit.line_id == line_id)
                 & (start >= Transit_time_fit.fit_start_datetime)
                 & (today == Transit_time_fit.fit_end_datetime)
-                & (Transit_time_fit.stop_id_origin == orig.id)
-                & (Transit_time_fit.stop_id_destination == dest.id)
+                & (Transit_time_fit.stop_id_origin == orig_id)
+                & (Transit_time_fit.stop_id_destination == dest_id)
                 )\
         .first()
 
@@ -523,8 +814,8 @@ def getMedianTravelTime(
         meansAndSdev_fit = session.query(Transit_time_fit)\
             .filter(
                 (Transit_time_fit.line_id == line_id)
-                & (Transit_time_fit.stop_id_origin == orig.id)
-                & (Transit_time_fit.stop_id_destination == dest.id)
+                & (Transit_time_fit.stop_id_origin == orig_id)
+                & (Transit_time_fit.stop_id_destination == dest_id)
                 )\
             .order_by(Transit_time_fit.fit_end_datetime.desc()).first()
 
@@ -537,23 +828,35 @@ def getMedianTravelTime(
         # generate a new fit with today as the end date.
         # we will make a new session. Otherwise there will be conflicts
 
-        fit_queue.put((line_id, direction, orig, dest, start, today))
+        fit_queue.put((line_id, direction, orig_id, dest_id, start, today))
 
     return median, sdev
 
 
-def getFit(orig, dest, line_id, direction, time_start, time_end, session):
-    transit_times = getTransitTimes(
-        orig.id, dest.id,
+def getFit(orig_id, dest_id, line_id, direction, time_start, time_end,
+           session, incremental=None):
+    '''Fit the transit times of a segment and save the fit in the
+    database.
+
+    Args:
+        incremental (STaSI.IncrementalSTaSI): the fit of this segment of
+            the previous call. If given, it is updated with the new transit
+            times instead of fitting everything again.
+    '''
+    # orig_id and dest_id are consecutive stops of a train
+    # (see SubwaySystem._trainStoppedRow)
+    transit_times = getSegmentTransitTimes(
+        orig_id, dest_id,
         line_id, time_start, time_end, session)
-    print('new fit, ' + orig.id + ' to ' + dest.id)
-    res, sdev = computeMeanTransitTimes(transit_times)
+    print('new fit, ' + orig_id + ' to ' + dest_id)
+    res, sdev = computeMeanTransitTimes(transit_times,
+                                        incremental=incremental)
     if res is None:
         print('result is None')
         return
     print('populating DB')
     populate_database_with_fit_results(
-        session, res, sdev, orig.id, dest.id,
+        session, res, sdev, orig_id, dest_id,
         line_id, direction, time_start,
         time_end)
 
@@ -561,14 +864,26 @@ def getFit(orig, dest, line_id, direction, time_start, time_end, session):
 def PerformFitAndWriteToDB_consumer(fit_queue, session):
     '''to be executed as a parallel daemon process that performs
     new STaSI fits and writes their results to the database.
+    The fits of every segment are kept and updated incrementally
+    when the segment is fitted again on the next day.
 
     Args:
-        fit_queue: queue of (line_id, direction, orig, dest, start, today)
+        fit_queue: queue of
+                (line_id, direction, orig_id, dest_id, start, today)
                 defining the fit that's supposed to be performed.
 
         session: sqlalchemy database session
     '''
-
+    # do not share the pooled connections of the ingest process
+    disposeAfterFork(session)
+    # keys: (line_id, direction, orig_id, dest_id),
+    # vals: IncrementalSTaSI of the segment
+    fits = {}
     while True:
-        line_id, direction, orig, dest, start, today = fit_queue.get()
-        getFit(orig, dest, line_id, direction, start, today, session)
+        line_id, direction, orig_id, dest_id, start, today = fit_queue.get()
+        incremental = fits.setdefault(
+            (line_id, direction, orig_id, dest_id), IncrementalSTaSI())
+        getFit(orig_id, dest_id, line_id, direction, start, today, session,
+               incremental)
+        # do not let the identity map of this long-lived process grow
+        session.close()
@@ -0,0 +1,262 @@
+'''Archive of old Stop_time_update rows.
+
+Stop_time_update is by far the largest table, but rows that are more than
+a few weeks old are rarely read. archiveStopTimeUpdates moves the monthly
+partitions of the table (see partitions.py) that are older than a
+retention period out of the database into zstd-compressed Parquet files,
+one per day and feed:
+
+    <archive>/Stop_time_update/date=2020-01-15/feed=gtfs-nqrw/part-0.parquet
+
+The archived rows carry the train_id and line_id of their trip update, so
+that they can be searched without the database. StopTimeUpdateArchive
+reads them back; get_MTA_predicted_transit_time uses it to combine the
+rows that are still in the database with the archived ones.
+
+Once all days of a month have been written, its partition is dropped as
+a whole, which frees its storage at once and leaves no dead rows for
+VACUUM. Run this module once a day (e.g. from cron). Reading and writing
+the archive needs pyarrow.
+'''
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from mtatracking_v2.parquet_export import tableSchema
+from mtatracking_v2.partitions import (listPartitions, detachOldPartitions,
+                                       _monthStart, _addMonths)
+from mtatracking_v2.db import makeSessionFactory, queryFrame
+
+# keys: line ids, vals: the MTA feed that publishes the line
+# (see scrape_MTA_feeds.TrackAllAndAttachForever)
+FEED_OF_LINE = {
+    'A': 'gtfs-ace', 'C': 'gtfs-ace', 'E': 'gtfs-ace', 'H': 'gtfs-ace',
+    'FS': 'gtfs-ace',
+    'B': 'gtfs-bdfm', 'D': 'gtfs-bdfm', 'F': 'gtfs-bdfm', 'M': 'gtfs-bdfm',
+    'FX': 'gtfs-bdfm',
+    'G': 'gtfs-g',
+    'J': 'gtfs-jz', 'Z': 'gtfs-jz',
+    'N': 'gtfs-nqrw', 'Q': 'gtfs-nqrw', 'R': 'gtfs-nqrw', 'W': 'gtfs-nqrw',
+    'L': 'gtfs-l',
+    '1': 'gtfs', '2': 'gtfs', '3': 'gtfs', '4': 'gtfs', '5': 'gtfs',
+    '6': 'gtfs', '5X': 'gtfs', '6X': 'gtfs', 'GS': 'gtfs',
+    '7': 'gtfs-7', '7X': 'gtfs-7',
+    'SI': 'gtfs-si'
+}
+UNKNOWN_FEED = 'other'
+
+TABLE = 'Stop_time_update'
+
+
+def feedOfLine(line_id):
+    '''the feed that publishes line_id'''
+    return FEED_OF_LINE.get(line_id, UNKNOWN_FEED)
+
+
+def _dayDirectory(path, day):
+    return os.path.join(path, TABLE, 'date={0}'.format(day))
+
+
+def archiveSchema(session):
+    '''schema of all archive files: the columns of Stop_time_update plus
+    train_id and line_id of the trip update'''
+    schema = tableSchema(session, TABLE)
+    trip_update = tableSchema(session, 'Trip_update')
+    for name in ['train_id', 'line_id']:
+        schema = schema.append(trip_update.field(name))
+    return schema
+
+
+def archiveDay(session, path, day):
+    '''Write the Stop_time_update rows of day to the archive. Days that
+    are archived again are overwritten. The rows stay in the database
+    (see archiveStopTimeUpdates).
+
+    Returns:
+        number of archived rows
+    '''
+    df = queryFrame(
+        session,
+        'SELECT stu.*, tu.train_id, tu.line_id '
+        'FROM public."Stop_time_update" AS stu '
+        'INNER JOIN public."Trip_update" AS tu '
+        'ON stu.trip_update_id = tu.id '
+        'WHERE stu.effective_timestamp >= :day '
+        'AND stu.effective_timestamp < :next_day',
+        day=day, next_day=day + timedelta(days=1))
+    if len(df) == 0:
+        return 0
+    schema = archiveSchema(session)
+    feeds = df['line_id'].map(feedOfLine)
+    for feed, rows in df.groupby(feeds):
+        directory = os.path.join(_dayDirectory(path, day),
+                                 'feed={0}'.format(feed))
+        os.makedirs(directory, exist_ok=True)
+        rows.to_parquet(os.path.join(directory, 'part-0.parquet'),
+                        compression='zstd', index=False, schema=schema)
+    return len(df)
+
+
+def archiveStopTimeUpdates(session, path, retention_months=1, now=None):
+    '''Archive the monthly partitions of Stop_time_update whose month
+    ended more than retention_months months ago, one day at a time, and
+    drop them once all their days have been written.
+
+    Partitions that the scraper has already detached (see the
+    retention_months of scrape_MTA_feeds.TrackAllAndAttachForever) are not
+    archived: keep the scraper's retention longer than this one.
+
+    Args:
+        session: the SQLAlchemy database session.
+        path (string): directory of the archive
+        retention_months (int): number of complete months to keep in the
+                                database (in addition to the current month)
+        now (date): reference date. Today if None.
+
+    Returns:
+        dict of day: number of archived rows
+    '''
+    if now is None:
+        now = date.today()
+    oldest_kept = _addMonths(_monthStart(now), -retention_months)
+    archived = {}
+    for _, month in listPartitions(session, TABLE):
+        if month >= oldest_kept:
+            continue
+        day = month
+        while day < _addMonths(month, 1):
+            archived[day] = archiveDay(session, path, day)
+            day += timedelta(days=1)
+    # only drop the partitions once all their days have been written
+    detachOldPartitions(session, retention_months, now, drop=True,
+                        tables=[TABLE])
+    return archived
+
+
+class StopTimeUpdateArchive:
+    """Stop_time_update rows archived by archiveStopTimeUpdates."""
+
+    def __init__(self, path):
+        '''Create a StopTimeUpdateArchive
+
+        Args:
+            path (string): directory of the archive
+        '''
+        self.path = path
+
+    def latestDay(self):
+        '''the most recent archived day (None if the archive is empty)'''
+        directory = os.path.join(self.path, TABLE)
+        if not os.path.isdir(directory):
+            return None
+        days = [name[len('date='):] for name in os.listdir(directory)
+                if name.startswith('date=')]
+        if not days:
+            return None
+        return datetime.strptime(max(days), '%Y-%m-%d').date()
+
+    def covers(self, time_start):
+        '''whether rows from time_start on may be in the archive'''
+        latest = self.latestDay()
+        return latest is not None and time_start.date() <= latest
+
+    def read(self, time_start, time_end, line_id=None, filters=None,
+             columns=None):
+        '''read the archived rows with an effective_timestamp between
+        time_start and time_end. Only the partitions of these days
+        (and of the feed of line_id, if given) are read.
+
+        Returns:
+            pd.DataFrame
+        '''
+        if not self.covers(time_start):
+            return pd.DataFrame(columns=columns)
+        filters = list(filters or []) + [
+            ('date', '>=', str(time_start.date())),
+            ('date', '<=', str(time_end.date())),
+            ('effective_timestamp', '>', time_start),
+            ('effective_timestamp', '<', time_end)]
+        if line_id is not None:
+            filters.append(('feed', '==', feedOfLine(line_id)))
+        df = pd.read_parquet(os.path.join(self.path, TABLE),
+                             columns=columns, filters=filters)
+        return df.drop(columns=['date', 'feed'], errors='ignore')
+
+    def stopTimeUpdates(self, session, train_id, line_id, stop_id,
+                        time_start, time_end):
+        '''the Stop_time_update rows of a train's trips for stop_id,
+        from the database and from the archive
+
+        Returns:
+            pd.DataFrame with columns arrival_time, effective_timestamp
+        '''
+        columns = ['arrival_time', 'effective_timestamp']
+        hot = queryFrame(
+            session,
+            'SELECT stu.arrival_time, stu.effective_timestamp '
+            'FROM public."Trip_update" AS tu '
+            'INNER JOIN public."Stop_time_update" AS stu '
+            'ON stu.trip_update_id = tu.id '
+            'WHERE tu.train_id = :train_id AND stu.stop_id = :stop_id '
+            'AND stu.effective_timestamp > :time_start '
+            'AND stu.effective_timestamp < :time_end',
+            train_id=train_id, stop_id=stop_id, time_start=time_start,
+            time_end=time_end)
+        cold = self.read(time_start, time_end, line_id,
+                         filters=[('train_id', '==', train_id),
+                                  ('stop_id', '==', stop_id)],
+                         columns=columns)
+        if len(cold) == 0:
+            return hot
+        if len(hot) == 0:
+            return cold
+        return pd.concat([hot, cold], ignore_index=True)
+
+    def mtaPredictedTransitTime(self, session, train_unique_num, origin_id,
+                                dest_id):
+        '''like sql_queries/mta_predicted_transit_time.sql, but also
+        searches the archived rows'''
+        result_columns = ['mta_predicted_arr_time', 'origin_time',
+                          'mta_predicted_transit_time']
+        train = session.execute(
+            'SELECT id, route_id FROM public."Train" '
+            'WHERE unique_num = :unique_num',
+            {'unique_num': train_unique_num}).fetchone()
+        if train is None:
+            return pd.DataFrame(columns=result_columns)
+        # unique_num starts with the date the trip started (YYYYMMDD)
+        trip_date = datetime.strptime(train_unique_num[:8], '%Y%m%d')
+        time_start = trip_date - timedelta(days=1)
+        time_end = trip_date + timedelta(days=2)
+        origin_time, = session.execute(
+            'SELECT max(stop_time) FROM public."Trains_stopped" '
+            'WHERE train_id = :train_id AND stop_id = :origin_id '
+            'AND stop_time > :time_start AND stop_time < :time_end',
+            {'train_id': train.id, 'origin_id': origin_id,
+             'time_start': time_start, 'time_end': time_end}).fetchone()
+        stus = self.stopTimeUpdates(session, train.id, train.route_id,
+                                    dest_id, time_start, time_end)
+        if origin_time is None or len(stus) == 0:
+            return pd.DataFrame(columns=result_columns)
+        # the predictions made closest to the departure from the origin
+        time_diff = np.abs(stus['effective_timestamp'] - origin_time)
+        best = stus[time_diff == time_diff.min()]
+        return pd.DataFrame({
+            'mta_predicted_arr_time': best['arrival_time'].values,
+            'origin_time': origin_time,
+            'mta_predicted_transit_time':
+                (best['arrival_time'] - origin_time).values})
+
+
+if __name__ == '__main__':
+    print("Enter database name: ")
+    name = sys.stdin.readline()
+    print("Enter archive directory: ")
+    path = sys.stdin.readline().strip()
+    Session = makeSessionFactory(name)
+    session = Session()
+    archived = archiveStopTimeUpdates(session, path)
+    print('archived ' + str(sum(archived.values())) + ' rows of '
+          + str(len(archived)) + ' days')
@@ -0,0 +1,55 @@
+'''Compare approximate STaSI fits (fitSTaSIModel with a tolerance) with
+exact fits, on synthetic transit times with known transitions.
+
+For every tolerance we report the fit time, the number of transitions that
+were found, the distance of the transitions from those of the exact fit,
+and the mean absolute difference between the approximate and the exact
+fit functions (in seconds).
+
+Run: python approximate_stasi.py [number of points]
+'''
+
+import sys
+import time
+import numpy as np
+sys.path.append('/home/tbartsch/source/repos')
+from mtatracking_v2.STaSI import fitSTaSIModel
+from mtatracking_v2.benchmarks.synthetic import piecewiseConstantSeries
+
+
+def _transitions(results):
+    return results['start'].values[1:]
+
+
+def _distance(found, reference):
+    '''mean distance of every found transition from the nearest reference
+    transition (np.nan if there are none)'''
+    if len(found) == 0 or len(reference) == 0:
+        return np.nan
+    return np.mean([np.min(np.abs(reference - f)) for f in found])
+
+
+def benchmark(N, tolerances=(10, 30, 60, 120, 300)):
+    data, _, _ = piecewiseConstantSeries(N, numstates=4, numtransitions=20)
+    t = time.perf_counter()
+    fit, _, _, results, _ = fitSTaSIModel(data)
+    exact_seconds = time.perf_counter() - t
+    exact_transitions = _transitions(results)
+    print('{0:>9} {1:>9} {2:>11} {3:>12} {4:>12}'.format(
+        'tolerance', 'time (s)', 'transitions', 'distance', 'fit diff (s)'))
+    print('{0:>9} {1:>9.3f} {2:>11} {3:>12} {4:>12}'.format(
+        'exact', exact_seconds, len(exact_transitions), '-', '-'))
+    for tolerance in tolerances:
+        t = time.perf_counter()
+        approx_fit, _, _, results, _ = fitSTaSIModel(data,
+                                                     tolerance=tolerance)
+        seconds = time.perf_counter() - t
+        transitions = _transitions(results)
+        print('{0:>9} {1:>9.3f} {2:>11} {3:>12.1f} {4:>12.2f}'.format(
+            tolerance, seconds, len(transitions),
+            _distance(transitions, exact_transitions),
+            np.mean(np.abs(approx_fit - fit))))
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
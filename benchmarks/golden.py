@@ -0,0 +1,87 @@
+'''Reference outputs of STaSI fits of synthetic series.
+
+Optimizations of STaSI.py must not change its results. checkGolden fits a
+fixed set of synthetic series and compares the segmentation, the states of
+every level of pooling, the medians of the best fit and the MDLs with the
+outputs stored by writeGolden. Segment indices, states and medians have to
+match exactly; MDLs up to floating point rounding (rtol MDL_RTOL).
+
+Run: python golden.py [--write]
+'''
+
+import os
+import sys
+import json
+import numpy as np
+sys.path.append('/home/tbartsch/source/repos')
+from mtatracking_v2.STaSI import (w1, sdevFromW1, segmentizeData,
+                                  makeStates, fitSTaSIModel)
+from mtatracking_v2.benchmarks.synthetic import piecewiseConstantSeries
+
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'golden', 'stasi.json')
+
+# arguments of piecewiseConstantSeries
+GOLDEN_CASES = [
+    {'N': 500, 'numstates': 2, 'noise': 5, 'seed': 1},
+    {'N': 2000, 'numstates': 3, 'noise': 15, 'seed': 2, 'integer': True},
+    {'N': 5000, 'numstates': 4, 'noise': 15, 'seed': 3},
+    {'N': 5000, 'numstates': 6, 'noise': 40, 'seed': 4, 'integer': True},
+    {'N': 20000, 'numstates': 8, 'noise': 10, 'seed': 5,
+     'numtransitions': 40},
+]
+
+MDL_RTOL = 1e-9
+
+
+def goldenOutput(data):
+    '''the outputs of a STaSI fit of data that we compare'''
+    sigma = sdevFromW1(w1(data))
+    segindices = segmentizeData(data, sigma)
+    states = makeStates(data, segindices)
+    _, means, sdevs, results, MDLs = fitSTaSIModel(data, return_fit=False)
+    return {'segmentindices': [int(i) for i in segindices],
+            'states': [[int(s) for s in level] for level in states],
+            'means': [float(m) for m in means],
+            'results': results.astype(float).to_dict(orient='list'),
+            'MDLs': [float(m) for m in MDLs]}
+
+
+def writeGolden(path=GOLDEN):
+    outputs = [goldenOutput(piecewiseConstantSeries(**case)[0])
+               for case in GOLDEN_CASES]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'cases': GOLDEN_CASES, 'outputs': outputs}, f)
+
+
+def checkGolden(path=GOLDEN):
+    '''fit the golden cases again and compare with the stored outputs
+
+    Returns:
+        list of strings describing the differences (empty if none)
+    '''
+    with open(path) as f:
+        golden = json.load(f)
+    differences = []
+    for case, expected in zip(golden['cases'], golden['outputs']):
+        output = goldenOutput(piecewiseConstantSeries(**case)[0])
+        for name in ['segmentindices', 'states', 'means', 'results']:
+            if output[name] != expected[name]:
+                differences.append('{0}: {1} differ'.format(case, name))
+        if len(output['MDLs']) != len(expected['MDLs']) or not np.allclose(
+                output['MDLs'], expected['MDLs'], rtol=MDL_RTOL, atol=0):
+            differences.append('{0}: MDLs differ'.format(case))
+    return differences
+
+
+if __name__ == '__main__':
+    if '--write' in sys.argv:
+        writeGolden()
+        print('wrote ' + GOLDEN)
+    else:
+        differences = checkGolden()
+        for difference in differences:
+            print(difference)
+        print('{0} differences'.format(len(differences)))
+        sys.exit(1 if differences else 0)
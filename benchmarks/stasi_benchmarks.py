@@ -0,0 +1,144 @@
+'''Timings and memory peaks of the steps of a STaSI fit on synthetic series
+(see synthetic.py), compared with stored baselines.
+
+Every step (segmentizeData, makeStates, getMeansOfStates, segmentMDL and
+the whole fitSTaSIModel) is timed as the best of a few runs, and its peak
+memory is measured in a separate run with tracemalloc. Steps that are more
+than REGRESSION times slower than their baseline are reported as
+regressions, steps that are that much faster as speedups (steps shorter
+than MIN_SECONDS are not compared). Baselines depend on the machine: save
+new ones after switching machines.
+
+Run: python stasi_benchmarks.py [--save] [--quick]
+    --save: store the results as the new baselines
+    --quick: only the two shortest lengths of the grid
+'''
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+sys.path.append('/home/tbartsch/source/repos')
+from mtatracking_v2.STaSI import (w1, sdevFromW1, segmentizeData,
+                                  makeStates, getMeansOfStates, segmentMDL,
+                                  fitSTaSIModel)
+from mtatracking_v2.benchmarks.synthetic import gridSeries, LENGTHS
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'baselines', 'stasi.json')
+
+# report steps that are this many times slower (or faster) than baseline
+REGRESSION = 1.5
+# ... unless they take less than this many seconds (too noisy to compare)
+MIN_SECONDS = 0.005
+
+
+def measure(function, *args, repeat=3):
+    '''best time (seconds) of repeat calls of function(*args), and the peak
+    of the memory allocated during one more call (bytes)
+
+    Returns:
+        (seconds, peak_bytes, result)
+    '''
+    seconds = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = function(*args)
+        seconds = min(seconds, time.perf_counter() - t)
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def benchmarkSeries(data):
+    '''time the steps of a fit of data
+
+    Returns:
+        dict of step: (seconds, peak_bytes)
+    '''
+    sigma = sdevFromW1(w1(data))
+    timings = {}
+    seconds, peak, segindices = measure(segmentizeData, data, sigma)
+    timings['segmentizeData'] = (seconds, peak)
+    seconds, peak, states = measure(makeStates, data, segindices)
+    timings['makeStates'] = (seconds, peak)
+    seconds, peak, (means, _) = measure(getMeansOfStates, data, segindices,
+                                        states)
+    timings['getMeansOfStates'] = (seconds, peak)
+    seconds, peak, _ = measure(segmentMDL, data, segindices, states, means)
+    timings['segmentMDL'] = (seconds, peak)
+    seconds, peak, _ = measure(fitSTaSIModel, data)
+    timings['fitSTaSIModel'] = (seconds, peak)
+    return timings
+
+
+def runBenchmarks(lengths=LENGTHS):
+    '''benchmark all series of the grid
+
+    Returns:
+        list of dicts with keys length, numstates, noise, step, seconds,
+        peak_bytes
+    '''
+    rows = []
+    for params, data, _ in gridSeries(lengths=lengths):
+        for step, (seconds, peak) in benchmarkSeries(data).items():
+            rows.append(dict(params, step=step, seconds=seconds,
+                             peak_bytes=peak))
+    return rows
+
+
+def _key(row):
+    return (row['length'], row['numstates'], row['noise'], row['step'])
+
+
+def compareWithBaselines(rows, path=BASELINES):
+    '''print every result next to its baseline
+
+    Returns:
+        list of the rows that are regressions
+    '''
+    baselines = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            baselines = {_key(row): row for row in json.load(f)}
+    regressions = []
+    print('{0:>7} {1:>6} {2:>5} {3:>17} {4:>10} {5:>10} {6:>10} {7}'.format(
+        'length', 'states', 'noise', 'step', 'time (s)', 'baseline',
+        'peak (MB)', ''))
+    for row in rows:
+        baseline = baselines.get(_key(row))
+        note = ''
+        baseline_seconds = float('nan') if baseline is None \
+            else baseline['seconds']
+        if max(row['seconds'], baseline_seconds) >= MIN_SECONDS:
+            if row['seconds'] > REGRESSION * baseline_seconds:
+                note = 'REGRESSION'
+                regressions.append(row)
+            elif row['seconds'] * REGRESSION < baseline_seconds:
+                note = 'speedup'
+        print('{0:>7} {1:>6} {2:>5} {3:>17} {4:>10.4f} {5:>10.4f} '
+              '{6:>10.2f} {7}'.format(
+                  row['length'], row['numstates'], row['noise'], row['step'],
+                  row['seconds'], baseline_seconds,
+                  row['peak_bytes'] / 2**20, note))
+    return regressions
+
+
+def saveBaselines(rows, path=BASELINES):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(rows, f, indent=1)
+
+
+if __name__ == '__main__':
+    lengths = LENGTHS[:2] if '--quick' in sys.argv else LENGTHS
+    rows = runBenchmarks(lengths)
+    regressions = compareWithBaselines(rows)
+    if '--save' in sys.argv:
+        saveBaselines(rows)
+        print('saved baselines to ' + BASELINES)
+    elif regressions:
+        sys.exit(1)
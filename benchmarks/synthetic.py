@@ -0,0 +1,62 @@
+'''Synthetic transit times for the STaSI benchmarks: piecewise constant
+series with gaussian noise and known transitions.'''
+
+import itertools
+import numpy as np
+
+# grid of the benchmarks: lengths of the series, numbers of distinct
+# states and noise levels (standard deviation in seconds)
+LENGTHS = [1000, 10000, 100000]
+NUMSTATES = [2, 4, 8]
+NOISES = [5, 15, 40]
+
+
+def piecewiseConstantSeries(N, numstates=4, noise=15, numtransitions=None,
+                            seed=0, integer=False):
+    '''piecewise constant transit times (in seconds) with gaussian noise.
+    Adjacent segments always belong to different states.
+
+    Args:
+        N (int): number of points
+        numstates (int): number of distinct transit times
+        noise (float): standard deviation of the noise
+        numtransitions (int): number of transitions. 2*numstates if None.
+        seed (int): seed of the random number generator
+        integer (bool): round to whole seconds, like the transit times of
+                        the MTA feeds
+
+    Returns:
+        (data (np.array), transitions (np.array of int), levels (np.array)):
+            transitions are the indices of the first points of all segments
+            but the first, levels are the transit times of the states
+    '''
+    rng = np.random.default_rng(seed)
+    if numtransitions is None:
+        numtransitions = 2 * numstates
+    levels = np.sort(rng.uniform(90, 240, numstates))
+    transitions = np.sort(rng.choice(np.arange(1, N), numtransitions,
+                                     replace=False))
+    states = [rng.integers(numstates)]
+    for _ in range(numtransitions):
+        # any state but the current one
+        states.append((states[-1] + rng.integers(1, numstates))
+                      % numstates)
+    data = np.repeat(levels[states], np.diff(np.r_[0, transitions, N]))
+    data = data + rng.normal(0, noise, N)
+    if integer:
+        data = np.round(data)
+    return data, transitions, levels
+
+
+def gridSeries(lengths=LENGTHS, numstates=NUMSTATES, noises=NOISES, seed=0):
+    '''generate one series for every combination of length, number of
+    states and noise level
+
+    Yields:
+        (params (dict), data (np.array), transitions (np.array))
+    '''
+    for N, k, noise in itertools.product(lengths, numstates, noises):
+        data, transitions, _ = piecewiseConstantSeries(N, k, noise,
+                                                       seed=seed)
+        yield {'length': N, 'numstates': k, 'noise': noise}, data, \
+            transitions
@@ -98,18 +98,35 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
         # there is no bulk operation
         # see here: https://stackoverflow.com/questions/25955200/
         # sqlalchemy-performing-a-bulk-upsert-if-exists-update-else-insert-in-postgr
-        for each in self.session.query(Train)\
-                .filter(Train.unique_num.in_(self.trains_dict.keys())).all():
-            self.session.merge(self.trains_dict.pop(each.unique_num))
-        for each in self.session.query(Trip_update)\
-                .filter(Trip_update.id.in_(
-                    self.trip_update_dict.keys())).all():
-            self.session.merge(self.trip_update_dict.pop(each.id))
+        # New trains and trip updates are added one by one, so that the
+        # database assigns their integer ids.
+        train_ids = self._upsertObjects(Train, Train.unique_num,
+                                        self.trains_dict)
+        for trip_key, trip in self.trip_update_dict.items():
+            trip.train_id = train_ids[self.trip_update_train_dict[trip_key]]
+        trip_ids = self._upsertObjects(Trip_update, Trip_update.trip_key,
+                                       self.trip_update_dict)
+
+        # now that we know the ids, fill in the foreign keys
+        train_ids.update(self._lookUpIds(
+            Train.unique_num, Train.id,
+            set(self.vmessage_train_dict.values()) - set(train_ids)))
+        trip_ids.update(self._lookUpIds(
+            Trip_update.trip_key, Trip_update.id,
+            (set(k for _, k in self.trains_stopped_keys.values())
+             | set(self.alert_trip_dict.values())) - set(trip_ids)))
+        for counter, (unique_num, trip_key) in\
+                self.trains_stopped_keys.items():
+            this_train_stopped = self.trains_stopped_dict[counter]
+            this_train_stopped.train_id = train_ids[unique_num]
+            this_train_stopped.trip_update_id = trip_ids.get(trip_key)
+        for vmessage, unique_num in self.vmessage_train_dict.items():
+            vmessage.train_id = train_ids.get(unique_num)
+        for alert, trip_key in self.alert_trip_dict.items():
+            alert.trip_update_id = trip_ids.get(trip_key)
 
         # finally do our bulk update
-        objs = list(self.trains_dict.values())\
-            + list(self.trip_update_dict.values())\
-            + list(self.stop_time_update_dict.values())\
+        objs = list(self.stop_time_update_dict.values())\
             + list(self.trains_stopped_dict.values())\
             + self.alerts_list\
             + self.vmessage_list
@@ -118,6 +135,38 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
 
         self.resetSystem(self.session)
 
+    def _upsertObjects(self, model, key_column, objects):
+        '''merge the objects that are already in the database,
+        add the others and flush them so that they get their ids.
+
+        Args:
+            model: ORM class of the table
+            key_column: natural key column of the table
+            objects (dict): natural key: ORM object
+
+        Returns:
+            dict of natural key: integer primary key
+        '''
+        existing = self._lookUpIds(key_column, model.id, objects.keys())
+        for key, obj in objects.items():
+            if obj.id is None and key in existing:
+                obj.id = existing[key]
+            if obj.id is None:
+                self.session.add(obj)
+            else:
+                self.session.merge(obj)
+        self.session.flush()
+        return {key: obj.id for key, obj in objects.items()}
+
+    def _lookUpIds(self, key_column, id_column, keys):
+        '''return a dict of natural key: integer id of the keys
+        that are in the database'''
+        keys = [k for k in keys if k is not None]
+        if not keys:
+            return {}
+        return dict(self.session.query(key_column, id_column)
+                    .filter(key_column.in_(keys)))
+
     def resetSystem(self, session):
         # keep the Stops table in memory so that we can check whether
         # a stop is in the database without performing a query:
@@ -147,6 +196,17 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
         self.alerts_list = []
         self.vmessage_list = []
 
+        # natural keys of the rows that the objects above refer to.
+        # We fill in the integer foreign keys in performBulkUpdate.
+        # keys: Trip_update trip_keys, vals: train unique_nums
+        self.trip_update_train_dict = {}
+        # keys: Trains_stopped ids, vals: (unique_num, trip_key)
+        self.trains_stopped_keys = {}
+        # keys: Vehicle_message objects, vals: train unique_nums
+        self.vmessage_train_dict = {}
+        # keys: Alert_message objects, vals: trip_keys
+        self.alert_trip_dict = {}
+
         # dict of trip origin dates.
         # keys are trip_id from GTFS, NOT our keys in the DB.
         self.trip_origin_date_dict = {}
@@ -218,8 +278,8 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
                 this_train_stopped = Trains_stopped(
                     self.trainsstopped_counter,
                     stopped_at,
-                    train.unique_num,
-                    tuid,
+                    None,
+                    None,
                     current_time_dt,
                     delayed=False,
                     delayed_magnitude=0,
@@ -227,6 +287,8 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
                     )
                 self.trains_stopped_dict[
                     self.trainsstopped_counter] = this_train_stopped
+                self.trains_stopped_keys[self.trainsstopped_counter] = (
+                    train.unique_num, tuid)
                 self.trainsstopped_counter += 1
             self.curr_trains_arr_st_dict.pop(train.unique_num)
 
@@ -282,7 +344,11 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
                                           Extensions[nyct_subway_pb2.
                                                      nyct_trip_descriptor].
                                           direction)
-        this_trip = Trip_update(trip_id=trip_id, train_unique_num=unique_num,
+        # the train's id is filled in once the train has been written
+        this_trip = Trip_update(trip_key=Trip_update.tripKey(unique_num,
+                                                             trip_id),
+                                trip_id=trip_id,
+                                train_id=None,
                                 origin_date=origin_date,
                                 origin_time=origin_time,
                                 line_id=route_id,
@@ -290,8 +356,9 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
                                 effective_timestamp=current_time_dt,
                                 path=path_id)
 
-        self.trip_update_dict[this_trip.id] = this_trip
-        self.last_trip_update_for_train_dict[unique_num] = unique_num + ": " + trip_id
+        self.trip_update_dict[this_trip.trip_key] = this_trip
+        self.trip_update_train_dict[this_trip.trip_key] = unique_num
+        self.last_trip_update_for_train_dict[unique_num] = this_trip.trip_key
         # determine whether our train has just stopped at a station:
         stopped_at = None
         if this_train.unique_num in self.curr_trains_arr_st_dict:
@@ -323,12 +390,14 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
         if stopped_at:
             this_train_stopped = Trains_stopped(self.trainsstopped_counter,
                                                 stopped_at,
-                                                this_train.unique_num,
-                                                this_trip.id,
+                                                None,
+                                                None,
                                                 current_time_dt,
                                                 delayed=False,
                                                 delayed_magnitude=0,
                                                 delayed_MTA=False)
+            self.trains_stopped_keys[self.trainsstopped_counter] = (
+                this_train.unique_num, this_trip.trip_key)
             if stopped_at not in self.stop_ids:
                 this_stop = Stop(stopped_at, 'Unknown')
                 self.stops_dict[stopped_at] = this_stop
@@ -363,14 +432,15 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
                     origin_date = current_time_dt
                 unique_num = origin_date.strftime('%Y%m%d') + ": " + train_id
                 # tr_id is ID in GTFS; trip_id is ID in DB:
-                trip_id = unique_num + ": " + tr_id
+                trip_id = Trip_update.tripKey(unique_num, tr_id)
                 if trip_id in self.trip_update_dict.keys():
                     if len(FeedEntity.alert.header_text.translation) > 0:
                         for h in FeedEntity.alert.header_text.translation:
                             header = h.text
                             thisalert = Alert_message(
-                                trip_id, header, current_time_dt)
+                                None, header, current_time_dt)
                             self.alerts_list.append(thisalert)
+                            self.alert_trip_dict[thisalert] = trip_id
                 else:
                     print('warning: alert message refers '
                           'to non-existent trip update')
@@ -390,11 +460,12 @@ class SubwaySystem_bulk_updater_noStopTimeUpdate:
 
         current_stop_sequence = FeedEntity.vehicle.current_stop_sequence
         effective_timestamp = current_time_dt
-        vmessage = Vehicle_message(unique_num, current_status,
+        vmessage = Vehicle_message(None, current_status,
                                    stop_id, last_moved_at,
                                    current_stop_sequence,
                                    effective_timestamp)
         self.vmessage_list.append(vmessage)
+        self.vmessage_train_dict[vmessage] = unique_num
 
     def direction_to_str(self, direction):
         """convert a direction number (1, 2, 3, 4) to a string (N, E, S, W)
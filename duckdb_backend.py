@@ -0,0 +1,111 @@
+'''DuckDB as an embedded analytical backend for the heavy historical queries.
+
+A DuckDBSource holds a DuckDB database with the tables of the subway
+system, either as views of a Parquet export (see parquet_export.py) or as
+a snapshot copied from Postgres. Pass it instead of a database session to
+getTransitTimes, getTransitTimes_and_delay or getTransitTimeMatrix: the
+queries of sql_queries/ then run vectorized in DuckDB, off the production
+database.
+
+Needs the duckdb package (and its postgres extension for snapshots).
+'''
+
+import os
+from mtatracking_v2.parquet_export import EXPORT_TABLES
+
+# tables that the analytical queries read
+SNAPSHOT_TABLES = ['Train', 'Trip_update', 'Trains_stopped',
+                   'Stop_time_update', 'Line', 'Line_stops', 'Stop']
+
+
+def _connect(database=':memory:', threads=None):
+    # duckdb is optional: only needed if we use this backend
+    import duckdb
+    connection = duckdb.connect(database)
+    if threads is not None:
+        connection.execute('SET threads TO {0}'.format(int(threads)))
+    return connection
+
+
+class DuckDBSource:
+    """DuckDB database that the queries of sql_queries/ can run on."""
+
+    def __init__(self, connection):
+        '''Create a DuckDBSource. Use fromParquet, fromPostgres or open.
+
+        Args:
+            connection: duckdb connection whose schema "public" holds the
+                        tables of the subway system.
+        '''
+        self.connection = connection
+
+    @classmethod
+    def fromParquet(cls, path, threads=None):
+        '''views of a Parquet export written by parquet_export.exportTables
+
+        Args:
+            path (string): directory of the export
+            threads (int): number of DuckDB threads. DuckDB's default if None.
+        '''
+        connection = _connect(threads=threads)
+        connection.execute('CREATE SCHEMA IF NOT EXISTS public')
+        for table, column in EXPORT_TABLES.items():
+            directory = os.path.join(path, table)
+            if not os.path.isdir(directory):
+                continue
+            if column is None:
+                files = os.path.join(directory, '*.parquet')
+            else:
+                files = os.path.join(directory, '*', '*.parquet')
+            connection.execute(
+                'CREATE VIEW public."{0}" AS SELECT * FROM read_parquet('
+                '\'{1}\', hive_partitioning = {2})'.format(
+                    table, files, column is not None))
+        return cls(connection)
+
+    @classmethod
+    def fromPostgres(cls, dsn, database=':memory:', time_start=None,
+                     tables=SNAPSHOT_TABLES, threads=None):
+        '''copy a snapshot of the tables from Postgres into DuckDB
+
+        Args:
+            dsn (string): libpq connection string of the Postgres database,
+                          e.g. 'dbname=mtatrackingv2 user=tbartsch'
+            database (string): DuckDB database file to keep the snapshot in.
+                               In memory by default.
+            time_start (datetime): only copy the rows of the partitioned
+                                   tables (see parquet_export.EXPORT_TABLES)
+                                   from this time on. All if None.
+            tables (list of string): tables to copy
+            threads (int): number of DuckDB threads. DuckDB's default if None.
+        '''
+        connection = _connect(database, threads)
+        connection.execute('INSTALL postgres')
+        connection.execute('LOAD postgres')
+        connection.execute(
+            'ATTACH \'{0}\' AS pg (TYPE postgres, READ_ONLY)'.format(
+                dsn.replace('\'', '\'\'')))
+        connection.execute('CREATE SCHEMA IF NOT EXISTS public')
+        for table in tables:
+            column = EXPORT_TABLES.get(table)
+            sql = 'CREATE OR REPLACE TABLE public."{0}" AS ' \
+                'SELECT * FROM pg.public."{0}"'.format(table)
+            if column is not None and time_start is not None:
+                connection.execute(sql + ' WHERE {0} >= $time_start'.format(
+                    column), {'time_start': time_start})
+            else:
+                connection.execute(sql)
+        connection.execute('DETACH pg')
+        return cls(connection)
+
+    @classmethod
+    def open(cls, database, threads=None):
+        '''open a snapshot saved by fromPostgres'''
+        return cls(_connect(database, threads))
+
+    def frame(self, sql, params):
+        '''run sql (with $name parameters) and return a pandas DataFrame'''
+        return self.connection.execute(sql, params).df()
+
+    def close(self):
+        self.connection.close()
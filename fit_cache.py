@@ -0,0 +1,160 @@
+'''On-disk cache of STaSI fit results.
+
+The same transit times are often fitted again: by historicTrainDelays, by
+getMedianTransitTimeMatrix, and by reruns of notebooks. A FitCache stores
+the result of every fit, keyed by a hash of the fitted transit times and
+the fit parameters. computeMeanTransitTimes takes its result from the
+cache if the transit times have not changed. Every entry is a small
+compressed .npz file holding the table of segments and states
+(see STaSI._segsAndMeans), the standard deviation of the data and the MDL
+curve. Once the cache grows beyond max_bytes, the least recently used
+entries are deleted. The size of the cache is only walked once and then
+kept up to date from the sizes of the written entries, so that storing a
+batch of fits does not walk the directory again for every one of them.
+
+Several processes can share a cache directory. Entries are written to a
+temporary file first and then renamed, so readers never see partial
+entries.
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import zipfile
+import numpy as np
+import pandas as pd
+
+# change this whenever the results of the STaSI fit change,
+# to invalidate the existing entries
+CACHE_VERSION = 1
+
+RESULT_COLUMNS = ['start', 'stop', 'median', 'sdev', 'state']
+
+
+class FitCache:
+    """Fit results stored in a directory, keyed by a hash of their input."""
+
+    def __init__(self, path, max_bytes=256 * 2**20):
+        '''Create a FitCache
+
+        Args:
+            path (string): directory of the cache. Created if it does not
+                           exist.
+            max_bytes (int): maximum total size of the entries
+        '''
+        self.path = path
+        self.max_bytes = max_bytes
+        # estimated total size of the entries: None until we first need
+        # it. Entries written by other processes are only counted once we
+        # walk the directory again (see evict).
+        self._size = None
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(data, **params):
+        '''the key of the fit of data with the fit parameters params'''
+        data = np.ascontiguousarray(data)
+        h = hashlib.sha256()
+        h.update(json.dumps({'version': CACHE_VERSION,
+                             'dtype': str(data.dtype),
+                             'params': params}, sort_keys=True).encode())
+        h.update(data.tobytes())
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.npz')
+
+    def get(self, key):
+        '''the cached fit of key
+
+        Returns:
+            (results (pd.DataFrame), sigma (float), MDLs (np.array)),
+            or None if the fit is not in the cache
+        '''
+        filename = self._file(key)
+        try:
+            with np.load(filename) as entry:
+                results = pd.DataFrame({column: entry[column]
+                                        for column in RESULT_COLUMNS})
+                sigma = float(entry['sigma'])
+                MDLs = entry['MDLs']
+            # mark the entry as recently used
+            os.utime(filename)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # damaged entry: forget it
+            self._remove(filename)
+            return None
+        return results, sigma, MDLs
+
+    def put(self, key, results, sigma, MDLs):
+        '''store a fit and evict old entries if the cache is too large
+
+        Args:
+            key (string): see key
+            results (pd.DataFrame): table of segments and states
+                                    (see STaSI._segsAndMeans)
+            sigma (float): standard deviation of the fitted data
+            MDLs (np.array): MDL curve of the fit
+        '''
+        filename = self._file(key)
+        directory = os.path.dirname(filename)
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            np.savez_compressed(
+                f, sigma=sigma, MDLs=np.asarray(MDLs),
+                **{column: results[column].to_numpy()
+                   for column in RESULT_COLUMNS})
+        written = os.path.getsize(temporary)
+        try:
+            replaced = os.path.getsize(filename)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temporary, filename)
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += written - replaced
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        '''(last use, size, filename) of all entries'''
+        entries = []
+        for directory, _, filenames in os.walk(self.path):
+            for name in filenames:
+                if not name.endswith('.npz'):
+                    continue
+                filename = os.path.join(directory, name)
+                try:
+                    stat = os.stat(filename)
+                except FileNotFoundError:
+                    # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        return entries
+
+    def size(self):
+        '''total size of the entries in bytes'''
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        '''delete the least recently used entries until the cache is no
+        larger than max_bytes'''
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(filename)
+            total -= size
+        self._size = total
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
@@ -1,11 +1,12 @@
-from pkgutil import get_data
 import pandas as pd
+from datetime import datetime, timedelta
 from mtatracking_v2.subway_system_analyzer import (
     historicTrainDelays,
     getLatestSavedLinedefinition)
 from mtatracking_v2.models import (Line,
                                    Line_stops,
                                    Stop)
+from mtatracking_v2.queries import getQuery
 import numpy as np
 
 
@@ -39,7 +40,7 @@ def getTransitTimeMatrix(origin_id, dest_id, line_id, direction,
                                 Specify an hour of day for which you want to
                                 retrieve them.
         linedef_day (String): One of 'Weekday', 'Saturday', or 'Sunday'.
-        session: the SQLAlchemy database session.
+        session: the SQLAlchemy database session, or a DuckDBSource.
 
     Returns:
         features, labels: dataframe of features. labels are the observed
@@ -52,24 +53,18 @@ def getTransitTimeMatrix(origin_id, dest_id, line_id, direction,
     for f_line_id in line_ids_features:
         for f_direction in directions_features:
             print('working on: ' + f_line_id + f_direction)
-            sqltext = get_data(
-                'mtatracking_v2', 'sql_queries/featurematrix_transitTime.sql')
-            transit_times_matrix = session.execute(
-                sqltext.decode("utf-8").format(
-                    origin_id,
-                    dest_id,
-                    line_id,
-                    direction,
-                    time_start,
-                    time_end,
-                    f_line_id,
-                    f_direction,
-                    linedef_hour,
-                    linedef_day
-                    )
-                )
-            df = pd.DataFrame(transit_times_matrix.fetchall(),
-                              columns=transit_times_matrix.keys())
+            df = getQuery('featurematrix_transitTime').frame(
+                session,
+                origin_id=origin_id,
+                dest_id=dest_id,
+                line_id=line_id,
+                direction=direction,
+                time_start=time_start,
+                time_end=time_end,
+                feature_line_id=f_line_id,
+                feature_direction=f_direction,
+                linedef_hour=linedef_hour,
+                linedef_day=linedef_day)
             df.set_index(['origin_time',
                           'train_unique_num',
                           'transit_time',
@@ -106,7 +101,7 @@ def getTransitTimeMatrix(origin_id, dest_id, line_id, direction,
 
 
 def getMedianTransitTimeMatrix(line_id, direction, time_start,
-                               time_end, timestamps, session):
+                               time_end, timestamps, session, cache=None):
     '''get the median transit times (from stasi fits)
     between each pair of stations in line_id and direction
     for each timestamp in 'timestamps'
@@ -123,12 +118,14 @@ def getMedianTransitTimeMatrix(line_id, direction, time_start,
                                        transit times. The feature matrix will
                                        have one row for each of these.
         session: the SQLAlchemy database session.
+        cache (fit_cache.FitCache): cache of fit results
+                                    (see historicTrainDelays)
 
 
     Returns: features
     '''
     htd = historicTrainDelays(line_id, direction,
-                              time_start, time_end, session)
+                              time_start, time_end, session, cache)
     station_ids = getLatestSavedLinedefinition(line_id, direction, session)
     stations = session.query(Stop).filter(Stop.id.in_(station_ids)).all()
 
@@ -147,20 +144,33 @@ def getMedianTransitTimeMatrix(line_id, direction, time_start,
 
 
 def get_MTA_predicted_transit_time(
-        train_unique_num, origin_id, dest_id, session):
-
-    sqltext = get_data(
-        'mtatracking_v2', 'sql_queries/mta_predicted_transit_time.sql')
-    transit_times_matrix = session.execute(
-        sqltext.decode("utf-8").format(
-            train_unique_num,
-            origin_id,
-            dest_id
-            )
-        )
-    df = pd.DataFrame(transit_times_matrix.fetchall(),
-                      columns=transit_times_matrix.keys())
-    return df
+        train_unique_num, origin_id, dest_id, session, archive=None):
+    '''the arrival time at dest_id that the MTA predicted for a train when
+    it left origin_id.
+
+    Args:
+        train_unique_num (string): unique_num of the train
+        origin_id (string): id of the origin station
+        dest_id (string): id of the destination station
+        session: the SQLAlchemy database session.
+        archive (StopTimeUpdateArchive): where the old Stop_time_update
+            rows are archived (see archive.py). If the trip is old enough
+            to be archived, search the archive as well as the database.
+
+    Returns:
+        pd.DataFrame with columns mta_predicted_arr_time, origin_time,
+        mta_predicted_transit_time
+    '''
+    if archive is not None:
+        trip_date = datetime.strptime(train_unique_num[:8], '%Y%m%d')
+        if archive.covers(trip_date - timedelta(days=1)):
+            return archive.mtaPredictedTransitTime(
+                session, train_unique_num, origin_id, dest_id)
+    return getQuery('mta_predicted_transit_time').frame(
+        session,
+        train_unique_num=train_unique_num,
+        origin_id=origin_id,
+        dest_id=dest_id)
 
 
 def get_current_features_NOW(origin_id, dest_id, line_id, direction,
@@ -173,18 +183,12 @@ def get_current_features_NOW(origin_id, dest_id, line_id, direction,
             print('working on: ' + f_line_id + f_direction)
             print(linedef_day)
             print(linedef_hour)
-            sqltext = get_data(
-                'mtatracking_v2', 'sql_queries/features_now.sql')
-            transit_times_matrix = session.execute(
-                sqltext.decode("utf-8").format(
-                    f_line_id,
-                    f_direction,
-                    linedef_hour,
-                    linedef_day
-                    )
-                )
-            df = pd.DataFrame(transit_times_matrix.fetchall(),
-                              columns=transit_times_matrix.keys())
+            df = getQuery('features_now').frame(
+                session,
+                line_id=f_line_id,
+                direction=f_direction,
+                linedef_hour=linedef_hour,
+                linedef_day=linedef_day)
             df.set_index(['origin_time',
                           'stop_id'], inplace=True)
 
@@ -213,18 +217,13 @@ def get_current_features_NOW(origin_id, dest_id, line_id, direction,
 
     features = pd.concat(list(feature_dfs.values()), axis=1)
     # add the last feature: the transit time the MTA predicts
-    sqltext = get_data('mtatracking_v2', 'sql_queries/MTApredictionNow.sql')
     print('get last feature')
-    transit_times_matrix = session.execute(
-                        sqltext.decode("utf-8").format(
-                            line_id,
-                            direction,
-                            origin_id,
-                            dest_id
-                        )
-    )
-    df = pd.DataFrame(transit_times_matrix.fetchall(),
-                      columns=transit_times_matrix.keys())
+    df = getQuery('MTApredictionNow').frame(
+        session,
+        line_id=line_id,
+        direction=direction,
+        origin_id=origin_id,
+        dest_id=dest_id)
     features['mta_prediction'] = df['transit_time'].dt.total_seconds()
 
     return features
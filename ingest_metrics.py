@@ -0,0 +1,150 @@
+'''Per-cycle metrics of the ingest loop.
+
+Every scraping cycle records timings (fetch time of each feed, parse time,
+processing and commit time), counters (entities by type, stop events,
+rows written per table) and gauges (fit queue depth, memory). The values of
+the last cycles are kept in rolling histograms and can be inspected through
+a local HTTP endpoint:
+
+    metrics = IngestMetrics()
+    metrics.serve(port=9100)
+    # curl localhost:9100/metrics
+'''
+
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class RollingHistogram:
+    """Keeps the last `window` observations of one metric."""
+
+    def __init__(self, window=360):
+        self.values = deque(maxlen=window)
+
+    def add(self, value):
+        self.values.append(value)
+
+    def summary(self):
+        '''count, mean, percentiles and max of the observations in the
+        window'''
+        if not self.values:
+            return {'count': 0}
+        v = np.asarray(self.values, dtype=float)
+        p50, p90, p99 = np.percentile(v, [50, 90, 99])
+        return {'count': len(v),
+                'mean': float(np.mean(v)),
+                'p50': float(p50),
+                'p90': float(p90),
+                'p99': float(p99),
+                'max': float(np.max(v))}
+
+
+class IngestMetrics:
+    """Structured metrics of the ingest loop.
+
+    Call startCycle() at the beginning of a cycle and endCycle() at its
+    end. In between, record values with timer(), count() and gauge().
+    """
+
+    def __init__(self, window=360):
+        '''Create IngestMetrics
+
+        Args:
+            window (int): number of cycles kept in the rolling histograms.
+        '''
+        self.window = window
+        self.histograms = defaultdict(lambda: RollingHistogram(self.window))
+        self.cycles = 0
+        self.last_cycle = {}
+        self._current = self._emptyCycle()
+        # the HTTP endpoint reads from another thread
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _emptyCycle(self):
+        return {'timings': defaultdict(float),
+                'counts': defaultdict(int),
+                'gauges': {}}
+
+    def startCycle(self):
+        self._current = self._emptyCycle()
+        self._cycle_start = time.time()
+
+    @contextmanager
+    def timer(self, name):
+        '''time the enclosed block (in seconds). Repeated timings with the
+        same name within one cycle are added up.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._current['timings'][name] += time.perf_counter() - start
+
+    def count(self, name, n=1):
+        self._current['counts'][name] += n
+
+    def gauge(self, name, value):
+        self._current['gauges'][name] = value
+
+    def gauges(self, values, prefix=''):
+        '''record a dict of gauges'''
+        for name, value in values.items():
+            self.gauge(prefix + name, value)
+
+    def endCycle(self):
+        '''close the current cycle and add its values to the histograms'''
+        cycle = {'timestamp': time.time(),
+                 'timings': dict(self._current['timings']),
+                 'counts': dict(self._current['counts']),
+                 'gauges': dict(self._current['gauges'])}
+        with self._lock:
+            for kind in ('timings', 'counts', 'gauges'):
+                for name, value in cycle[kind].items():
+                    # booleans and other non-numbers only show up in
+                    # the last cycle
+                    if isinstance(value, (int, float))\
+                            and not isinstance(value, bool):
+                        self.histograms[kind + '.' + name].add(value)
+            self.last_cycle = cycle
+            self.cycles += 1
+
+    def snapshot(self):
+        '''last cycle and histogram summaries as a json-serializable dict'''
+        with self._lock:
+            return {'cycles': self.cycles,
+                    'last_cycle': self.last_cycle,
+                    'histograms': {name: h.summary() for name, h
+                                   in sorted(self.histograms.items())}}
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        '''serve snapshot() as json on http://host:port/metrics
+        from a daemon thread'''
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot(), default=str).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # do not clutter the scraper output with access logs
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self._server
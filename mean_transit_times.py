@@ -1,11 +1,19 @@
-from pkgutil import get_data
-from mtatracking_v2.STaSI import w1, fitSTaSIModel, sdevFromW1
+from mtatracking_v2.STaSI import w1, fitSTaSIModel, fitSTaSIModels, \
+    sdevFromW1, THRESHOLD
+from mtatracking_v2.queries import getQuery
+from mtatracking_v2.parquet_export import ParquetSource
 import numpy as np
+import pandas as pd
 from mtatracking_v2.models import Transit_time_fit
 from datetime import timedelta
 import sys
 sys.path.append('/home/tbartsch/source/repos')
 
+# columns that identify a segment in the result of
+# all_segment_transit_times.sql
+_SEGMENT_COLUMNS = ['line_id', 'direction', 'stop_id_origin',
+                    'stop_id_destination']
+
 
 def getTransitTimes(origin_id, dest_id, line_id,
                     time_start, time_end, session):
@@ -20,20 +28,72 @@ def getTransitTimes(origin_id, dest_id, line_id,
                                start the computation
         time_end (datetime): timepoint in the historic data at which to
                                stop the computation
-        session: the SQLAlchemy database session.
+        session: the SQLAlchemy database session, a ParquetSource
+                 or a DuckDBSource.
 
     Returns:
-        transit_times
+        transit_times (pd.DataFrame): columns unique_num, stop_time
+                                      (arrival at dest_id), transit_time
     '''
 
     if(time_end - time_start < timedelta(days=30)):
         print('warning: time should be at least one month')
-    sqltext = get_data('mtatracking_v2', 'sql_queries/transit_times.sql')
-    transit_times = session.execute(
-        sqltext.decode("utf-8").format(origin_id, dest_id, line_id,
-                                       time_start, time_end)
-        ).fetchall()
-    return transit_times
+    if isinstance(session, ParquetSource):
+        return session.transitTimes(origin_id, dest_id, line_id,
+                                    time_start, time_end)
+    return getQuery('transit_times').frame(
+        session, origin_id=origin_id, dest_id=dest_id, line_id=line_id,
+        time_start=time_start, time_end=time_end)
+
+
+def getSegmentTransitTimes(origin_id, dest_id, line_id,
+                           time_start, time_end, session):
+    '''Like getTransitTimes, but read the precomputed transit times of the
+    Segment_transit_time table instead of matching stops in Trains_stopped.
+    origin_id and dest_id have to be consecutive stops of the trains.
+
+    Returns:
+        transit_times (pd.DataFrame): columns unique_num, stop_time
+                                      (arrival at dest_id), transit_time
+    '''
+    if(time_end - time_start < timedelta(days=30)):
+        print('warning: time should be at least one month')
+    return getQuery('segment_transit_times').frame(
+        session, origin_id=origin_id, dest_id=dest_id, line_id=line_id,
+        time_start=time_start, time_end=time_end)
+
+
+def getAllSegmentTransitTimes(time_start, time_end, session,
+                              line_id=None):
+    '''Get the transit times of all pairs of adjacent stations, of all lines
+    and directions, with a single query.
+
+    Args:
+        time_start (datetime): timepoint in the historic data at which to
+                               start the computation
+        time_end (datetime): timepoint in the historic data at which to
+                               stop the computation
+        session: the SQLAlchemy database session, a ParquetSource
+                 or a DuckDBSource.
+        line_id (string): only get the segments of this line. All if None.
+
+    Returns:
+        dict of (line_id, direction, origin_id, dest_id):
+            pd.DataFrame with columns unique_num, stop_time
+            (arrival at dest_id), transit_time, like getTransitTimes
+    '''
+    if isinstance(session, ParquetSource):
+        df = session.allSegmentTransitTimes(time_start, time_end, line_id)
+    else:
+        df = getQuery('all_segment_transit_times').frame(
+            session, time_start=time_start, time_end=time_end,
+            line_id=line_id)
+    segments = {}
+    # the rows are sorted by segment, then by stop_time
+    for key, group in df.groupby(_SEGMENT_COLUMNS, sort=False, dropna=False):
+        segments[key] = group.drop(columns=_SEGMENT_COLUMNS)\
+            .reset_index(drop=True)
+    return segments
 
 
 def getTransitTimes_and_delay(origin_id, dest_id, line_id,
@@ -51,20 +111,21 @@ def getTransitTimes_and_delay(origin_id, dest_id, line_id,
                                start the computation
         time_end (datetime): timepoint in the historic data at which to
                                stop the computation
-        session: the SQLAlchemy database session.
+        session: the SQLAlchemy database session, a ParquetSource
+                 or a DuckDBSource.
 
     Returns:
-        transit_times, delays
+        transit_times (pd.DataFrame): columns stop_time, transit_time,
+                                      delayed
     '''
     if(time_end - time_start < timedelta(days=30)):
         print('warning: time should be at least one month')
-    sqltext = get_data('mtatracking_v2',
-                       'sql_queries/transit_times_and_delay.sql')
-    transit_times = session.execute(
-        sqltext.decode("utf-8").format(origin_id, dest_id, line_id,
-                                       time_start, time_end)
-        ).fetchall()
-    return transit_times
+    if isinstance(session, ParquetSource):
+        return session.transitTimes(origin_id, dest_id, line_id,
+                                    time_start, time_end, delay=True)
+    return getQuery('transit_times_and_delay').frame(
+        session, origin_id=origin_id, dest_id=dest_id, line_id=line_id,
+        time_start=time_start, time_end=time_end)
 
 
 def _removeShortStates(results, dt=timedelta(hours=4)):
@@ -113,12 +174,28 @@ def _removeShortStates(results, dt=timedelta(hours=4)):
     return results
 
 
-def computeMeanTransitTimes(transit_times):
+def computeMeanTransitTimes(transit_times, processes=1, incremental=None,
+                            cache=None, tolerance=None):
     '''Fit transit time data with the STaSI algorithm.
 
     Args:
-        transit_times: list of tuples (datetime, timedelta) describing
+        transit_times: pd.DataFrame with columns stop_time and transit_time
+                       (as returned by getTransitTimes), or a list of
+                       tuples (unique_num, datetime, timedelta) describing
                        transit time vs datetime
+        processes (int): number of worker processes for long time series
+                         (see STaSI.segmentizeDataParallel). 1 fits in this
+                         process, None uses one process per core.
+        incremental (STaSI.IncrementalSTaSI): if given, update the fit of
+                     the previous call with this object instead of
+                     fitting all transit times again.
+        cache (fit_cache.FitCache): if given, take the fit from this cache
+               if the same transit times were fitted before, and store new
+               fits in it. Not used for incremental fits.
+        tolerance (int): if given, find the transitions approximately on
+                         bins of this many transit times
+                         (see STaSI.segmentizeDataApproximate). Not used
+                         for incremental fits.
 
     Returns:
         (result (pandas.df), sdev):
@@ -129,43 +206,141 @@ def computeMeanTransitTimes(transit_times):
 
             sdev: standard deviation of entire (non-segmentized) trace
     '''
-    transit_times = np.array(transit_times)
-    if len(transit_times) < 2:
+    stamps, seconds, sigma = _prepareTransitTimes(transit_times)
+    if seconds is None:
         return None, None
-    to_seconds_vectorized = np.vectorize(lambda x: x.total_seconds())
-    transit_times_s = transit_times.copy()
-    transit_times_s[:, 2] = to_seconds_vectorized(transit_times[:, 2])
 
-    # Remove negative times:
-    transit_times_filtered = transit_times_s[
-        transit_times_s[:, 2] > 0]
-    if len(transit_times_filtered) < 2:
+    if incremental is not None:
+        fit, means, sdevs, results, MDLs = incremental.update(
+            seconds, stamps, return_fit=False)
+    else:
+        if cache is not None:
+            key = _cacheKey(cache, seconds, tolerance)
+            cached = cache.get(key)
+            if cached is not None:
+                results, sigma, MDLs = cached
+                return _datetimeResults(results, stamps), sigma
+        fit, means, sdevs, results, MDLs = fitSTaSIModel(
+            seconds, return_fit=False, processes=processes,
+            tolerance=tolerance)
+        if cache is not None and results is not None:
+            cache.put(key, results, sigma, MDLs)
+    if results is None:
         return None, None
+    return _datetimeResults(results, stamps), sigma
+
+
+def computeAllMeanTransitTimes(segments, processes=None, cache=None,
+                               tolerance=None):
+    '''Fit the transit times of many segments with the STaSI algorithm,
+    in parallel (see STaSI.fitSTaSIModels).
+
+    Args:
+        segments (dict): keys identify the segments, vals are transit
+                         times as accepted by computeMeanTransitTimes
+        processes (int): number of worker processes. One per core if None.
+        cache (fit_cache.FitCache): if given, only fit the segments whose
+               transit times are not in this cache, and store their fits
+               in it.
+        tolerance (int): see computeMeanTransitTimes
+
+    Returns:
+        (fits (dict), errors (dict)):
+            fits: keys of segments: (result, sdev) as returned by
+                  computeMeanTransitTimes
+            errors: keys of the segments that could not be fitted:
+                    description of the problem
+    '''
+    prepared = {}
+    errors = {}
+    fits = {}
+    for key, transit_times in segments.items():
+        stamps, seconds, sigma = _prepareTransitTimes(transit_times)
+        if seconds is None:
+            errors[key] = 'not enough transit times'
+            continue
+        if cache is not None:
+            cached = cache.get(_cacheKey(cache, seconds, tolerance))
+            if cached is not None:
+                table, sigma, _ = cached
+                fits[key] = (_datetimeResults(table, stamps), sigma)
+                continue
+        prepared[key] = (stamps, seconds, sigma)
+
+    MDLs = {}
+    results, fit_errors = fitSTaSIModels(
+        {key: seconds for key, (_, seconds, _) in prepared.items()},
+        processes, MDLs=MDLs, tolerance=tolerance)
+    errors.update(fit_errors)
+    for key, table in results.groupby('key', sort=False):
+        stamps, seconds, sigma = prepared[key]
+        table = table.drop(columns='key').reset_index(drop=True)
+        if cache is not None:
+            cache.put(_cacheKey(cache, seconds, tolerance), table, sigma,
+                      MDLs[key])
+        fits[key] = (_datetimeResults(table, stamps), sigma)
+    return fits, errors
+
+
+def _cacheKey(cache, seconds, tolerance):
+    '''the cache key of a full fit of seconds. It holds every parameter
+    that changes the cached results, so that e.g. approximate fits are
+    never taken for exact ones.'''
+    return cache.key(seconds, tolerance=tolerance, threshold=THRESHOLD,
+                     return_fit=False, incremental=False)
+
+
+def _prepareTransitTimes(transit_times):
+    '''Time stamps and transit times (in seconds) to fit, without
+    negative transit times and outliers, and the standard deviation of
+    the transit times.
+
+    Returns:
+        (stamps, seconds, sigma) (np.array, np.array, float):
+            (None, None, None) if there is nothing to fit
+    '''
+    if isinstance(transit_times, pd.DataFrame):
+        stamps = transit_times['stop_time'].to_numpy()
+        seconds = transit_times['transit_time'].dt.total_seconds()\
+            .to_numpy()
+    else:
+        transit_times = np.array(transit_times)
+        if len(transit_times) < 2:
+            return None, None, None
+        stamps = transit_times[:, 1]
+        seconds = np.array([t.total_seconds() for t in transit_times[:, 2]])
+    if len(seconds) < 2:
+        return None, None, None
+
+    # Remove negative times:
+    positive = seconds > 0
+    stamps = stamps[positive]
+    seconds = seconds[positive]
+    if len(seconds) < 2:
+        return None, None, None
 
     # remove outliers 40 sigma beyond mean.
-    w1s = w1(transit_times_filtered[:, 2])
+    w1s = w1(seconds)
     sigma = sdevFromW1(w1s)
     if sigma == 0:
-        return None, None
+        return None, None, None
 
-    transit_times_filtered = transit_times_filtered[(
-        np.abs((transit_times_filtered[:, 2]) - np.median(
-            (transit_times_filtered[:, 2]))) < 40 * sigma)
-            ]
+    inliers = np.abs(seconds - np.median(seconds)) < 40 * sigma
+    stamps = stamps[inliers]
+    seconds = seconds[inliers]
     # if the time series is zero, return None
-    if len(transit_times_filtered) == 0:
-        return None, None
+    if len(seconds) == 0:
+        return None, None, None
+    return stamps, seconds, sigma
 
-    fit, means, sdevs, results, MDLs = fitSTaSIModel(
-        transit_times_filtered[:, 2])
-    if results is None:
-        return None, None
+
+def _datetimeResults(results, stamps):
+    '''replace the start and stop indices of the fit results by the time
+    stamps of these points, and remove short states'''
     # currently the results dataframe contains indices;
     # make those into time stamps.
-    start_stamps = np.asarray(
-        transit_times_filtered[:, 1])[results['start'].values]
-    stop_stamps = np.asarray(
-        transit_times_filtered[:, 1])[results['stop'].values]
+    start_stamps = stamps[results['start'].values]
+    stop_stamps = stamps[results['stop'].values]
     results['seg_start_datetime'] = start_stamps
     results['seg_end_datetime'] = stop_stamps
     results = results.drop('start', axis=1)
@@ -173,7 +348,7 @@ def computeMeanTransitTimes(transit_times):
 
     results = _removeShortStates(results)
 
-    return results, sigma
+    return results
 
 
 def populate_database_with_fit_results(session, results, sdev, origin_id,
@@ -205,3 +380,34 @@ def populate_database_with_fit_results(session, results, sdev, origin_id,
     session.commit()
     print('deposited ' + origin_id + ' to ' + destination_id)
     return newfit
+
+
+def refitAllSegments(time_start, time_end, session, line_id=None,
+                     processes=None):
+    '''Fit the transit times of all pairs of adjacent stations and save
+    the fits in the database. Reads Trains_stopped only once and fits the
+    segments in parallel.
+
+    Args:
+        time_start (datetime): start of the fitted data
+        time_end (datetime): end of the fitted data
+        session: the SQLAlchemy database session.
+        line_id (string): only fit the segments of this line. All if None.
+        processes (int): number of worker processes. One per core if None.
+
+    Returns:
+        list of the new Transit_time_fit objects
+    '''
+    segments = getAllSegmentTransitTimes(time_start, time_end, session,
+                                         line_id)
+    results, errors = computeAllMeanTransitTimes(segments, processes)
+    for key, error in errors.items():
+        print('could not fit ' + ' '.join(str(k) for k in key) + ': '
+              + error)
+    fits = []
+    for (line, direction, origin_id, dest_id), (res, sdev) in \
+            results.items():
+        fits.append(populate_database_with_fit_results(
+            session, res, sdev, origin_id, dest_id, line, direction,
+            time_start, time_end))
+    return fits
@@ -0,0 +1,102 @@
+'''Versioned schema migrations.
+
+Migrations are the numbered SQL files in migrations/ (e.g.
+0001_hot_query_indexes.sql). They are applied in order, each in its own
+transaction, and recorded in the Schema_migration table so that every
+migration runs exactly once per database.
+
+Databases created from scratch by create_tables.py already have the schema
+of models.py; create_tables.py therefore only stamps them as migrated.
+'''
+
+import os
+import sys
+from datetime import datetime
+from pkgutil import get_data
+from db import makeSessionFactory
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+
+
+def availableMigrations():
+    '''Return the migrations that ship with this package.
+
+    Returns:
+        list of (version (int), filename) sorted by version
+    '''
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        if filename.endswith('.sql'):
+            migrations.append((int(filename.split('_')[0]), filename))
+    return sorted(migrations)
+
+
+def _createMigrationTable(session):
+    session.execute(
+        'CREATE TABLE IF NOT EXISTS public."Schema_migration" ('
+        'version INTEGER PRIMARY KEY, '
+        'name VARCHAR NOT NULL, '
+        'applied_at TIMESTAMP NOT NULL)')
+    session.commit()
+
+
+def appliedMigrations(session):
+    '''Return the set of migration versions applied to the database'''
+    _createMigrationTable(session)
+    return set(v for v, in session.execute(
+        'SELECT version FROM public."Schema_migration"'))
+
+
+def _recordMigration(session, version, filename):
+    session.execute(
+        'INSERT INTO public."Schema_migration" (version, name, applied_at) '
+        'VALUES (:version, :name, :applied_at)',
+        {'version': version, 'name': filename,
+         'applied_at': datetime.now()})
+
+
+def applyMigrations(session, target=None):
+    '''Apply all pending migrations (up to and including version target).
+
+    Args:
+        session: SQLAlchemy session bound to the database.
+        target (int): last version to apply. All if None.
+
+    Returns:
+        list of filenames of the migrations we applied
+    '''
+    done = appliedMigrations(session)
+    applied = []
+    for version, filename in availableMigrations():
+        if version in done or (target is not None and version > target):
+            continue
+        print('applying migration ' + filename)
+        sqltext = get_data('mtatracking_v2', 'migrations/' + filename)
+        try:
+            session.execute(sqltext.decode("utf-8"))
+            _recordMigration(session, version, filename)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        applied.append(filename)
+    return applied
+
+
+def stampMigrations(session):
+    '''Mark all migrations as applied without running them. Use this for
+    databases whose tables were just created from models.py.'''
+    done = appliedMigrations(session)
+    for version, filename in availableMigrations():
+        if version not in done:
+            _recordMigration(session, version, filename)
+    session.commit()
+
+
+if __name__ == '__main__':
+    print("Enter database name: ")
+    name = sys.stdin.readline()
+    Session = makeSessionFactory(name)
+    session = Session()
+    applied = applyMigrations(session)
+    print('applied ' + str(len(applied)) + ' migrations')
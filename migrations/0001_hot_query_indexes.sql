@@ -0,0 +1,31 @@
+/* Indexes for the hot analytical queries in sql_queries/ and for the
+fit lookups in getMedianTravelTime. These are also declared in models.py.
+Building them locks the tables for writes, so stop the scraper first. */
+
+CREATE INDEX IF NOT EXISTS "ix_Trains_stopped_stop_id_stop_time"
+    ON public."Trains_stopped" (stop_id, stop_time);
+CREATE INDEX IF NOT EXISTS "ix_Trains_stopped_trip_update_id"
+    ON public."Trains_stopped" (trip_update_id);
+CREATE INDEX IF NOT EXISTS "ix_Trains_stopped_train_unique_num_stop_id"
+    ON public."Trains_stopped" (train_unique_num, stop_id);
+
+CREATE INDEX IF NOT EXISTS "ix_Trip_update_line_id_direction"
+    ON public."Trip_update" (line_id, direction);
+CREATE INDEX IF NOT EXISTS "ix_Trip_update_train_unique_num"
+    ON public."Trip_update" (train_unique_num);
+
+CREATE INDEX IF NOT EXISTS "ix_Stop_time_update_trip_update_id_stop_id"
+    ON public."Stop_time_update" (trip_update_id, stop_id);
+
+CREATE INDEX IF NOT EXISTS "ix_Transit_time_fit_line_origin_destination_end"
+    ON public."Transit_time_fit"
+    (line_id, stop_id_origin, stop_id_destination, fit_end_datetime);
+
+CREATE INDEX IF NOT EXISTS "ix_Mean_transit_time_fit_id"
+    ON public."Mean_transit_time" (fit_id);
+
+ANALYZE public."Trains_stopped";
+ANALYZE public."Trip_update";
+ANALYZE public."Stop_time_update";
+ANALYZE public."Transit_time_fit";
+ANALYZE public."Mean_transit_time";
@@ -0,0 +1,140 @@
+/* Convert Stop_time_update, Vehicle_message and Trains_stopped into tables
+that are range-partitioned by month on their timestamp column
+(requires Postgres 11 or later). The partition key has to be part of the
+primary key, so the primary keys become (id, <timestamp>).
+Existing rows are copied into one partition per month. New partitions are
+created ahead of time by partitions.rotatePartitions; rows outside of all
+monthly partitions end up in the _default partition.
+Stop the scraper before running this migration. */
+
+/* The partition keys become part of the primary keys, so they must not be
+NULL. Older Stop_time_update rows may lack effective_timestamp; use the
+timestamp of their trip update, or else the predicted arrival or
+departure time. Trains_stopped rows without stop_time get the timestamp
+of their trip update. Rows that still have no timestamp cannot be
+assigned to a month and are deleted. */
+UPDATE public."Stop_time_update" AS stu
+    SET effective_timestamp = COALESCE(
+        (SELECT tu.effective_timestamp FROM public."Trip_update" AS tu
+         WHERE tu.id = stu.trip_update_id),
+        stu.arrival_time, stu.departure_time)
+    WHERE stu.effective_timestamp IS NULL;
+DELETE FROM public."Stop_time_update" WHERE effective_timestamp IS NULL;
+
+UPDATE public."Trains_stopped" AS ts
+    SET stop_time = tu.effective_timestamp
+    FROM public."Trip_update" AS tu
+    WHERE ts.trip_update_id = tu.id AND ts.stop_time IS NULL;
+DELETE FROM public."Trains_stopped" WHERE stop_time IS NULL;
+DELETE FROM public."Vehicle_message" WHERE effective_timestamp IS NULL;
+
+/* the old tables are dropped before the primary keys are added:
+make sure that adding them cannot fail */
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM public."Stop_time_update"
+               WHERE effective_timestamp IS NULL)
+       OR EXISTS (SELECT 1 FROM public."Trains_stopped"
+                  WHERE stop_time IS NULL)
+       OR EXISTS (SELECT 1 FROM public."Vehicle_message"
+                  WHERE effective_timestamp IS NULL) THEN
+        RAISE EXCEPTION 'NULL partition keys left, not partitioning';
+    END IF;
+END
+$$;
+
+ALTER TABLE public."Stop_time_update" RENAME TO "Stop_time_update_unpartitioned";
+ALTER TABLE public."Vehicle_message" RENAME TO "Vehicle_message_unpartitioned";
+ALTER TABLE public."Trains_stopped" RENAME TO "Trains_stopped_unpartitioned";
+
+CREATE TABLE public."Stop_time_update" (
+    LIKE public."Stop_time_update_unpartitioned" INCLUDING DEFAULTS
+) PARTITION BY RANGE (effective_timestamp);
+CREATE TABLE public."Vehicle_message" (
+    LIKE public."Vehicle_message_unpartitioned" INCLUDING DEFAULTS
+) PARTITION BY RANGE (effective_timestamp);
+CREATE TABLE public."Trains_stopped" (
+    LIKE public."Trains_stopped_unpartitioned" INCLUDING DEFAULTS
+) PARTITION BY RANGE (stop_time);
+
+/* one partition for every month that has data, plus a default partition */
+DO $$
+DECLARE
+    t RECORD;
+    first_month DATE;
+    last_month DATE;
+    m DATE;
+BEGIN
+    FOR t IN SELECT * FROM (VALUES
+            ('Stop_time_update', 'effective_timestamp'),
+            ('Vehicle_message', 'effective_timestamp'),
+            ('Trains_stopped', 'stop_time')) AS v(tbl, col)
+    LOOP
+        EXECUTE 'SELECT date_trunc(''month'', min(' || quote_ident(t.col)
+            || '))::date, date_trunc(''month'', max(' || quote_ident(t.col)
+            || '))::date FROM public.'
+            || quote_ident(t.tbl || '_unpartitioned')
+            INTO first_month, last_month;
+        m := first_month;
+        WHILE m IS NOT NULL AND m <= last_month LOOP
+            EXECUTE 'CREATE TABLE public.'
+                || quote_ident(t.tbl || '_' || to_char(m, 'YYYY_MM'))
+                || ' PARTITION OF public.' || quote_ident(t.tbl)
+                || ' FOR VALUES FROM (' || quote_literal(m::timestamp)
+                || ') TO (' || quote_literal((m + interval '1 month')::timestamp)
+                || ')';
+            m := (m + interval '1 month')::date;
+        END LOOP;
+        EXECUTE 'CREATE TABLE public.' || quote_ident(t.tbl || '_default')
+            || ' PARTITION OF public.' || quote_ident(t.tbl) || ' DEFAULT';
+    END LOOP;
+END
+$$;
+
+INSERT INTO public."Stop_time_update"
+    SELECT * FROM public."Stop_time_update_unpartitioned";
+INSERT INTO public."Vehicle_message"
+    SELECT * FROM public."Vehicle_message_unpartitioned";
+INSERT INTO public."Trains_stopped"
+    SELECT * FROM public."Trains_stopped_unpartitioned";
+
+/* the id sequences are owned by the old tables.
+Hand them over before we drop the old tables. */
+ALTER SEQUENCE public."Stop_time_update_id_seq"
+    OWNED BY public."Stop_time_update".id;
+ALTER SEQUENCE public."Vehicle_message_id_seq"
+    OWNED BY public."Vehicle_message".id;
+ALTER SEQUENCE public."Trains_stopped_id_seq"
+    OWNED BY public."Trains_stopped".id;
+
+DROP TABLE public."Stop_time_update_unpartitioned";
+DROP TABLE public."Vehicle_message_unpartitioned";
+DROP TABLE public."Trains_stopped_unpartitioned";
+
+ALTER TABLE public."Stop_time_update"
+    ADD PRIMARY KEY (id, effective_timestamp),
+    ADD FOREIGN KEY (trip_update_id) REFERENCES public."Trip_update" (id),
+    ADD FOREIGN KEY (stop_id) REFERENCES public."Stop" (id);
+ALTER TABLE public."Vehicle_message"
+    ADD PRIMARY KEY (id, effective_timestamp),
+    ADD FOREIGN KEY (train_unique_num) REFERENCES public."Train" (unique_num),
+    ADD FOREIGN KEY (stop_id) REFERENCES public."Stop" (id);
+ALTER TABLE public."Trains_stopped"
+    ADD PRIMARY KEY (id, stop_time),
+    ADD FOREIGN KEY (stop_id) REFERENCES public."Stop" (id),
+    ADD FOREIGN KEY (train_unique_num) REFERENCES public."Train" (unique_num),
+    ADD FOREIGN KEY (trip_update_id) REFERENCES public."Trip_update" (id);
+
+/* indexes of migration 0001, now created on every partition */
+CREATE INDEX "ix_Trains_stopped_stop_id_stop_time"
+    ON public."Trains_stopped" (stop_id, stop_time);
+CREATE INDEX "ix_Trains_stopped_trip_update_id"
+    ON public."Trains_stopped" (trip_update_id);
+CREATE INDEX "ix_Trains_stopped_train_unique_num_stop_id"
+    ON public."Trains_stopped" (train_unique_num, stop_id);
+CREATE INDEX "ix_Stop_time_update_trip_update_id_stop_id"
+    ON public."Stop_time_update" (trip_update_id, stop_id);
+
+ANALYZE public."Stop_time_update";
+ANALYZE public."Vehicle_message";
+ANALYZE public."Trains_stopped";
@@ -0,0 +1,89 @@
+/* Give Train and Trip_update integer primary keys and use them as foreign
+keys in the large tables. The natural keys (Train.unique_num and the old
+Trip_update.id, now Trip_update.trip_key) are kept as unique columns.
+Stop the scraper before running this migration. */
+
+/* new primary key columns. SERIAL numbers the existing rows. */
+ALTER TABLE public."Trip_update" RENAME COLUMN id TO trip_key;
+ALTER TABLE public."Trip_update" ADD COLUMN id SERIAL;
+ALTER TABLE public."Train" ADD COLUMN id SERIAL;
+
+/* integer foreign keys, filled in from the natural keys */
+ALTER TABLE public."Trip_update" ADD COLUMN train_id INTEGER;
+UPDATE public."Trip_update" AS tu SET train_id = t.id
+    FROM public."Train" AS t WHERE tu.train_unique_num = t.unique_num;
+
+ALTER TABLE public."Stop_time_update"
+    RENAME COLUMN trip_update_id TO trip_key;
+ALTER TABLE public."Stop_time_update" ADD COLUMN trip_update_id INTEGER;
+UPDATE public."Stop_time_update" AS stu SET trip_update_id = tu.id
+    FROM public."Trip_update" AS tu WHERE stu.trip_key = tu.trip_key;
+
+ALTER TABLE public."Trains_stopped" RENAME COLUMN trip_update_id TO trip_key;
+ALTER TABLE public."Trains_stopped" ADD COLUMN train_id INTEGER;
+ALTER TABLE public."Trains_stopped" ADD COLUMN trip_update_id INTEGER;
+UPDATE public."Trains_stopped" AS ts SET train_id = t.id
+    FROM public."Train" AS t WHERE ts.train_unique_num = t.unique_num;
+UPDATE public."Trains_stopped" AS ts SET trip_update_id = tu.id
+    FROM public."Trip_update" AS tu WHERE ts.trip_key = tu.trip_key;
+
+ALTER TABLE public."Vehicle_message" ADD COLUMN train_id INTEGER;
+UPDATE public."Vehicle_message" AS vm SET train_id = t.id
+    FROM public."Train" AS t WHERE vm.train_unique_num = t.unique_num;
+
+ALTER TABLE public."Alert_message" ADD COLUMN trip_update_id INTEGER;
+UPDATE public."Alert_message" AS am SET trip_update_id = tu.id
+    FROM public."Trip_update" AS tu WHERE am.trip_id = tu.trip_key;
+
+/* dropping the string columns also drops their foreign keys and the
+indexes of migration 0001 that contain them */
+ALTER TABLE public."Stop_time_update" DROP COLUMN trip_key;
+ALTER TABLE public."Trains_stopped" DROP COLUMN trip_key;
+ALTER TABLE public."Trains_stopped" DROP COLUMN train_unique_num;
+ALTER TABLE public."Vehicle_message" DROP COLUMN train_unique_num;
+ALTER TABLE public."Alert_message" DROP COLUMN trip_id;
+ALTER TABLE public."Trip_update" DROP COLUMN train_unique_num;
+
+/* swap the primary keys */
+ALTER TABLE public."Train" DROP CONSTRAINT "Train_pkey";
+ALTER TABLE public."Train" ADD PRIMARY KEY (id);
+CREATE UNIQUE INDEX "ix_Train_unique_num" ON public."Train" (unique_num);
+
+ALTER TABLE public."Trip_update" DROP CONSTRAINT "Trip_update_pkey";
+ALTER TABLE public."Trip_update" ADD PRIMARY KEY (id);
+CREATE UNIQUE INDEX "ix_Trip_update_trip_key"
+    ON public."Trip_update" (trip_key);
+
+/* foreign keys */
+ALTER TABLE public."Trip_update"
+    ALTER COLUMN train_id SET NOT NULL,
+    ADD FOREIGN KEY (train_id) REFERENCES public."Train" (id);
+ALTER TABLE public."Stop_time_update"
+    ALTER COLUMN trip_update_id SET NOT NULL,
+    ADD FOREIGN KEY (trip_update_id) REFERENCES public."Trip_update" (id);
+ALTER TABLE public."Trains_stopped"
+    ALTER COLUMN train_id SET NOT NULL,
+    ADD FOREIGN KEY (train_id) REFERENCES public."Train" (id),
+    ADD FOREIGN KEY (trip_update_id) REFERENCES public."Trip_update" (id);
+ALTER TABLE public."Vehicle_message"
+    ALTER COLUMN train_id SET NOT NULL,
+    ADD FOREIGN KEY (train_id) REFERENCES public."Train" (id);
+ALTER TABLE public."Alert_message"
+    ALTER COLUMN trip_update_id SET NOT NULL,
+    ADD FOREIGN KEY (trip_update_id) REFERENCES public."Trip_update" (id);
+
+/* indexes of migration 0001, on the integer keys */
+CREATE INDEX "ix_Trip_update_train_id" ON public."Trip_update" (train_id);
+CREATE INDEX "ix_Stop_time_update_trip_update_id_stop_id"
+    ON public."Stop_time_update" (trip_update_id, stop_id);
+CREATE INDEX "ix_Trains_stopped_trip_update_id"
+    ON public."Trains_stopped" (trip_update_id);
+CREATE INDEX "ix_Trains_stopped_train_id_stop_id"
+    ON public."Trains_stopped" (train_id, stop_id);
+
+ANALYZE public."Train";
+ANALYZE public."Trip_update";
+ANALYZE public."Stop_time_update";
+ANALYZE public."Trains_stopped";
+ANALYZE public."Vehicle_message";
+ANALYZE public."Alert_message";
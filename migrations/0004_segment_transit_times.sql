@@ -0,0 +1,44 @@
+/* Derived table of the transit times of trains between consecutive stops of
+a trip. The scraper appends to it; segment_transit_times.py rebuilds it.
+Fill it from the existing Trains_stopped rows with the same query as
+sql_queries/rebuild_segment_transit_times.sql. */
+
+CREATE TABLE public."Segment_transit_time" (
+    id SERIAL PRIMARY KEY,
+    train_id INTEGER NOT NULL REFERENCES public."Train" (id),
+    trip_update_id INTEGER NOT NULL REFERENCES public."Trip_update" (id),
+    line_id VARCHAR NOT NULL,
+    direction VARCHAR NOT NULL,
+    stop_id_origin VARCHAR NOT NULL REFERENCES public."Stop" (id),
+    stop_id_destination VARCHAR NOT NULL REFERENCES public."Stop" (id),
+    origin_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    arrival_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    transit_seconds DOUBLE PRECISION NOT NULL
+);
+
+INSERT INTO public."Segment_transit_time" (train_id, trip_update_id, line_id,
+    direction, stop_id_origin, stop_id_destination, origin_time, arrival_time,
+    transit_seconds)
+SELECT train_id, trip_update_id, line_id, direction, stop_id_origin,
+    stop_id_destination, origin_time, arrival_time,
+    EXTRACT(EPOCH FROM arrival_time - origin_time)
+FROM (SELECT ts.train_id, ts.trip_update_id, tu.line_id, tu.direction,
+        LAG(ts.stop_id) OVER w AS stop_id_origin,
+        ts.stop_id AS stop_id_destination,
+        LAG(ts.stop_time) OVER w AS origin_time,
+        ts.stop_time AS arrival_time
+    FROM public."Trains_stopped" AS ts
+        INNER JOIN public."Trip_update" AS tu
+        ON ts.trip_update_id = tu.id
+    WINDOW w AS (PARTITION BY ts.train_id, ts.trip_update_id
+                 ORDER BY ts.stop_time)
+    ) AS segments
+WHERE stop_id_origin IS NOT NULL
+    AND stop_id_origin <> stop_id_destination;
+
+/* created after the bulk insert, which is faster than maintaining it */
+CREATE INDEX "ix_Segment_transit_time_line_origin_destination_arrival"
+    ON public."Segment_transit_time"
+    (line_id, stop_id_origin, stop_id_destination, arrival_time);
+
+ANALYZE public."Segment_transit_time";
@@ -0,0 +1,26 @@
+/* Hourly statistics of the transit times and delays of every segment
+(pair of consecutive stops of a trip). The table starts out empty: the
+first call of segment_transit_times.refreshHourlyRollups fills it from
+Trains_stopped, later calls only recompute the latest hours. */
+
+CREATE TABLE public."Segment_hourly_rollup" (
+    id SERIAL PRIMARY KEY,
+    line_id VARCHAR NOT NULL,
+    direction VARCHAR,
+    stop_id_origin VARCHAR NOT NULL,
+    stop_id_destination VARCHAR NOT NULL,
+    hour TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    n_trains INTEGER NOT NULL,
+    median_seconds DOUBLE PRECISION,
+    p25_seconds DOUBLE PRECISION,
+    p75_seconds DOUBLE PRECISION,
+    p90_seconds DOUBLE PRECISION,
+    n_delayed INTEGER NOT NULL,
+    mean_delayed_magnitude DOUBLE PRECISION
+);
+
+CREATE UNIQUE INDEX "ix_Segment_hourly_rollup_line_direction_segment_hour"
+    ON public."Segment_hourly_rollup"
+    (line_id, direction, stop_id_origin, stop_id_destination, hour);
+CREATE INDEX "ix_Segment_hourly_rollup_hour"
+    ON public."Segment_hourly_rollup" (hour);
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
 from sqlalchemy.types import DateTime, Boolean, Time, Date, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -9,9 +9,16 @@ Base = declarative_base()
 
 class Stop_time_update(Base):
     __tablename__ = 'Stop_time_update'
+    __table_args__ = (
+        Index('ix_Stop_time_update_trip_update_id_stop_id',
+              'trip_update_id', 'stop_id'),
+        # monthly partitions, see partitions.py
+        {'postgresql_partition_by': 'RANGE (effective_timestamp)'}
+    )
 
-    id = Column(Integer, primary_key=True)
-    trip_update_id = Column(String,
+    # the partition key has to be part of the primary key
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    trip_update_id = Column(Integer,
                             ForeignKey('Trip_update.id'),
                             nullable=False)
     stop_id = Column(String, ForeignKey('Stop.id'),
@@ -20,7 +27,7 @@ class Stop_time_update(Base):
     departure_time = Column(DateTime, nullable=True)
     scheduled_track = Column(String, nullable=True)
     actual_track = Column(String, nullable=True)
-    effective_timestamp = Column(DateTime, nullable=True)
+    effective_timestamp = Column(DateTime, primary_key=True)
 
     trip_update = relationship('Trip_update',
                                back_populates='stop_time_updates')
@@ -40,11 +47,17 @@ class Stop_time_update(Base):
 
 class Trip_update(Base):
     __tablename__ = 'Trip_update'
+    __table_args__ = (
+        Index('ix_Trip_update_trip_key', 'trip_key', unique=True),
+        Index('ix_Trip_update_line_id_direction', 'line_id', 'direction'),
+        Index('ix_Trip_update_train_id', 'train_id'),
+    )
 
-    id = Column(String, primary_key=True)
+    id = Column(Integer, primary_key=True)
+    # natural key: train unique_num + ": " + trip_id
+    trip_key = Column(String, nullable=False)
     trip_id = Column(String, nullable=False)
-    train_unique_num = Column(String, ForeignKey('Train.unique_num'),
-                              nullable=False)
+    train_id = Column(Integer, ForeignKey('Train.id'), nullable=False)
     origin_date = Column(Date, nullable=False)
     origin_time = Column(Time, nullable=False)
     line_id = Column(String, nullable=False)
@@ -66,12 +79,12 @@ class Trip_update(Base):
                                    order_by='desc(Trains_stopped.id)',
                                    back_populates='trip_update')
 
-    def __init__(self, trip_id, train_unique_num, origin_date,
+    def __init__(self, trip_key, trip_id, train_id, origin_date,
                  origin_time, line_id,
                  direction, effective_timestamp, path=None):
-        self.id = train_unique_num + ": " + trip_id
+        self.trip_key = trip_key
         self.trip_id = trip_id
-        self.train_unique_num = train_unique_num
+        self.train_id = train_id
         self.origin_date = origin_date
         self.origin_time = origin_time
         self.line_id = line_id
@@ -79,12 +92,21 @@ class Trip_update(Base):
         self.effective_timestamp = effective_timestamp
         self.path = path
 
+    @staticmethod
+    def tripKey(train_unique_num, trip_id):
+        '''natural key of the trip trip_id of the train train_unique_num'''
+        return train_unique_num + ": " + trip_id
+
 
 class Train(Base):
     __tablename__ = 'Train'
+    __table_args__ = (
+        Index('ix_Train_unique_num', 'unique_num', unique=True),
+    )
 
-    # unique_num is start_date + train_id
-    unique_num = Column(String, primary_key=True)
+    id = Column(Integer, primary_key=True)
+    # natural key: start_date + train_id
+    unique_num = Column(String, nullable=False)
     route_id = Column(String, nullable=False)
     is_assigned = Column(Boolean, nullable=True)
     first_seen_timestamp = Column(DateTime, nullable=False)
@@ -193,17 +215,26 @@ class Trains_stopped(Base):
     '''junction table. Which trains stopped at what stops?
     When? Were they delayed?'''
     __tablename__ = 'Trains_stopped'
+    __table_args__ = (
+        Index('ix_Trains_stopped_stop_id_stop_time', 'stop_id', 'stop_time'),
+        Index('ix_Trains_stopped_trip_update_id', 'trip_update_id'),
+        Index('ix_Trains_stopped_train_id_stop_id',
+              'train_id', 'stop_id'),
+        # monthly partitions, see partitions.py
+        {'postgresql_partition_by': 'RANGE (stop_time)'}
+    )
 
-    id = Column(Integer, primary_key=True)
+    # the partition key has to be part of the primary key
+    id = Column(Integer, primary_key=True, autoincrement=True)
     stop_id = Column(String, ForeignKey('Stop.id'),
                      nullable=False)
-    train_unique_num = Column(String,
-                              ForeignKey('Train.unique_num'),
-                              nullable=False)
-    trip_update_id = Column(String,
+    train_id = Column(Integer,
+                      ForeignKey('Train.id'),
+                      nullable=False)
+    trip_update_id = Column(Integer,
                             ForeignKey('Trip_update.id'),
                             nullable=True)
-    stop_time = Column(DateTime, nullable=False)
+    stop_time = Column(DateTime, primary_key=True)
     delayed = Column(Boolean, nullable=False)
     delayed_magnitude = Column(Float, nullable=True)
     delayed_MTA = Column(Boolean, nullable=False)
@@ -212,11 +243,11 @@ class Trains_stopped(Base):
     stop = relationship('Stop', back_populates='trains_stopped_here')
     trip_update = relationship('Trip_update', back_populates='trip_stopped_at')
 
-    def __init__(self, id, stop_id, train_unique_num, trip_update_id,
+    def __init__(self, id, stop_id, train_id, trip_update_id,
                  stop_time, delayed, delayed_magnitude, delayed_MTA):
         self.id = id
         self.stop_id = stop_id
-        self.train_unique_num = train_unique_num
+        self.train_id = train_id
         self.trip_update_id = trip_update_id
         self.stop_time = stop_time
         self.delayed = delayed
@@ -224,12 +255,83 @@ class Trains_stopped(Base):
         self.delayed_MTA = delayed_MTA
 
     def __repr__(self):
-        return f'{self.train_unique_num}'\
+        return f'train {self.train_id}'\
             f' stopped at {self.stop_id} at {self.stop_time}'
 
 
+class Segment_transit_time(Base):
+    '''derived table: transit times of trains between consecutive stops
+    of a trip. Appended by the ingest loop whenever a train stops,
+    rebuilt in bulk from Trains_stopped by segment_transit_times.py.'''
+    __tablename__ = 'Segment_transit_time'
+    __table_args__ = (
+        Index('ix_Segment_transit_time_line_origin_destination_arrival',
+              'line_id', 'stop_id_origin', 'stop_id_destination',
+              'arrival_time'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    train_id = Column(Integer, ForeignKey('Train.id'), nullable=False)
+    trip_update_id = Column(Integer, ForeignKey('Trip_update.id'),
+                            nullable=False)
+    line_id = Column(String, nullable=False)
+    direction = Column(String, nullable=False)
+    stop_id_origin = Column(String, ForeignKey('Stop.id'), nullable=False)
+    stop_id_destination = Column(String, ForeignKey('Stop.id'),
+                                 nullable=False)
+    origin_time = Column(DateTime, nullable=False)
+    arrival_time = Column(DateTime, nullable=False)
+    transit_seconds = Column(Float, nullable=False)
+
+    def __init__(self, train_id, trip_update_id, line_id, direction,
+                 stop_id_origin, stop_id_destination, origin_time,
+                 arrival_time):
+        self.train_id = train_id
+        self.trip_update_id = trip_update_id
+        self.line_id = line_id
+        self.direction = direction
+        self.stop_id_origin = stop_id_origin
+        self.stop_id_destination = stop_id_destination
+        self.origin_time = origin_time
+        self.arrival_time = arrival_time
+        self.transit_seconds = (arrival_time - origin_time).total_seconds()
+
+
+class Segment_hourly_rollup(Base):
+    '''derived table: hourly statistics of the transit times and delays
+    of the trains between consecutive stops of a trip. Kept up to date by
+    segment_transit_times.refreshHourlyRollups.'''
+    __tablename__ = 'Segment_hourly_rollup'
+    __table_args__ = (
+        Index('ix_Segment_hourly_rollup_line_direction_segment_hour',
+              'line_id', 'direction', 'stop_id_origin',
+              'stop_id_destination', 'hour', unique=True),
+        Index('ix_Segment_hourly_rollup_hour', 'hour'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    line_id = Column(String, nullable=False)
+    direction = Column(String, nullable=True)
+    stop_id_origin = Column(String, nullable=False)
+    stop_id_destination = Column(String, nullable=False)
+    # start of the hour in which the trains arrived at the destination
+    hour = Column(DateTime, nullable=False)
+    n_trains = Column(Integer, nullable=False)
+    median_seconds = Column(Float, nullable=True)
+    p25_seconds = Column(Float, nullable=True)
+    p75_seconds = Column(Float, nullable=True)
+    p90_seconds = Column(Float, nullable=True)
+    n_delayed = Column(Integer, nullable=False)
+    mean_delayed_magnitude = Column(Float, nullable=True)
+
+
 class Transit_time_fit(Base):
     __tablename__ = 'Transit_time_fit'
+    __table_args__ = (
+        Index('ix_Transit_time_fit_line_origin_destination_end',
+              'line_id', 'stop_id_origin', 'stop_id_destination',
+              'fit_end_datetime'),
+    )
 
     id = Column(Integer, primary_key=True)
     stop_id_origin = Column(String,
@@ -275,6 +377,9 @@ class Transit_time_fit(Base):
 
 class Mean_transit_time(Base):
     __tablename__ = 'Mean_transit_time'
+    __table_args__ = (
+        Index('ix_Mean_transit_time_fit_id', 'fit_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     fit_id = Column(Integer, ForeignKey('Transit_time_fit.id'),
@@ -305,28 +410,32 @@ class Alert_message(Base):
     __tablename__ = 'Alert_message'
 
     id = Column(Integer, primary_key=True)
-    trip_id = Column(String, ForeignKey('Trip_update.id'),
-                     nullable=False)
+    trip_update_id = Column(Integer, ForeignKey('Trip_update.id'),
+                            nullable=False)
     header = Column(String, nullable=False)
     effective_timestamp = Column(DateTime, nullable=False)
 
     trip_update = relationship('Trip_update',
                                back_populates='alerts')
 
-    def __init__(self, trip_id, header, effective_timestamp):
-        self.trip_id = trip_id
+    def __init__(self, trip_update_id, header, effective_timestamp):
+        self.trip_update_id = trip_update_id
         self.header = header
         self.effective_timestamp = effective_timestamp
 
 
 class Vehicle_message(Base):
     __tablename__ = 'Vehicle_message'
+    # monthly partitions, see partitions.py
+    __table_args__ = (
+        {'postgresql_partition_by': 'RANGE (effective_timestamp)'},
+    )
 
-    id = Column(Integer, primary_key=True)
+    # the partition key has to be part of the primary key
+    id = Column(Integer, primary_key=True, autoincrement=True)
 
-    train_unique_num = Column(String, ForeignKey('Train.unique_num'),
-                              nullable=False)
-    effective_timestamp = Column(DateTime, nullable=False)
+    train_id = Column(Integer, ForeignKey('Train.id'), nullable=False)
+    effective_timestamp = Column(DateTime, primary_key=True)
     current_status = Column(String, nullable=True)
     stop_id = Column(String, ForeignKey('Stop.id'), nullable=True)
     last_moved_at = Column(DateTime, nullable=True)
@@ -337,9 +446,9 @@ class Vehicle_message(Base):
     stop = relationship('Stop',
                         back_populates='vehicle_messages')
 
-    def __init__(self, train_unique_num, current_status, stop_id,
+    def __init__(self, train_id, current_status, stop_id,
                  last_moved_at, current_stop_sequence, effective_timestamp):
-        self.train_unique_num = train_unique_num
+        self.train_id = train_id
         self.current_status = current_status
         self.stop_id = stop_id
         self.last_moved_at = last_moved_at
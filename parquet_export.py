@@ -0,0 +1,285 @@
+'''Export of the historical tables to Parquet, and analyses that read the
+export instead of the database.
+
+exportTables writes every table to its own directory. The large tables
+are split by day into hive-style partitions
+(e.g. Trains_stopped/date=2020-01-15/part-0.parquet), the small tables
+(trains, stops, line definitions and fits) are written as a whole. Columns are stored with compact
+types: dictionaries for repeated strings, 32 bit integers for the ids,
+float32 for measurements. The types are taken from the columns' types in
+the database (see tableSchema), so that all days of a table have the same
+schema and can be read as one dataset.
+
+A ParquetSource can be passed instead of a database session to
+getTransitTimes, getTransitTimes_and_delay and getAllSegmentTransitTimes.
+It only reads the columns and the days that a query needs.
+
+Reading and writing Parquet needs pyarrow.
+'''
+
+import os
+import sys
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy import inspect, types
+from mtatracking_v2.db import makeSessionFactory, queryFrame
+
+# keys: exported tables, vals: the timestamp column by whose date the
+# table is partitioned (None: not partitioned)
+EXPORT_TABLES = {
+    'Trains_stopped': 'stop_time',
+    'Trip_update': 'effective_timestamp',
+    'Stop_time_update': 'effective_timestamp',
+    'Segment_transit_time': 'arrival_time',
+    'Train': None,
+    'Stop': None,
+    'Line': None,
+    'Line_stops': None,
+    'Transit_time_fit': None,
+    'Mean_transit_time': None
+}
+
+PARTITION_COLUMN = 'date'
+
+# string columns that repeat a few distinct values: stored as dictionaries
+CATEGORICAL_COLUMNS = {'stop_id', 'stop_id_origin', 'stop_id_destination',
+                       'line_id', 'route_id', 'direction', 'path', 'day',
+                       'scheduled_track', 'actual_track'}
+
+
+def _arrowType(name, sql_type):
+    '''pyarrow type in which we store a column of SQL type sql_type'''
+    import pyarrow as pa
+    if isinstance(sql_type, types.Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, types.BigInteger):
+        return pa.int64()
+    if isinstance(sql_type, types.SmallInteger):
+        return pa.int16()
+    if isinstance(sql_type, types.Integer):
+        return pa.int32()
+    if isinstance(sql_type, types.Numeric):
+        return pa.float32()
+    if isinstance(sql_type, types.DateTime):
+        return pa.timestamp('us', tz='UTC' if sql_type.timezone else None)
+    if isinstance(sql_type, types.Date):
+        return pa.date32()
+    if isinstance(sql_type, types.Time):
+        return pa.time64('us')
+    if isinstance(sql_type, types.String):
+        if name in CATEGORICAL_COLUMNS:
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.string()
+    raise TypeError('cannot export column {0} of type {1}'.format(
+        name, sql_type))
+
+
+def tableSchema(session, table):
+    '''pyarrow schema of the export of table, derived from the types of
+    its columns in the database (not from the exported values)
+
+    Returns:
+        pyarrow.Schema
+    '''
+    # pyarrow is optional: only needed if we export
+    import pyarrow as pa
+    columns = inspect(session.connection()).get_columns(table,
+                                                        schema='public')
+    return pa.schema([pa.field(c['name'], _arrowType(c['name'], c['type']))
+                      for c in columns])
+
+
+def _writePart(df, directory, schema):
+    os.makedirs(directory, exist_ok=True)
+    df.to_parquet(os.path.join(directory, 'part-0.parquet'), index=False,
+                  schema=schema)
+
+
+def exportTable(session, path, table, time_start=None, time_end=None):
+    '''Export a table to path/table.
+
+    Args:
+        session: the SQLAlchemy database session.
+        path (string): directory of the export
+        table (string): name of the table (a key of EXPORT_TABLES)
+        time_start (datetime): first day to export (partitioned tables only)
+        time_end (datetime): export up to this day (exclusive).
+                             Today if None.
+
+    Returns:
+        number of exported rows
+    '''
+    column = EXPORT_TABLES[table]
+    directory = os.path.join(path, table)
+    schema = tableSchema(session, table)
+    if column is None:
+        df = queryFrame(session, 'SELECT * FROM public."{0}"'.format(table))
+        _writePart(df, directory, schema)
+        return len(df)
+
+    if time_end is None:
+        time_end = datetime.now()
+    day = time_start.date()
+    exported = 0
+    # one query per day, so that we never hold more than a day in memory.
+    # Days that are exported again are overwritten.
+    while day < time_end.date():
+        df = queryFrame(
+            session,
+            'SELECT * FROM public."{0}" WHERE {1} >= :day '
+            'AND {1} < :next_day'.format(table, column),
+            day=day, next_day=day + timedelta(days=1))
+        if len(df):
+            _writePart(df, os.path.join(
+                directory, '{0}={1}'.format(PARTITION_COLUMN, day)), schema)
+            exported += len(df)
+        day += timedelta(days=1)
+    return exported
+
+
+def exportTables(session, path, time_start, time_end=None,
+                 tables=EXPORT_TABLES):
+    '''Export tables to Parquet (see exportTable).
+
+    Returns:
+        dict of table name: number of exported rows
+    '''
+    return {table: exportTable(session, path, table, time_start, time_end)
+            for table in tables}
+
+
+class ParquetSource:
+    """An export written by exportTables, used instead of the database."""
+
+    def __init__(self, path):
+        '''Create a ParquetSource
+
+        Args:
+            path (string): directory of the export
+        '''
+        self.path = path
+
+    def read(self, table, columns=None, time_start=None, time_end=None,
+             filters=None):
+        '''read (part of) an exported table
+
+        Args:
+            table (string): name of the table
+            columns (list of string): only read these columns.
+                                      All if None.
+            time_start, time_end (datetime): only read the rows whose
+                timestamp (see EXPORT_TABLES) lies in between. Only the
+                partitions of these days are read.
+            filters (list of tuples): further filters, in the format of
+                                      pandas.read_parquet
+
+        Returns:
+            pd.DataFrame
+        '''
+        column = EXPORT_TABLES[table]
+        filters = list(filters or [])
+        if columns is not None and column is not None \
+                and column not in columns:
+            columns = list(columns) + [column]
+        if column is not None:
+            if time_start is not None:
+                filters.append((PARTITION_COLUMN, '>=',
+                                str(time_start.date())))
+                filters.append((column, '>=', time_start))
+            if time_end is not None:
+                filters.append((PARTITION_COLUMN, '<=',
+                                str(time_end.date())))
+                filters.append((column, '<', time_end))
+        df = pd.read_parquet(os.path.join(self.path, table),
+                             columns=columns, filters=filters or None)
+        if PARTITION_COLUMN in df.columns and column is not None:
+            df = df.drop(columns=PARTITION_COLUMN)
+        return df
+
+    def _trainsStopped(self, stop_ids, line_id, time_start, time_end,
+                       columns):
+        '''stops of the trains of line_id at stop_ids, from a day before
+        time_start to a day after time_end, with the trains' unique_num'''
+        stops = self.read(
+            'Trains_stopped',
+            ['train_id', 'trip_update_id', 'stop_id', 'stop_time']
+            + columns,
+            time_start - timedelta(days=1), time_end + timedelta(days=1),
+            filters=[('stop_id', 'in', stop_ids)])
+        trains = self.read('Train', ['id', 'unique_num'],
+                           filters=[('route_id', '==', line_id)])
+        stops = stops.merge(trains, left_on='train_id', right_on='id')
+        stops['stop_id'] = stops['stop_id'].astype(object)
+        return stops.dropna(subset=['trip_update_id'])
+
+    def transitTimes(self, origin_id, dest_id, line_id, time_start,
+                     time_end, delay=False):
+        '''transit times between two stations, like transit_times.sql
+        (or transit_times_and_delay.sql if delay)'''
+        extra = ['delayed'] if delay else []
+        stops = self._trainsStopped([origin_id, dest_id], line_id,
+                                    time_start, time_end, extra)
+        keys = ['unique_num', 'stop_id', 'trip_update_id']
+        # the last stop time is the real one (see transit_times.sql)
+        origin = stops[stops['stop_id'] == origin_id]\
+            .groupby(keys)['stop_time'].max().reset_index()
+        destination = stops[stops['stop_id'] == dest_id]\
+            .groupby(keys + extra, dropna=False)['stop_time'].max()\
+            .reset_index()
+        df = destination.merge(origin, on=['unique_num', 'trip_update_id'],
+                               suffixes=('', '_origin'))
+        df['transit_time'] = df['stop_time'] - df['stop_time_origin']
+        df = df[(df['stop_time'] > time_start) & (df['stop_time'] < time_end)]
+        if delay:
+            columns = ['stop_time', 'transit_time', 'delayed']
+        else:
+            columns = ['unique_num', 'stop_time', 'transit_time']
+        return df[columns].drop_duplicates().sort_values('stop_time')\
+            .reset_index(drop=True)
+
+    def allSegmentTransitTimes(self, time_start, time_end, line_id=None):
+        '''transit times of all adjacent segments,
+        like all_segment_transit_times.sql'''
+        stops = self.read(
+            'Trains_stopped',
+            ['train_id', 'trip_update_id', 'stop_id', 'stop_time'],
+            time_start - timedelta(days=1), time_end)
+        filters = None if line_id is None else [('line_id', '==', line_id)]
+        trips = self.read('Trip_update', ['id', 'line_id', 'direction'],
+                          filters=filters)
+        stops = stops.merge(trips, left_on='trip_update_id', right_on='id')\
+            .drop(columns='id')
+        stops['stop_id'] = stops['stop_id'].astype(object)
+        stops = stops.sort_values(['train_id', 'trip_update_id',
+                                   'stop_time'])
+        previous = stops.groupby(['train_id', 'trip_update_id'])
+        stops['stop_id_origin'] = previous['stop_id'].shift()
+        stops['transit_time'] = stops['stop_time']\
+            - previous['stop_time'].shift()
+        stops = stops[stops['stop_id_origin'].notna()
+                      & (stops['stop_id_origin'] != stops['stop_id'])
+                      & (stops['stop_time'] > time_start)]
+        trains = self.read('Train', ['id', 'unique_num'])
+        df = stops.merge(trains, left_on='train_id', right_on='id')\
+            .rename(columns={'stop_id': 'stop_id_destination'})
+        df = df[['line_id', 'direction', 'stop_id_origin',
+                 'stop_id_destination', 'unique_num', 'stop_time',
+                 'transit_time']]
+        for column in ['line_id', 'direction', 'unique_num']:
+            df[column] = df[column].astype(object)
+        return df.sort_values(['line_id', 'direction', 'stop_id_origin',
+                               'stop_id_destination', 'stop_time'])\
+            .reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    print("Enter database name: ")
+    name = sys.stdin.readline()
+    print("Enter export directory: ")
+    path = sys.stdin.readline().strip()
+    print("Enter first day to export (YYYY-MM-DD): ")
+    time_start = datetime.strptime(sys.stdin.readline().strip(), '%Y-%m-%d')
+    Session = makeSessionFactory(name)
+    session = Session()
+    for table, rows in exportTables(session, path, time_start).items():
+        print('exported ' + str(rows) + ' rows of ' + table)
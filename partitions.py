@@ -0,0 +1,160 @@
+'''Monthly range partitions of the high-volume tables.
+
+Stop_time_update, Vehicle_message and Trains_stopped are partitioned by
+month on their timestamp column (see
+migrations/0002_partition_high_volume_tables.sql). Queries that filter on
+that column only read the partitions of the requested time window.
+
+rotatePartitions creates the partitions of the coming months ahead of time
+and, given a retention period, detaches partitions that have become too
+old. Detached partitions stay in the database as plain tables
+(e.g. "Stop_time_update_2019_07") until they are archived or dropped.
+'''
+
+import re
+from datetime import date, datetime
+
+# keys: partitioned tables, vals: their partition key column
+PARTITIONED_TABLES = {
+    'Stop_time_update': 'effective_timestamp',
+    'Vehicle_message': 'effective_timestamp',
+    'Trains_stopped': 'stop_time'
+}
+
+
+def _monthStart(d):
+    return date(d.year, d.month, 1)
+
+
+def _addMonths(month, n):
+    '''first day of the month n months after month'''
+    m = month.month - 1 + n
+    return date(month.year + m // 12, m % 12 + 1, 1)
+
+
+def partitionName(table, month):
+    '''name of the partition of table that holds the rows of month'''
+    return '{0}_{1:%Y_%m}'.format(table, month)
+
+
+def createPartition(session, table, month):
+    '''create the partition of table for the month that contains the
+    date month (if it does not exist yet)'''
+    month = _monthStart(month)
+    session.execute(
+        'CREATE TABLE IF NOT EXISTS public."{0}" PARTITION OF public."{1}" '
+        'FOR VALUES FROM (\'{2}\') TO (\'{3}\')'.format(
+            partitionName(table, month), table,
+            month, _addMonths(month, 1)))
+
+
+def createDefaultPartition(session, table):
+    '''create the partition that catches rows outside of all monthly
+    partitions. It should stay empty, because a new monthly partition
+    cannot be created while the default partition holds rows in its range.
+    '''
+    session.execute(
+        'CREATE TABLE IF NOT EXISTS public."{0}_default" '
+        'PARTITION OF public."{0}" DEFAULT'.format(table))
+
+
+def ensurePartitions(session, start=None, months_ahead=2,
+                     tables=PARTITIONED_TABLES):
+    '''create monthly partitions from the month of start up to
+    months_ahead months later, plus the default partitions.
+
+    Args:
+        session: the SQLAlchemy database session.
+        start (date): first month to create. Today if None.
+        months_ahead (int): number of future months to create.
+        tables: names of the partitioned tables.
+    '''
+    if start is None:
+        start = date.today()
+    month = _monthStart(start)
+    for table in tables:
+        createDefaultPartition(session, table)
+        for i in range(months_ahead + 1):
+            createPartition(session, table, _addMonths(month, i))
+    session.commit()
+
+
+def listPartitions(session, table):
+    '''return the monthly partitions attached to table
+
+    Returns:
+        list of (partition name, first day of its month), sorted by month
+    '''
+    names = session.execute(
+        'SELECT c.relname FROM pg_inherits AS i '
+        'INNER JOIN pg_class AS c ON i.inhrelid = c.oid '
+        'INNER JOIN pg_class AS p ON i.inhparent = p.oid '
+        'WHERE p.relname = :table', {'table': table}).fetchall()
+    partitions = []
+    pattern = re.compile(re.escape(table) + r'_(\d{4})_(\d{2})$')
+    for name, in names:
+        match = pattern.match(name)
+        if match:
+            partitions.append(
+                (name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def detachOldPartitions(session, retention_months, now=None, drop=False,
+                        tables=PARTITIONED_TABLES):
+    '''Detach the partitions whose month ended more than retention_months
+    months ago.
+
+    Args:
+        session: the SQLAlchemy database session.
+        retention_months (int): number of complete months to keep attached
+                                (in addition to the current month).
+        now (date): reference date. Today if None.
+        drop (bool): drop the detached partitions instead of keeping them
+                     as standalone tables.
+        tables: names of the partitioned tables.
+
+    Returns:
+        list of names of the detached partitions
+    '''
+    if now is None:
+        now = date.today()
+    oldest_kept = _addMonths(_monthStart(now), -retention_months)
+    detached = []
+    for table in tables:
+        for name, month in listPartitions(session, table):
+            if month >= oldest_kept:
+                continue
+            session.execute(
+                'ALTER TABLE public."{0}" DETACH PARTITION public."{1}"'
+                .format(table, name))
+            if drop:
+                session.execute('DROP TABLE public."{0}"'.format(name))
+            detached.append(name)
+    session.commit()
+    return detached
+
+
+def rotatePartitions(session, now=None, months_ahead=2,
+                     retention_months=None):
+    '''create upcoming partitions and detach expired ones. Run this at
+    least once a month (the scraper runs it daily).
+
+    Args:
+        session: the SQLAlchemy database session.
+        now (date or datetime): reference date. Today if None.
+        months_ahead (int): number of future months to create.
+        retention_months (int): see detachOldPartitions.
+                                Keep all partitions if None.
+
+    Returns:
+        list of names of the detached partitions
+    '''
+    if now is None:
+        now = date.today()
+    if isinstance(now, datetime):
+        now = now.date()
+    ensurePartitions(session, now, months_ahead)
+    if retention_months is None:
+        return []
+    return detachOldPartitions(session, retention_months, now)
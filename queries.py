@@ -0,0 +1,177 @@
+'''Registry of the analytical queries in sql_queries/.
+
+The SQL files use named bind parameters (e.g. :origin_id). Each file is
+read from disk once, the first time its query is used. On Postgres every
+query is PREPAREd once per database connection and afterwards run with
+EXECUTE, so the server parses it only once per connection and can reuse
+its plan. Other databases execute the SQL text directly.
+
+Results come back as pandas DataFrames (PreparedQuery.frame) or as a dict
+of NumPy columns (PreparedQuery.columns). frame and columns also run the
+queries on a DuckDBSource (see duckdb_backend.py).
+'''
+
+import re
+from pkgutil import get_data
+from sqlalchemy import text
+from mtatracking_v2.duckdb_backend import DuckDBSource
+from mtatracking_v2.db import resultFrame
+
+# matches :name, but not the :: of casts
+_BIND_PARAM = re.compile(r'(?<![:\w]):(\w+)(?!:)')
+_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+
+
+class PreparedQuery:
+    """A query from sql_queries/ with typed, named parameters."""
+
+    def __init__(self, name, filename, params):
+        '''Create a PreparedQuery
+
+        Args:
+            name (string): name of the prepared statement
+            filename (string): file in sql_queries/
+            params (list of (string, string)): names of the bind parameters
+                and their Postgres types, in the order of the prepared
+                statement's arguments.
+        '''
+        self.name = name
+        self.filename = filename
+        self.params = params
+        self._sql = None
+        self._prepare_sql = None
+        self._duckdb_sql = None
+
+    @property
+    def sql(self):
+        '''SQL text with named bind parameters'''
+        if self._sql is None:
+            self._sql = get_data(
+                'mtatracking_v2',
+                'sql_queries/' + self.filename).decode("utf-8")
+        return self._sql
+
+    def _prepareStatement(self):
+        '''PREPARE statement of this query, with positional parameters'''
+        if self._prepare_sql is None:
+            positions = {name: i + 1 for i, (name, _) in
+                         enumerate(self.params)}
+
+            def positional(match):
+                return '$' + str(positions[match.group(1)])
+
+            # comments may contain colons that are not parameters
+            body = _BIND_PARAM.sub(positional, _COMMENT.sub('', self.sql))
+            self._prepare_sql = 'PREPARE {0} ({1}) AS {2}'.format(
+                self.name, ', '.join(t for _, t in self.params), body)
+        return self._prepare_sql
+
+    def _duckdbStatement(self):
+        '''the query with DuckDB's $name parameters'''
+        if self._duckdb_sql is None:
+            self._duckdb_sql = _BIND_PARAM.sub(
+                lambda match: '$' + match.group(1),
+                _COMMENT.sub('', self.sql))
+        return self._duckdb_sql
+
+    def _bindParams(self, params):
+        missing = [name for name, _ in self.params if name not in params]
+        if missing:
+            raise TypeError(self.name + ' is missing parameters: '
+                            + ', '.join(missing))
+        return {name: params[name] for name, _ in self.params}
+
+    def execute(self, session, **params):
+        '''run the query
+
+        Args:
+            session: the SQLAlchemy database session.
+            params: values of the bind parameters
+
+        Returns:
+            SQLAlchemy result
+        '''
+        params = self._bindParams(params)
+        connection = session.connection()
+        if connection.dialect.name != 'postgresql':
+            return connection.execute(text(self.sql), params)
+        # Connection.info lives as long as the DBAPI connection,
+        # and so do prepared statements.
+        prepared = connection.info.setdefault('prepared_queries', set())
+        if self.name not in prepared:
+            connection.execute(text(self._prepareStatement()))
+            prepared.add(self.name)
+        arguments = ', '.join(':' + name for name, _ in self.params)
+        return connection.execute(
+            text('EXECUTE {0} ({1})'.format(self.name, arguments)), params)
+
+    def frame(self, session, **params):
+        '''run the query and return the result as a pandas DataFrame.
+        session can also be a DuckDBSource.'''
+        if isinstance(session, DuckDBSource):
+            return session.frame(self._duckdbStatement(),
+                                 self._bindParams(params))
+        return resultFrame(self.execute(session, **params))
+
+    def columns(self, session, **params):
+        '''run the query and return the result as a dict of
+        column name: numpy array'''
+        df = self.frame(session, **params)
+        return {column: df[column].to_numpy() for column in df.columns}
+
+
+_TRANSIT_TIME_PARAMS = [('origin_id', 'text'), ('dest_id', 'text'),
+                        ('line_id', 'text'), ('time_start', 'timestamp'),
+                        ('time_end', 'timestamp')]
+
+QUERIES = {q.name: q for q in [
+    PreparedQuery('transit_times', 'transit_times.sql',
+                  _TRANSIT_TIME_PARAMS),
+    PreparedQuery('transit_times_and_delay', 'transit_times_and_delay.sql',
+                  _TRANSIT_TIME_PARAMS),
+    PreparedQuery('segment_transit_times', 'segment_transit_times.sql',
+                  _TRANSIT_TIME_PARAMS),
+    PreparedQuery('all_segment_transit_times',
+                  'all_segment_transit_times.sql',
+                  [('time_start', 'timestamp'), ('time_end', 'timestamp'),
+                   ('line_id', 'text')]),
+    PreparedQuery('rebuild_segment_transit_times',
+                  'rebuild_segment_transit_times.sql',
+                  [('time_start', 'timestamp'), ('time_end', 'timestamp')]),
+    PreparedQuery('refresh_hourly_rollups', 'refresh_hourly_rollups.sql',
+                  [('time_start', 'timestamp'), ('time_end', 'timestamp')]),
+    PreparedQuery('hourly_rollups', 'hourly_rollups.sql',
+                  [('line_id', 'text'), ('direction', 'text'),
+                   ('time_start', 'timestamp'), ('time_end', 'timestamp')]),
+    PreparedQuery('featurematrix_transitTime',
+                  'featurematrix_transitTime.sql',
+                  [('origin_id', 'text'), ('dest_id', 'text'),
+                   ('line_id', 'text'), ('direction', 'text'),
+                   ('time_start', 'timestamp'), ('time_end', 'timestamp'),
+                   ('feature_line_id', 'text'),
+                   ('feature_direction', 'text'),
+                   ('linedef_hour', 'integer'), ('linedef_day', 'text')]),
+    PreparedQuery('features_now', 'features_now.sql',
+                  [('line_id', 'text'), ('direction', 'text'),
+                   ('linedef_hour', 'integer'), ('linedef_day', 'text')]),
+    PreparedQuery('mta_predicted_transit_time',
+                  'mta_predicted_transit_time.sql',
+                  [('train_unique_num', 'text'), ('origin_id', 'text'),
+                   ('dest_id', 'text')]),
+    PreparedQuery('MTApredictionNow', 'MTApredictionNow.sql',
+                  [('line_id', 'text'), ('direction', 'text'),
+                   ('origin_id', 'text'), ('dest_id', 'text')]),
+    PreparedQuery('retrieve_ordered_stations',
+                  'retrieve_ordered_stations.sql',
+                  [('line_id', 'text'), ('direction', 'text'),
+                   ('linedef_day', 'text'), ('linedef_hour', 'integer')]),
+    PreparedQuery('stations_in_line_unordered',
+                  'stations_in_line_unordered.sql',
+                  [('line_id', 'text'), ('direction', 'text'),
+                   ('time_start', 'timestamp'), ('time_end', 'timestamp')])
+]}
+
+
+def getQuery(name):
+    '''return the PreparedQuery called name (see QUERIES)'''
+    return QUERIES[name]
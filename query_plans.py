@@ -0,0 +1,120 @@
+'''Check the query plans of the hot analytical queries.
+
+The queries in sql_queries/ and the fit lookup of getMedianTravelTime are
+only fast if they can use the indexes declared in models.py (see
+migrations/0001_hot_query_indexes.sql). checkQueryPlans runs EXPLAIN on
+each of them and flags sequential scans of the large tables.
+'''
+
+import json
+import re
+from sqlalchemy import text
+from mtatracking_v2.queries import getQuery
+
+# sequential scans of these tables are a problem. Small tables such as
+# Stop, Line, and Line_stops are fine to scan.
+HOT_TABLES = ('Trains_stopped', 'Trip_update', 'Stop_time_update',
+              'Transit_time_fit', 'Mean_transit_time',
+              'Segment_transit_time')
+
+_FIT_LOOKUP_SQL = '''SELECT * FROM public."Transit_time_fit"
+WHERE line_id = :line_id AND stop_id_origin = :origin_id
+AND stop_id_destination = :dest_id
+ORDER BY fit_end_datetime DESC
+LIMIT 1'''
+
+
+def explain(sql, session, params=None):
+    '''Return the (json) query plan of sql, with bind parameters params'''
+    res = session.execute(
+        text('EXPLAIN (FORMAT JSON) ' + sql), params or {}).fetchall()
+    plan = res[0][0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def _parentTable(relation):
+    '''name of the partitioned table that relation is a partition of
+    (e.g. Trains_stopped for Trains_stopped_2020_01). relation itself if it
+    is not a partition.'''
+    if relation is None:
+        return None
+    return re.sub(r'_(\d{4}_\d{2}|default)$', '', relation)
+
+
+def sequentialScans(plan, tables=HOT_TABLES):
+    '''find the sequential scans of tables in a query plan
+
+    Args:
+        plan (dict): query plan as returned by explain()
+        tables (tuple of string): names of the tables we care about
+
+    Returns:
+        list of table names that are scanned sequentially
+    '''
+    scans = []
+    if plan.get('Node Type') == 'Seq Scan'\
+            and _parentTable(plan.get('Relation Name')) in tables:
+        scans.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        scans.extend(sequentialScans(child, tables))
+    return scans
+
+
+def hotQueries(origin_id, dest_id, line_id, direction, time_start,
+               time_end, train_unique_num, linedef_hour=8,
+               linedef_day='Weekday'):
+    '''the hot analytical queries, filled in with example parameters
+
+    Returns:
+        dict of query name: (sql, bind parameters)
+    '''
+    params = {'origin_id': origin_id, 'dest_id': dest_id,
+              'line_id': line_id, 'direction': direction,
+              'time_start': time_start, 'time_end': time_end,
+              'feature_line_id': line_id, 'feature_direction': direction,
+              'linedef_hour': linedef_hour, 'linedef_day': linedef_day,
+              'train_unique_num': train_unique_num}
+    queries = {}
+    for name in ['transit_times', 'segment_transit_times',
+                 'featurematrix_transitTime', 'mta_predicted_transit_time']:
+        query = getQuery(name)
+        queries[name] = (query.sql,
+                         {p: params[p] for p, _ in query.params})
+    queries['getMedianTravelTime'] = (_FIT_LOOKUP_SQL, params)
+    return queries
+
+
+def checkQueryPlans(session, origin_id, dest_id, line_id, direction,
+                    time_start, time_end, train_unique_num,
+                    linedef_hour=8, linedef_day='Weekday'):
+    '''EXPLAIN the hot queries and flag sequential scans on large tables.
+    Pick parameters that occur in the database (the planner may choose
+    differently for values it has never seen).
+
+    Args:
+        session: the SQLAlchemy database session.
+        origin_id, dest_id (string): adjacent stations of line_id
+        line_id (string): id of the subway line, for example 'Q'
+        direction (string): 'N' or 'S'
+        time_start, time_end (datetime): time window of the queries
+        train_unique_num (string): a train that traveled from origin_id
+                                   to dest_id
+        linedef_hour (int), linedef_day (string): line definition to use
+                                                  for the feature matrix
+
+    Returns:
+        dict of query name: list of sequentially scanned tables.
+        Empty lists mean the query only uses index scans on hot tables.
+    '''
+    results = {}
+    for name, (sql, params) in hotQueries(
+            origin_id, dest_id, line_id, direction, time_start, time_end,
+            train_unique_num, linedef_hour, linedef_day).items():
+        scans = sequentialScans(explain(sql, session, params))
+        if scans:
+            print('warning: ' + name + ' scans ' + ', '.join(scans)
+                  + ' sequentially')
+        results[name] = scans
+    return results
@@ -0,0 +1,119 @@
+'''Transit times of trains between consecutive stops.
+
+The Segment_transit_time table holds one row per pair of consecutive stops
+of a train during one trip: line, direction, origin and destination stop,
+departure from the origin, arrival at the destination and the transit time
+in seconds. The scraper appends a row whenever it records a Trains_stopped
+row (SubwaySystem._trainStoppedRow), so STaSI fits can read the transit
+times of a segment with an index range scan instead of matching the stops
+of every train in Trains_stopped.
+
+rebuildSegmentTransitTimes recomputes the table from Trains_stopped, e.g.
+after Trains_stopped was loaded by bulkUpdate.py, or after the scraper was
+stopped for a while.
+
+The Segment_hourly_rollup table holds hourly statistics of every segment
+(number of trains, median and percentiles of the transit times, number of
+delayed trains and their mean delay magnitude). refreshHourlyRollups keeps
+it current: the scraper calls it once an hour and it only recomputes the
+hours since its last run. Dashboards and long-range analyses read the
+rollups with getHourlyRollups instead of the raw stop events.
+'''
+
+import sys
+from datetime import datetime, timedelta
+from mtatracking_v2.queries import getQuery
+from mtatracking_v2.db import makeSessionFactory
+
+
+def rebuildSegmentTransitTimes(session, time_start=None, time_end=None):
+    '''Replace the rows of Segment_transit_time with an arrival time
+    between time_start and time_end by rows computed from Trains_stopped.
+
+    Args:
+        session: the SQLAlchemy database session.
+        time_start (datetime): rebuild from here. All of the history if None.
+        time_end (datetime): rebuild up to here. Up to now if None.
+
+    Returns:
+        number of rows inserted
+    '''
+    if time_start is None:
+        time_start = datetime(1970, 1, 1)
+    if time_end is None:
+        time_end = datetime.now() + timedelta(days=1)
+    session.execute(
+        'DELETE FROM public."Segment_transit_time" '
+        'WHERE arrival_time > :time_start AND arrival_time < :time_end',
+        {'time_start': time_start, 'time_end': time_end})
+    result = getQuery('rebuild_segment_transit_times').execute(
+        session, time_start=time_start, time_end=time_end)
+    session.commit()
+    return result.rowcount
+
+
+def refreshHourlyRollups(session, now=None, lookback=timedelta(hours=1)):
+    '''Recompute the hourly rollups from the latest hour in
+    Segment_hourly_rollup (minus lookback) up to now. The latest hour is
+    usually incomplete, so it is always recomputed. If the table is empty,
+    compute the rollups of all of Trains_stopped.
+
+    Args:
+        session: the SQLAlchemy database session.
+        now (datetime): end of the refresh. Now if None.
+        lookback (timedelta): also recompute this much time before the
+                              latest hour, for stops that were written late.
+
+    Returns:
+        number of rollup rows written
+    '''
+    if now is None:
+        now = datetime.now()
+    latest, = session.execute(
+        'SELECT MAX(hour) FROM public."Segment_hourly_rollup"').fetchone()
+    if latest is None:
+        time_start = datetime(1970, 1, 1)
+    else:
+        time_start = latest - lookback
+    time_start = time_start.replace(minute=0, second=0, microsecond=0)
+    time_end = now.replace(minute=0, second=0, microsecond=0)\
+        + timedelta(hours=1)
+    session.execute(
+        'DELETE FROM public."Segment_hourly_rollup" '
+        'WHERE hour >= :time_start AND hour < :time_end',
+        {'time_start': time_start, 'time_end': time_end})
+    result = getQuery('refresh_hourly_rollups').execute(
+        session, time_start=time_start, time_end=time_end)
+    session.commit()
+    return result.rowcount
+
+
+def getHourlyRollups(line_id, direction, time_start, time_end, session):
+    '''Get the hourly rollups of all segments of a line.
+
+    Args:
+        line_id (string): id of the subway line, for example 'Q'
+        direction (string): 'N' or 'S'
+        time_start (datetime): first hour
+        time_end (datetime): end of the last hour
+        session: the SQLAlchemy database session.
+
+    Returns:
+        pd.DataFrame with columns stop_id_origin, stop_id_destination,
+        hour, n_trains, median_seconds, p25_seconds, p75_seconds,
+        p90_seconds, n_delayed, mean_delayed_magnitude
+    '''
+    return getQuery('hourly_rollups').frame(
+        session, line_id=line_id, direction=direction,
+        time_start=time_start, time_end=time_end)
+
+
+if __name__ == '__main__':
+    print("Enter database name: ")
+    name = sys.stdin.readline()
+    Session = makeSessionFactory(name)
+    session = Session()
+    inserted = rebuildSegmentTransitTimes(session)
+    print('rebuilt ' + str(inserted) + ' segments')
+    refreshed = refreshHourlyRollups(session)
+    print('refreshed ' + str(refreshed) + ' hourly rollups')
@@ -1,26 +1,30 @@
-/*
+/* parameters:
 line_id
 direction
 origin_id
-destination_id
+dest_id
  */
 
 WITH trains_in_sys AS (
-SELECT * FROM public."Train" As t
-INNER JOIN public."Trip_update" AS tu ON t.unique_num = tu.train_unique_num
-WHERE is_in_system_now = True AND tu.line_id = '{0}' AND tu.direction = '{1}'
+SELECT tu.id, t.unique_num FROM public."Train" As t
+INNER JOIN public."Trip_update" AS tu ON t.id = tu.train_id
+WHERE is_in_system_now = True AND tu.line_id = :line_id AND tu.direction = :direction
 ),
 
 stu_my_station AS (
 SELECT * FROM public."Stop_time_update" AS stu
 INNER JOIN trains_in_sys ON trains_in_sys.id = stu.trip_update_id
-WHERE stu.stop_id = '{2}'
+WHERE stu.stop_id = :origin_id
+/* only read the latest partition(s) of Stop_time_update */
+AND stu.effective_timestamp > NOW() - interval '1 day'
 ),
 
 stu_destination_station AS (
 SELECT unique_num, stu.effective_timestamp, arrival_time FROM public."Stop_time_update" AS stu
 INNER JOIN trains_in_sys ON trains_in_sys.id = stu.trip_update_id
-WHERE stu.stop_id = '{3}'
+WHERE stu.stop_id = :dest_id
+/* only read the latest partition(s) of Stop_time_update */
+AND stu.effective_timestamp > NOW() - interval '1 day'
 ),
 
 closest_train AS (
@@ -0,0 +1,26 @@
+SELECT s.line_id, s.direction, s.stop_id_origin, s.stop_id_destination,
+	t.unique_num, s.stop_time, s.transit_time
+FROM (SELECT ts.train_id, tu.line_id, tu.direction,
+		LAG(ts.stop_id) OVER w AS stop_id_origin,
+		ts.stop_id AS stop_id_destination,
+		ts.stop_time,
+		ts.stop_time - LAG(ts.stop_time) OVER w AS transit_time
+	FROM public."Trains_stopped" AS ts
+		INNER JOIN public."Trip_update" AS tu
+		ON ts.trip_update_id = tu.id
+	WHERE ts.stop_time > CAST(:time_start AS timestamp) - interval '1 day'
+	AND ts.stop_time < :time_end
+	AND (CAST(:line_id AS text) IS NULL OR tu.line_id = :line_id)
+	WINDOW w AS (PARTITION BY ts.train_id, ts.trip_update_id
+				 ORDER BY ts.stop_time)
+	) AS s
+	INNER JOIN public."Train" AS t
+	ON t.id = s.train_id
+WHERE s.stop_id_origin IS NOT NULL
+	AND s.stop_id_origin <> s.stop_id_destination
+	AND s.stop_time > :time_start
+ORDER BY s.line_id, s.direction, s.stop_id_origin, s.stop_id_destination,
+	s.stop_time
+	/* transit times of all adjacent segments in one pass over the partitions
+	of Trains_stopped in the time window. Same segments as
+	rebuild_segment_transit_times.sql. :line_id NULL means all lines. */
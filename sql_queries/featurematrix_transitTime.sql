@@ -3,24 +3,24 @@ our origin station within a specified time window*/
 
 WITH ts_filtered AS (
 SELECT * FROM public."Trains_stopped" AS ts
-WHERE '{4}' < stop_time AND '{5}' > stop_time
+WHERE :time_start < stop_time AND :time_end > stop_time
 ),
 
 origin AS (
-SELECT ts.train_unique_num, MAX(stop_time) as origin_time
+SELECT ts.train_id, MAX(stop_time) as origin_time
 FROM ts_filtered AS ts
 INNER JOIN public."Trip_update" AS tu ON ts.trip_update_id = tu.id
-GROUP BY ts.train_unique_num, tu.line_id, tu.direction, ts.stop_id
-HAVING tu.line_id = '{2}' AND tu.direction = '{3}' AND ts.stop_id = '{0}'
+GROUP BY ts.train_id, tu.line_id, tu.direction, ts.stop_id
+HAVING tu.line_id = :line_id AND tu.direction = :direction AND ts.stop_id = :origin_id
 ORDER BY origin_time
 ),
 
 destination AS (
-SELECT ts.train_unique_num, MAX(stop_time) as destination_time
+SELECT ts.train_id, MAX(stop_time) as destination_time
 FROM ts_filtered AS ts
 INNER JOIN public."Trip_update" AS tu ON ts.trip_update_id = tu.id
-GROUP BY ts.train_unique_num, tu.line_id, tu.direction, ts.stop_id
-HAVING tu.line_id = '{2}' AND tu.direction = '{3}' AND ts.stop_id = '{1}'
+GROUP BY ts.train_id, tu.line_id, tu.direction, ts.stop_id
+HAVING tu.line_id = :line_id AND tu.direction = :direction AND ts.stop_id = :dest_id
 ORDER BY destination_time
 ),
 
@@ -28,8 +28,8 @@ stops_this_line AS (
 SELECT stop_id
 FROM public."Line" as l INNER JOIN public."Line_stops" As ls
 ON l.id = ls.line_id
-WHERE l.name = '{6}' AND l.direction = '{7}'
-AND from_hour < '{8}' and to_hour >= '{8}' AND day='{9}'
+WHERE l.name = :feature_line_id AND l.direction = :feature_direction
+AND from_hour < :linedef_hour and to_hour >= :linedef_hour AND day=:linedef_day
 ORDER BY ls.sequence
 ),
 
@@ -40,22 +40,24 @@ SELECT stop_id, tu.id, MAX(stop_time) as stop_time, delayed_magnitude
 FROM ts_filtered AS ts 
 INNER JOIN public."Trip_update" AS tu ON ts.trip_update_id = tu.id
 GROUP BY stop_id, tu.id, delayed_magnitude, tu.line_id, tu.direction
-HAVING tu.line_id = '{6}' AND tu.direction = '{7}' AND ts.stop_id IN (SELECT stop_id FROM stops_this_line)
+HAVING tu.line_id = :feature_line_id AND tu.direction = :feature_direction AND ts.stop_id IN (SELECT stop_id FROM stops_this_line)
 ORDER BY ts.stop_id
 ),
 
 all_combinations AS (
-SELECT stl.stop_id, o.train_unique_num, o.origin_time, o.origin_time - stl.stop_time AS odiff, stl.delayed_magnitude
+SELECT stl.stop_id, o.train_id, o.origin_time, o.origin_time - stl.stop_time AS odiff, stl.delayed_magnitude
 FROM all_stopped_trains_this_line AS stl CROSS JOIN origin AS o
-WHERE o.origin_time - stl.stop_time > interval '0'
+WHERE o.origin_time - stl.stop_time > interval '0 seconds'
 ),
 
 res AS (
-SELECT DISTINCT ON (origin_time, stop_id) origin_time, train_unique_num, stop_id, odiff, delayed_magnitude
+SELECT DISTINCT ON (origin_time, stop_id) origin_time, train_id, stop_id, odiff, delayed_magnitude
 FROM all_combinations
 ORDER BY origin_time DESC, stop_id, odiff, delayed_magnitude DESC
 )
 
-SELECT DISTINCT res.*, destination.destination_time as arrival_time, destination.destination_time - res.origin_time as transit_time
-FROM res INNER JOIN destination ON res.train_unique_num = destination.train_unique_num
+SELECT DISTINCT res.origin_time, t.unique_num AS train_unique_num, res.stop_id, res.odiff, res.delayed_magnitude,
+destination.destination_time as arrival_time, destination.destination_time - res.origin_time as transit_time
+FROM res INNER JOIN destination ON res.train_id = destination.train_id
+INNER JOIN public."Train" AS t ON t.id = res.train_id
 ORDER BY res.origin_time ASC
\ No newline at end of file
@@ -1,11 +1,10 @@
 /* we want to create one entry for every train that leaves
 our origin station within a specified time window
+parameters:
                     line_id,
                     direction,
                     linedef_hour,
-                    linedef_day,
-                    f_line_id,
-                    f_direction
+                    linedef_day
 */
 
 WITH ts_filtered AS (
@@ -17,8 +16,8 @@ stops_this_line AS (
 SELECT stop_id
 FROM public."Line" as l INNER JOIN public."Line_stops" As ls
 ON l.id = ls.line_id
-WHERE l.name = '{0}' AND l.direction = '{1}'
-AND from_hour < '{2}' and to_hour >= '{2}' AND day='{3}'
+WHERE l.name = :line_id AND l.direction = :direction
+AND from_hour < :linedef_hour and to_hour >= :linedef_hour AND day=:linedef_day
 ORDER BY ls.sequence
 ),
 
@@ -29,7 +28,7 @@ SELECT stop_id, tu.id, MAX(stop_time) as stop_time, delayed_magnitude
 FROM ts_filtered AS ts 
 INNER JOIN public."Trip_update" AS tu ON ts.trip_update_id = tu.id
 GROUP BY stop_id, tu.id, delayed_magnitude, tu.line_id, tu.direction
-HAVING tu.line_id = '{0}' AND tu.direction = '{1}' AND ts.stop_id IN (SELECT stop_id FROM stops_this_line)
+HAVING tu.line_id = :line_id AND tu.direction = :direction AND ts.stop_id IN (SELECT stop_id FROM stops_this_line)
 ORDER BY ts.stop_id
 ),
 
@@ -0,0 +1,9 @@
+SELECT stop_id_origin, stop_id_destination, hour, n_trains, median_seconds,
+	p25_seconds, p75_seconds, p90_seconds, n_delayed,
+	mean_delayed_magnitude
+FROM public."Segment_hourly_rollup"
+WHERE line_id = :line_id
+	AND direction = :direction
+	AND hour >= :time_start
+	AND hour < :time_end
+ORDER BY stop_id_origin, stop_id_destination, hour
@@ -1,24 +1,37 @@
 
-/* make sure you indexed trip_update_id and stop_id in Stop_time_update, or this will take forever. */
-/* variables to be passed into this:
-{0}: train_unique_num
-{1}: origin stop_id
-{2}: destination stop_id
+/* needs the (trip_update_id, stop_id) index on Stop_time_update, or this will take forever.
+Run migrate.py on databases created before that index existed. */
+/* parameters:
+train_unique_num
+origin_id: origin stop_id
+dest_id: destination stop_id
 
 */
-WITH origin_time AS (SELECT max(stop_time) as origin_time FROM public."Trains_stopped"
-WHERE train_unique_num = '{0}' and stop_id = '{1}'
+/* unique_num starts with the date the trip started (YYYYMMDD). Bounding the
+timestamps around that date lets Postgres skip the other monthly partitions
+of Trains_stopped and Stop_time_update. */
+WITH train AS (SELECT id FROM public."Train" WHERE unique_num = :train_unique_num
+),
+
+origin_time AS (SELECT max(stop_time) as origin_time FROM public."Trains_stopped"
+WHERE train_id = (SELECT id FROM train) and stop_id = :origin_id
+AND stop_time > to_date(left(:train_unique_num, 8), 'YYYYMMDD') - interval '1 day'
+AND stop_time < to_date(left(:train_unique_num, 8), 'YYYYMMDD') + interval '2 days'
 ),
 
 best_time_diff AS (
 SELECT min(abs(stu.effective_timestamp - (SELECT * FROM origin_time))) as td
 FROM public."Trip_update" as tu
 INNER JOIN public."Stop_time_update"as stu ON stu.trip_update_id = tu.id
-WHERE tu.train_unique_num = '{0}' and stop_id = '{2}'
+WHERE tu.train_id = (SELECT id FROM train) and stop_id = :dest_id
+AND stu.effective_timestamp > to_date(left(:train_unique_num, 8), 'YYYYMMDD') - interval '1 day'
+AND stu.effective_timestamp < to_date(left(:train_unique_num, 8), 'YYYYMMDD') + interval '2 days'
 )
 
 SELECT stu.arrival_time as MTA_predicted_arr_time, (SELECT * FROM origin_time) as origin_time, stu.arrival_time - origin_time as MTA_predicted_transit_time
 FROM public."Trip_update" as tu
 INNER JOIN public."Stop_time_update"as stu ON stu.trip_update_id = tu.id
-WHERE tu.train_unique_num = '{0}' and stop_id = '{2}'
+WHERE tu.train_id = (SELECT id FROM train) and stop_id = :dest_id
+AND stu.effective_timestamp > to_date(left(:train_unique_num, 8), 'YYYYMMDD') - interval '1 day'
+AND stu.effective_timestamp < to_date(left(:train_unique_num, 8), 'YYYYMMDD') + interval '2 days'
 AND abs(stu.effective_timestamp - (SELECT * FROM origin_time))  = (SELECT * FROM best_time_diff)
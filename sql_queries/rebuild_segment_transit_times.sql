@@ -0,0 +1,27 @@
+INSERT INTO public."Segment_transit_time" (train_id, trip_update_id, line_id,
+	direction, stop_id_origin, stop_id_destination, origin_time, arrival_time,
+	transit_seconds)
+SELECT train_id, trip_update_id, line_id, direction, stop_id_origin,
+	stop_id_destination, origin_time, arrival_time,
+	EXTRACT(EPOCH FROM arrival_time - origin_time)
+FROM (SELECT ts.train_id, ts.trip_update_id, tu.line_id, tu.direction,
+		LAG(ts.stop_id) OVER w AS stop_id_origin,
+		ts.stop_id AS stop_id_destination,
+		LAG(ts.stop_time) OVER w AS origin_time,
+		ts.stop_time AS arrival_time
+	FROM public."Trains_stopped" AS ts
+		INNER JOIN public."Trip_update" AS tu
+		ON ts.trip_update_id = tu.id
+	WHERE ts.stop_time > CAST(:time_start AS timestamp) - interval '1 day'
+	AND ts.stop_time < :time_end
+	WINDOW w AS (PARTITION BY ts.train_id, ts.trip_update_id
+				 ORDER BY ts.stop_time)
+	) AS segments
+WHERE stop_id_origin IS NOT NULL
+	AND stop_id_origin <> stop_id_destination
+	AND arrival_time > :time_start
+	/* a segment is a pair of consecutive stops of a train during one trip,
+	as recorded by SubwaySystem._trainStoppedRow during ingest.
+	The stops of the day before the window provide the origins of the first
+	arrivals in the window. Repeated stops at the same station (a glitch in
+	the feed) do not make a segment. */
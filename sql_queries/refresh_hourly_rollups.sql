@@ -0,0 +1,36 @@
+INSERT INTO public."Segment_hourly_rollup" (line_id, direction,
+	stop_id_origin, stop_id_destination, hour, n_trains, median_seconds,
+	p25_seconds, p75_seconds, p90_seconds, n_delayed,
+	mean_delayed_magnitude)
+SELECT line_id, direction, stop_id_origin, stop_id_destination,
+	date_trunc('hour', stop_time) AS hour,
+	COUNT(*),
+	percentile_cont(0.5) WITHIN GROUP (ORDER BY transit_seconds),
+	percentile_cont(0.25) WITHIN GROUP (ORDER BY transit_seconds),
+	percentile_cont(0.75) WITHIN GROUP (ORDER BY transit_seconds),
+	percentile_cont(0.9) WITHIN GROUP (ORDER BY transit_seconds),
+	COUNT(*) FILTER (WHERE delayed),
+	AVG(delayed_magnitude)
+FROM (SELECT tu.line_id, tu.direction,
+		LAG(ts.stop_id) OVER w AS stop_id_origin,
+		ts.stop_id AS stop_id_destination,
+		ts.stop_time,
+		EXTRACT(EPOCH FROM ts.stop_time - LAG(ts.stop_time) OVER w)
+			AS transit_seconds,
+		ts.delayed, ts.delayed_magnitude
+	FROM public."Trains_stopped" AS ts
+		INNER JOIN public."Trip_update" AS tu
+		ON ts.trip_update_id = tu.id
+	WHERE ts.stop_time > CAST(:time_start AS timestamp) - interval '1 day'
+	AND ts.stop_time < :time_end
+	WINDOW w AS (PARTITION BY ts.train_id, ts.trip_update_id
+				 ORDER BY ts.stop_time)
+	) AS s
+WHERE stop_id_origin IS NOT NULL
+	AND stop_id_origin <> stop_id_destination
+	AND stop_time >= :time_start
+GROUP BY line_id, direction, stop_id_origin, stop_id_destination,
+	date_trunc('hour', stop_time)
+	/* hourly statistics of the segments of all_segment_transit_times.sql.
+	The delay columns of Trains_stopped belong to the arrival at the
+	destination, i.e. to the segment. :time_start should be a full hour. */
@@ -1,16 +1,17 @@
-/* 
-0: name
-1: direction
-2: day
-3: hour of day
+/* stops of the latest definition of a line, in order
+parameters:
+                    line_id,
+                    direction,
+                    linedef_day,
+                    linedef_hour
 */
 WITH latest_def AS (
 SELECT max(id) as id FROM public."Line"
 GROUP BY name, direction
-HAVING name = '{0}' AND direction = '{1}'
+HAVING name = :line_id AND direction = :direction
 )
 
 SELECT stop_id
 FROM public."Line_stops" AS ls INNER JOIN latest_def AS ld ON ls.line_id = ld.id
-WHERE day = '{2}' and from_hour < '{3}' AND '{3}' < to_hour
+WHERE day = :linedef_day and from_hour < :linedef_hour AND :linedef_hour < to_hour
 ORDER BY sequence ASC
\ No newline at end of file
@@ -0,0 +1,14 @@
+SELECT t.unique_num, s.arrival_time AS stop_time,
+	(s.arrival_time - s.origin_time) AS transit_time
+FROM public."Segment_transit_time" AS s
+	INNER JOIN public."Train" AS t
+	ON t.id = s.train_id
+WHERE s.line_id = :line_id
+	AND s.stop_id_origin = :origin_id
+	AND s.stop_id_destination = :dest_id
+	AND s.arrival_time > :time_start
+	AND s.arrival_time < :time_end
+ORDER BY s.arrival_time
+	/* same columns as transit_times.sql, read from the precomputed segments
+	with a range scan of ix_Segment_transit_time_line_origin_destination_arrival.
+	Only holds consecutive stops of a trip (see segment_transit_times.py). */
@@ -2,9 +2,9 @@
 WITH cnts as (
 SELECT ts.stop_id, COUNT(t.unique_num) as cnt
 FROM public."Trains_stopped" AS ts
-JOIN public."Train" AS t on (ts.train_unique_num = t.unique_num)
-    JOIN public."Trip_update" as tup ON (tup.train_unique_num = t.unique_num)
-WHERE t.route_id = '{0}' AND tup.direction = '{1}' AND ts.stop_time > '{2}' AND ts.stop_time < '{3}'
+JOIN public."Train" AS t on (ts.train_id = t.id)
+    JOIN public."Trip_update" as tup ON (tup.train_id = t.id)
+WHERE t.route_id = :line_id AND tup.direction = :direction AND ts.stop_time > :time_start AND ts.stop_time < :time_end
 GROUP BY ts.stop_id
 ),
 /* plan: find the intersection of all trains that visited these
@@ -29,8 +29,8 @@ SELECT stop_id FROM filtered_stations
 ourTrains as (
 SELECT t.unique_num, ts.stop_id
 FROM public."Trains_stopped" AS ts
-JOIN public."Train" AS t on (ts.train_unique_num = t.unique_num)
-    JOIN public."Trip_update" as tup ON (tup.train_unique_num = t.unique_num)
+JOIN public."Train" AS t on (ts.train_id = t.id)
+    JOIN public."Trip_update" as tup ON (tup.train_id = t.id)
 WHERE t.route_id = '2' AND tup.direction = 'N'
 )
 
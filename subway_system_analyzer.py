@@ -15,7 +15,9 @@ from models import (
 )
 from mean_transit_times import (
     getTransitTimes,
+    getAllSegmentTransitTimes,
     computeMeanTransitTimes,
+    computeAllMeanTransitTimes,
     populate_database_with_fit_results
 )
 from sqlalchemy.orm.exc import NoResultFound
@@ -218,7 +220,8 @@ def findDelaysAndSetDelayedAttrib(time_start, time_end, session):
 class historicTrainDelays():
     '''finds train delays in historic data and can update database'''
 
-    def __init__(self, line_id, direction, time_start, time_end, session):
+    def __init__(self, line_id, direction, time_start, time_end, session,
+                 cache=None):
         '''create a historicTrainDelays instance.
         Args:
             line_id (string): id of the subway line, for example 'Q'
@@ -230,12 +233,16 @@ class historicTrainDelays():
             time_end (datetime): timepoint in the historic data at which to
                                     stop the computation
             session: the SQLAlchemy database session.
+            cache (fit_cache.FitCache): cache of fit results. Segments
+                                        whose transit times were fitted
+                                        before are not fitted again.
         '''
         self.line_id = line_id
         self.direction = direction
         self.time_start = time_start
         self.time_end = time_end
         self.session = session
+        self.cache = cache
 
         self.meansAndSdev_fit_dict = self.getHistoricMeansAndSdevs()
         self.trains = self.getTrains()
@@ -323,7 +330,8 @@ class historicTrainDelays():
                 orig.stop_id, dest.stop_id,
                 self.line_id, self.time_start, self.time_end, self.session)
             print('new fit, ' + orig.stop_id + ' to ' + dest.stop_id)
-            res, sdev = computeMeanTransitTimes(transit_times)
+            res, sdev = computeMeanTransitTimes(transit_times,
+                                                cache=self.cache)
             if res is None:
                 self.meansAndSdev_fit_dict[(orig.stop_id, dest.stop_id)] = None
                 return None, None
@@ -346,6 +354,36 @@ class historicTrainDelays():
                     sdev = mean_tt.sdev
         return median, sdev
 
+    def fitAllSegments(self, processes=None):
+        '''Fit all pairs of adjacent stations of the line that are not in
+        meansAndSdev_fit_dict yet, in parallel, and deposit the fits in the
+        database. getMedianTravelTime then only has to fit pairs of stops
+        that are not adjacent. Call this before checkAllTrainsInLine to
+        fit the segments of the line up front.
+
+        Args:
+            processes (int): number of worker processes.
+                             One per core if None.
+        '''
+        segments = getAllSegmentTransitTimes(
+            self.time_start, self.time_end, self.session, self.line_id)
+        segments = {
+            (orig_id, dest_id): transit_times
+            for (line, direction, orig_id, dest_id), transit_times
+            in segments.items()
+            if direction == self.direction
+            and (orig_id, dest_id) not in self.meansAndSdev_fit_dict}
+        results, errors = computeAllMeanTransitTimes(segments, processes,
+                                                     self.cache)
+        for key in errors:
+            self.meansAndSdev_fit_dict[key] = None
+        for (orig_id, dest_id), (res, sdev) in results.items():
+            self.meansAndSdev_fit_dict[(orig_id, dest_id)] = \
+                populate_database_with_fit_results(
+                    self.session, res, sdev, orig_id, dest_id,
+                    self.line_id, self.direction, self.time_start,
+                    self.time_end)
+
     def checkAllTrainsInLine(self, n=8, many_trains=True):
         print('numtrains to process: ', len(self.trains))
         for i, train in enumerate(self.trains):
@@ -26,6 +26,7 @@ app = Flask(__name__)
 
 session = initDB()
 data = getData(session)
+session.remove()
 mttv = MeanTransitTimes(data, def_line='Q', def_dir='N')
 mttv2 = MeanTransitTimes(data, def_line='4', def_dir='N')
 
@@ -72,6 +73,12 @@ def transit_time_prediction():
                            mta_prediction=mta_prediction)
 
 
+@app.teardown_appcontext
+def remove_session(exception=None):
+    # return this request's connection to the pool
+    session.remove()
+
+
 @app.route('/about', methods=['GET'])
 def about():
     return render_template("about.html.j2")